@@ -1,16 +1,84 @@
 from django.contrib import admin
+from django.template.defaultfilters import filesizeformat
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 from django.db import models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib import messages
-from django.core.exceptions import ValidationError
+from django.contrib.admin.utils import unquote
+from django.utils.encoding import force_str
+from django.utils.text import capfirst
+from django.core.exceptions import PermissionDenied, ValidationError
 from simple_history.admin import SimpleHistoryAdmin
 from import_export.admin import ImportExportModelAdmin
-from .models import Book, Review, Genre, UserProfile, Message, UserActivity
+from .models import Book, Review, Genre, UserProfile, Message, UserActivity, Job, DeadJob
+from .history_diff import history_page
+from .jobs import requeue_dead_jobs
+from .pagination import EstimatedCountPaginator
 from .resources import BookResource, ReviewResource, GenreResource, UserProfileResource, MessageResource
 
 
+class KeysetHistoryAdminMixin:
+    """История объекта в админке: страницы по history_date и сохраненные изменения полей"""
+    object_history_template = 'admin/books/keyset_object_history.html'
+    history_list_per_page = 50
+
+    def history_view(self, request, object_id, extra_context=None):
+        obj = self.get_object(request, unquote(object_id))
+        if obj is None:
+            # Удаленный объект - стандартная страница истории
+            return super().history_view(request, object_id, extra_context)
+        if not self.has_view_history_or_change_history_permission(request, obj):
+            raise PermissionDenied
+
+        history_list_display = getattr(self, 'history_list_display', [])
+        # Связанные объекты из колонок (например, owner) - в том же запросе
+        relations = {field.name for field in obj.history.model._meta.get_fields() if field.many_to_one}
+        history = obj.history.select_related(
+            'history_user', *[column for column in history_list_display if column in relations]
+        )
+        try:
+            action_list, next_cursor = history_page(history, request.GET.get('before'), self.history_list_per_page)
+        except ValueError:
+            # Неверный курсор - первая страница
+            action_list, next_cursor = history_page(history, None, self.history_list_per_page)
+
+        for column in history_list_display:
+            value_for_entry = getattr(self, column, None)
+            if value_for_entry and callable(value_for_entry):
+                for entry in action_list:
+                    setattr(entry, column, value_for_entry(entry))
+
+        opts = self.model._meta
+        context = {
+            'title': self.history_view_title(request, obj),
+            'action_list': action_list,
+            'next_cursor': next_cursor,
+            'is_first_page': not request.GET.get('before'),
+            'module_name': capfirst(force_str(opts.verbose_name_plural)),
+            'object': obj,
+            'app_label': opts.app_label,
+            'opts': opts,
+            'admin_user_view': 'admin:auth_user_change',
+            'history_list_display': history_list_display,
+            'revert_disabled': self.revert_disabled(request, obj),
+        }
+        context.update(self.admin_site.each_context(request))
+        context.update(extra_context or {})
+        request.current_app = self.admin_site.name
+        return self.render_history_view(request, self.object_history_template, context)
+
+
+def count_subquery(model, user_field):
+    """Число объектов model пользователя (для аннотации queryset профилей)"""
+    return Coalesce(Subquery(
+        model.objects.filter(**{user_field: OuterRef('user_id')})
+        .order_by().values(user_field).annotate(count=models.Count('pk')).values('count')
+    ), 0)
+
+
 class ReviewInline(admin.TabularInline):
     """Инлайн для отзывов в админке книг"""
     model = Review
@@ -26,6 +94,36 @@ class ReviewInline(admin.TabularInline):
     rating_stars.short_description = "Рейтинг"
 
 
+class FileSizeListFilter(admin.SimpleListFilter):
+    """Фильтр книг по размеру файла (колонка file_size)"""
+    title = 'Размер файла'
+    parameter_name = 'file_size'
+
+    MB = 1024 * 1024
+    RANGES = {
+        'small': ('До 1 МБ', 0, MB),
+        'medium': ('1-10 МБ', MB, 10 * MB),
+        'large': ('10-50 МБ', 10 * MB, 50 * MB),
+        'huge': ('Больше 50 МБ', 50 * MB, None),
+    }
+
+    def lookups(self, request, model_admin):
+        choices = [(key, label) for key, (label, _, _) in self.RANGES.items()]
+        return choices + [('unknown', 'Не вычислен')]
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value == 'unknown':
+            return queryset.exclude(book_file='').filter(file_size__isnull=True)
+        if value not in self.RANGES:
+            return queryset
+        _, low, high = self.RANGES[value]
+        queryset = queryset.filter(file_size__gte=low)
+        if high is not None:
+            queryset = queryset.filter(file_size__lt=high)
+        return queryset
+
+
 class MessageInline(admin.TabularInline):
     """Инлайн для сообщений в админке книг"""
     model = Message
@@ -90,7 +188,7 @@ class GenreAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
 
 
 @admin.register(Book)
-class BookAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
+class BookAdmin(KeysetHistoryAdminMixin, SimpleHistoryAdmin, ImportExportModelAdmin):
     """Админка для книг"""
     resource_class = BookResource
     
@@ -98,12 +196,13 @@ class BookAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
     list_display = [
         'title', 'author', 'owner_link', 'genres_display', 
         'average_rating_display', 'reviews_count', 'has_file_display', 
-        'created_at_short', 'book_actions'
+        'file_size_display', 'created_at_short', 'book_actions'
     ]
     
     list_filter = [
         'genres', 'created_at', 'owner', 
         ('book_file', admin.EmptyFieldListFilter),
+        FileSizeListFilter, 'file_mime',
         ('cover_image', admin.EmptyFieldListFilter)
     ]
     
@@ -111,7 +210,10 @@ class BookAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
     
     filter_horizontal = ['genres']
     
-    readonly_fields = ['created_at', 'updated_at', 'average_rating_display', 'file_info']
+    readonly_fields = [
+        'created_at', 'updated_at', 'average_rating_display', 'file_info',
+        'file_mime', 'file_sha256', 'page_count'
+    ]
     
     # Группировка полей
     fieldsets = (
@@ -123,7 +225,7 @@ class BookAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
             'classes': ('wide',)
         }),
         ('Файлы', {
-            'fields': ('cover_image', 'book_file', 'file_info'),
+            'fields': ('cover_image', 'book_file', 'file_info', 'file_mime', 'page_count', 'file_sha256'),
             'classes': ('collapse',)
         }),
         ('Владелец и даты', {
@@ -145,6 +247,12 @@ class BookAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
     # Настройки списка
     list_per_page = 25
     list_max_show_all = 100
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_queryset(self, request):
+        """Владелец, рейтинг и жанры одним набором запросов на страницу"""
+        return super().get_queryset(request).select_related('owner', 'score').prefetch_related('genres')
     
     def owner_link(self, obj):
         """Ссылка на владельца книги"""
@@ -159,22 +267,23 @@ class BookAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
     
     def genres_display(self, obj):
         """Отображение жанров"""
-        genres = obj.genres.all()[:3]  # Показываем только первые 3
+        genres = list(obj.genres.all())  # Из prefetch_related, без запросов
         if genres:
             genre_links = []
-            for genre in genres:
+            for genre in genres[:3]:  # Показываем только первые 3
                 url = reverse('admin:books_genre_change', args=[genre.id])
                 genre_links.append(f'<a href="{url}">{genre.name}</a>')
             result = ', '.join(genre_links)
-            if obj.genres.count() > 3:
-                result += f' <span style="color: gray;">+{obj.genres.count() - 3}</span>'
+            if len(genres) > 3:
+                result += f' <span style="color: gray;">+{len(genres) - 3}</span>'
             return mark_safe(result)
         return "-"
     genres_display.short_description = 'Жанры'
     
     def average_rating_display(self, obj):
-        """Отображение среднего рейтинга"""
-        rating = obj.average_rating()
+        """Отображение среднего рейтинга (из BookScore)"""
+        score = getattr(obj, 'score', None)
+        rating = score.average_rating if score else 0
         if rating > 0:
             stars = "★" * int(rating) + "☆" * (5 - int(rating))
             color = "green" if rating >= 4 else "orange" if rating >= 3 else "red"
@@ -184,15 +293,18 @@ class BookAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
             )
         return format_html('<span style="color: gray;">Нет оценок</span>')
     average_rating_display.short_description = 'Рейтинг'
+    average_rating_display.admin_order_field = 'score__average_rating'
     
     def reviews_count(self, obj):
-        """Количество отзывов"""
-        count = obj.reviews.count()
+        """Количество отзывов (из BookScore)"""
+        score = getattr(obj, 'score', None)
+        count = score.reviews_count if score else 0
         if count > 0:
             url = reverse('admin:books_review_changelist') + f'?book__id__exact={obj.id}'
             return format_html('<a href="{}">{}</a>', url, count)
         return "0"
     reviews_count.short_description = 'Отзывы'
+    reviews_count.admin_order_field = 'score__reviews_count'
 
     def has_file_boolean(self, obj):
         """Наличие файла книги (boolean для сортировки)"""
@@ -215,15 +327,21 @@ class BookAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
     created_at_short.short_description = 'Создана'
     created_at_short.admin_order_field = 'created_at'
     
+    def file_size_display(self, obj):
+        """Размер файла из сохраненных сведений"""
+        if obj.file_size is None:
+            return "-"
+        return filesizeformat(obj.file_size)
+    file_size_display.short_description = 'Размер'
+    file_size_display.admin_order_field = 'file_size'
+    
     def file_info(self, obj):
         """Информация о файле"""
         if obj.book_file:
-            try:
-                size = obj.book_file.size
-                size_mb = round(size / (1024 * 1024), 2)
-                return f"Размер: {size_mb} МБ"
-            except:
-                return "Файл недоступен"
+            if obj.file_size is None:
+                return "Сведения о файле еще вычисляются"
+            size_mb = round(obj.file_size / (1024 * 1024), 2)
+            return f"Размер: {size_mb} МБ"
         return "Файл не загружен"
     file_info.short_description = 'Информация о файле'
     
@@ -263,7 +381,7 @@ class BookAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
 
 
 @admin.register(Review)
-class ReviewAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
+class ReviewAdmin(KeysetHistoryAdminMixin, SimpleHistoryAdmin, ImportExportModelAdmin):
     """Админка для отзывов"""
     resource_class = ReviewResource
     
@@ -292,6 +410,13 @@ class ReviewAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
     # История
     history_list_display = ['book', 'user', 'rating']
     
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_queryset(self, request):
+        """Книга и автор отзыва - в одном запросе"""
+        return super().get_queryset(request).select_related('book', 'user')
+    
     def book_link(self, obj):
         """Ссылка на книгу"""
         url = reverse('admin:books_book_change', args=[obj.book.id])
@@ -363,6 +488,16 @@ class UserProfileAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
     # История
     history_list_display = ['user', 'location']
     
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_queryset(self, request):
+        """Счетчики книг и отзывов - подзапросами только для строк страницы"""
+        return super().get_queryset(request).select_related('user').annotate(
+            books_total=count_subquery(Book, 'owner'),
+            reviews_total=count_subquery(Review, 'user'),
+        )
+    
     def user_link(self, obj):
         """Ссылка на пользователя"""
         url = reverse('admin:auth_user_change', args=[obj.user.id])
@@ -391,21 +526,23 @@ class UserProfileAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
     
     def books_count(self, obj):
         """Количество книг пользователя"""
-        count = obj.user.book_set.count()
+        count = obj.books_total
         if count > 0:
             url = reverse('admin:books_book_changelist') + f'?owner__id__exact={obj.user.id}'
             return format_html('<a href="{}">{}</a>', url, count)
         return "0"
     books_count.short_description = 'Книги'
+    books_count.admin_order_field = 'books_total'
     
     def reviews_count(self, obj):
         """Количество отзывов пользователя"""
-        count = obj.user.review_set.count()
+        count = obj.reviews_total
         if count > 0:
             url = reverse('admin:books_review_changelist') + f'?user__id__exact={obj.user.id}'
             return format_html('<a href="{}">{}</a>', url, count)
         return "0"
     reviews_count.short_description = 'Отзывы'
+    reviews_count.admin_order_field = 'reviews_total'
     
     def contact_info(self, obj):
         """Контактная информация"""
@@ -419,7 +556,7 @@ class UserProfileAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
 
 
 @admin.register(Message)
-class MessageAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
+class MessageAdmin(KeysetHistoryAdminMixin, SimpleHistoryAdmin, ImportExportModelAdmin):
     """Админка для сообщений"""
     resource_class = MessageResource
     
@@ -451,6 +588,13 @@ class MessageAdmin(SimpleHistoryAdmin, ImportExportModelAdmin):
     # История
     history_list_display = ['sender', 'recipient', 'subject', 'is_read']
     
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_queryset(self, request):
+        """Участники и книга - в одном запросе"""
+        return super().get_queryset(request).select_related('sender', 'recipient', 'book')
+    
     def sender_link(self, obj):
         """Ссылка на отправителя"""
         url = reverse('admin:auth_user_change', args=[obj.sender.id])
@@ -523,6 +667,13 @@ class UserActivityAdmin(SimpleHistoryAdmin):
     # История
     history_list_display = ['user', 'action', 'object_type']
     
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_queryset(self, request):
+        """Пользователь - в одном запросе"""
+        return super().get_queryset(request).select_related('user')
+    
     def has_add_permission(self, request):
         """Запрещаем создание активности через админку"""
         return False
@@ -571,3 +722,34 @@ class UserActivityAdmin(SimpleHistoryAdmin):
             return obj.user_agent[:100] + "..." if len(obj.user_agent) > 100 else obj.user_agent
         return "-"
     user_agent_short.short_description = 'User Agent'
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """Админка для фоновой очереди задач"""
+
+    list_display = ['task', 'attempts', 'max_attempts', 'run_at', 'locked_until', 'created_at']
+    list_filter = ['task']
+    search_fields = ['task', 'last_error']
+    readonly_fields = ['created_at']
+
+
+@admin.register(DeadJob)
+class DeadJobAdmin(admin.ModelAdmin):
+    """Админка для отказавших задач"""
+
+    list_display = ['task', 'attempts', 'created_at', 'failed_at']
+    list_filter = ['task', 'failed_at']
+    search_fields = ['task', 'last_error']
+    readonly_fields = ['task', 'payload', 'attempts', 'last_error', 'created_at', 'failed_at']
+    actions = ['requeue']
+
+    def has_add_permission(self, request):
+        """Отказавшие задачи создает только обработчик очереди"""
+        return False
+
+    @admin.action(description='Вернуть в очередь')
+    def requeue(self, request, queryset):
+        """Поставить выбранные задачи в очередь заново"""
+        count = requeue_dead_jobs(queryset)
+        messages.success(request, f'Возвращено в очередь задач: {count}')
@@ -0,0 +1,383 @@
+"""Аналитика активности по снимку данных в сжатых колонках NumPy
+
+Команда export_analytics выгружает UserActivity и историю книг, отзывов
+и сообщений в файлы .npz (по массиву на колонку) в ANALYTICS_SNAPSHOT_DIR.
+Выгрузка инкрементальная: каждый запуск дописывает только строки новее
+прошлой выгрузки. Отчеты (DAU/WAU/MAU, воронка, когорты удержания)
+считаются векторно по снимку и не нагружают рабочую базу.
+Дни и недели считаются в UTC.
+"""
+import json
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils import timezone
+
+from .jobs import task
+from .models import Book, Message, Review, UserActivity
+
+DAY = 86400
+WEEK = 7 * DAY
+# 1970-01-01 - четверг, недели начинаются с понедельника 1970-01-05
+WEEK_OFFSET = 4 * DAY
+
+INT = 'int'
+CATEGORY = 'category'
+
+STATE_FILE = 'state.json'
+USERS_FILE = 'users.npz'
+
+
+def snapshot_datasets():
+    """{набор: (queryset, поле времени, поле отметки выгрузки, [(колонка, поле модели, тип)])}
+
+    Отметка выгрузки - время записи строки в базу. Время события активности
+    задается при запросе, и фоновая задача может записать ее намного позже.
+    """
+    history_columns = [
+        ('object', 'id', INT),
+        ('type', 'history_type', CATEGORY),
+        ('actor', 'history_user_id', INT),
+    ]
+    return {
+        'activity': (UserActivity.objects.all(), 'timestamp', 'recorded_at', [
+            ('user', 'user_id', INT),
+            ('action', 'action', CATEGORY),
+            ('object', 'object_id', INT),
+        ]),
+        # user - пользователь, к которому относится событие
+        'books': (Book.history.all(), 'history_date', 'history_date', [*history_columns, ('user', 'owner_id', INT)]),
+        'reviews': (Review.history.all(), 'history_date', 'history_date', [*history_columns, ('user', 'user_id', INT)]),
+        'messages': (Message.history.all(), 'history_date', 'history_date', [*history_columns, ('user', 'recipient_id', INT)]),
+    }
+
+
+def snapshot_dir():
+    return Path(settings.ANALYTICS_SNAPSHOT_DIR)
+
+
+def read_state():
+    """Состояние снимка: версия, время выгрузки, файлы и отметки по наборам"""
+    try:
+        with open(snapshot_dir() / STATE_FILE, encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'version': 0, 'exported_at': None, 'datasets': {}}
+
+
+def _write_state(state):
+    path = snapshot_dir() / STATE_FILE
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(state, file, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _save_npz(path, columns):
+    # Имя временного файла должно оканчиваться на .npz, иначе numpy допишет расширение
+    tmp_path = path.with_name(f'.{path.name}')
+    np.savez_compressed(tmp_path, **columns)
+    os.replace(tmp_path, path)
+
+
+def _to_columns(rows, columns):
+    """Строки values_list -> {колонка: массив}; категории кодируются словарем"""
+    result = {'time': np.array([row[0].timestamp() for row in rows], dtype=np.int64)}
+    for index, (name, _, kind) in enumerate(columns, start=1):
+        values = [row[index] for row in rows]
+        if kind == CATEGORY:
+            names, codes = np.unique(np.array(values, dtype=str), return_inverse=True)
+            result[name] = codes.astype(np.int16)
+            result[f'{name}__names'] = names
+        else:
+            result[name] = np.array([-1 if value is None else value for value in values], dtype=np.int64)
+    return result
+
+
+def export_snapshot(full=False):
+    """Дописать в снимок новые строки; возвращает {набор: выгружено строк}
+
+    Строки моложе ANALYTICS_EXPORT_LAG секунд не выгружаются: транзакции,
+    начатые раньше отметки, успевают зафиксироваться до следующего запуска.
+    """
+    directory = snapshot_dir()
+    state = read_state()
+    if full:
+        state = {'version': state['version'], 'exported_at': None, 'datasets': {}}
+    until = timezone.now() - timedelta(seconds=settings.ANALYTICS_EXPORT_LAG)
+    stamp = f'{until:%Y%m%d%H%M%S}'
+
+    exported = {}
+    for name, (queryset, time_field, watermark_field, columns) in snapshot_datasets().items():
+        if full:
+            shutil.rmtree(directory / name, ignore_errors=True)
+        dataset_state = state['datasets'].setdefault(name, {'watermark': None, 'files': [], 'rows': 0})
+        (directory / name).mkdir(parents=True, exist_ok=True)
+
+        queryset = queryset.filter(**{f'{watermark_field}__lte': until})
+        if dataset_state['watermark']:
+            queryset = queryset.filter(
+                **{f'{watermark_field}__gt': datetime.fromisoformat(dataset_state['watermark'])}
+            )
+        rows_iter = queryset.order_by(watermark_field).values_list(
+            time_field, *[field for _, field, _ in columns], watermark_field
+        ).iterator(chunk_size=10000)
+
+        exported[name] = 0
+        part = 0
+        while True:
+            rows = [row for _, row in zip(range(settings.ANALYTICS_EXPORT_CHUNK_ROWS), rows_iter)]
+            if not rows:
+                break
+            file_name = f'{name}/{stamp}-{part}.npz'
+            _save_npz(directory / file_name, _to_columns(rows, columns))
+            dataset_state['files'].append(file_name)
+            dataset_state['rows'] += len(rows)
+            dataset_state['watermark'] = rows[-1][-1].isoformat()
+            exported[name] += len(rows)
+            part += 1
+
+    # Пользователи - небольшая таблица, выгружается целиком
+    users = list(User.objects.order_by('pk').values_list('pk', 'date_joined'))
+    _save_npz(directory / USERS_FILE, {
+        'id': np.array([pk for pk, _ in users], dtype=np.int64),
+        'joined': np.array([joined.timestamp() for _, joined in users], dtype=np.int64),
+    })
+
+    # Файлы, не попавшие в state.json (прерванная выгрузка), при чтении игнорируются
+    state['version'] += 1
+    state['exported_at'] = timezone.now().isoformat()
+    _write_state(state)
+    return exported
+
+
+@task('books.export_analytics_snapshot')
+def export_analytics_snapshot(full=False):
+    """Фоновая задача: обновить снимок аналитики"""
+    export_snapshot(full=full)
+
+
+def _load_dataset(files):
+    """Склеить файлы набора; коды категорий приводятся к общему словарю"""
+    chunks = []
+    for file_name in files:
+        with np.load(snapshot_dir() / file_name) as data:
+            chunks.append({key: data[key] for key in data.files})
+    if not chunks:
+        return None
+
+    result = {}
+    for key in chunks[0]:
+        if key.endswith('__names'):
+            continue
+        if f'{key}__names' in chunks[0]:
+            names = np.unique(np.concatenate([chunk[f'{key}__names'] for chunk in chunks]))
+            result[key] = np.concatenate([
+                np.searchsorted(names, chunk[f'{key}__names'])[chunk[key]] for chunk in chunks
+            ])
+            result[f'{key}__names'] = names
+        else:
+            result[key] = np.concatenate([chunk[key] for chunk in chunks])
+    return result
+
+
+class Snapshot:
+    """Снимок в памяти процесса; перечитывается, когда меняется версия в state.json"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._data = None
+
+    def get(self):
+        state = read_state()
+        if not state['version']:
+            return None
+        if self._version != state['version']:
+            with self._lock:
+                if self._version != state['version']:
+                    data = {
+                        name: _load_dataset(dataset_state['files'])
+                        for name, dataset_state in state['datasets'].items()
+                    }
+                    with np.load(snapshot_dir() / USERS_FILE) as users:
+                        data['users'] = {'id': users['id'], 'joined': users['joined']}
+                    data['version'] = state['version']
+                    data['exported_at'] = state['exported_at']
+                    self._data = data
+                    self._version = state['version']
+        return self._data
+
+
+snapshot = Snapshot()
+
+
+def category_mask(dataset, column, value):
+    """Маска строк, у которых категория column равна value"""
+    names = dataset[f'{column}__names']
+    matches = np.flatnonzero(names == value)
+    if not len(matches):
+        return np.zeros(len(dataset[column]), dtype=bool)
+    return dataset[column] == matches[0]
+
+
+def _today(now=None):
+    return int((now or timezone.now()).timestamp()) // DAY
+
+
+def _day_date(day):
+    return datetime.fromtimestamp(day * DAY, tz=dt_timezone.utc).date()
+
+
+def _rolling_unique(users, days, window, length):
+    """Уникальные пользователи за окно window дней, заканчивающееся каждым днем
+
+    users, days - уникальные пары (пользователь, день), отсортированные по
+    пользователю и дню. Пара покрывает дни [day, day + window), но не дальше
+    следующего активного дня того же пользователя - так никто не считается дважды.
+    """
+    end = days + window
+    same_user = np.zeros(len(users), dtype=bool)
+    same_user[:-1] = users[1:] == users[:-1]
+    next_day = np.zeros(len(days), dtype=days.dtype)
+    next_day[:-1] = days[1:]
+    end = np.where(same_user, np.minimum(end, next_day), end)
+
+    counter = np.zeros(length + window + 1, dtype=np.int64)
+    np.add.at(counter, days, 1)
+    np.add.at(counter, end, -1)
+    return np.cumsum(counter)[:length]
+
+
+def active_users(data, days=30, now=None):
+    """DAU, WAU и MAU за последние days дней"""
+    today = _today(now)
+    first_day = today - days + 1 - 29  # MAU первого дня требует 29 дней до него
+    length = today - first_day + 1
+
+    activity = data['activity']
+    if activity is None:
+        return []
+    mask = (activity['time'] >= first_day * DAY) & (activity['time'] < (today + 1) * DAY)
+    keys = np.unique(activity['user'][mask] * length + activity['time'][mask] // DAY - first_day)
+    users, day_index = keys // length, keys % length
+
+    dau = np.bincount(day_index, minlength=length)
+    wau = _rolling_unique(users, day_index, 7, length)
+    mau = _rolling_unique(users, day_index, 30, length)
+    return [
+        {'date': _day_date(first_day + index), 'dau': int(dau[index]), 'wau': int(wau[index]), 'mau': int(mau[index])}
+        for index in range(length - days, length)
+    ]
+
+
+def _first_event_after(user_ids, after, event_users, event_times):
+    """Время первого события каждого пользователя не раньше after (inf - не было)"""
+    first = np.full(len(user_ids), np.inf)
+    index = np.searchsorted(user_ids, event_users)
+    index[index == len(user_ids)] = 0
+    known = user_ids[index] == event_users if len(user_ids) else np.zeros(len(event_users), dtype=bool)
+    index, times = index[known], event_times[known]
+    in_order = times >= after[index]
+    np.minimum.at(first, index[in_order], times[in_order])
+    return first
+
+
+def funnel(data, days=90, now=None):
+    """Воронка для зарегистрировавшихся за days дней: регистрация -> книга -> сообщение"""
+    since = (now or timezone.now()).timestamp() - days * DAY
+    users = data['users']
+    registered = users['joined'] >= since
+    user_ids, joined = users['id'][registered], users['joined'][registered].astype(float)
+
+    steps = [('Регистрация', joined)]
+    activity, messages = data['activity'], data['messages']
+    if activity is not None:
+        books = category_mask(activity, 'action', 'create_book')
+        steps.append(('Добавление книги', _first_event_after(
+            user_ids, steps[-1][1], activity['user'][books], activity['time'][books]
+        )))
+    if messages is not None:
+        received = category_mask(messages, 'type', '+')
+        steps.append(('Получение сообщения', _first_event_after(
+            user_ids, steps[-1][1], messages['user'][received], messages['time'][received]
+        )))
+
+    result = []
+    total = len(user_ids)
+    previous = total
+    for title, times in steps:
+        count = int(np.isfinite(times).sum())
+        result.append({
+            'step': title,
+            'users': count,
+            'conversion': round(count / total, 4) if total else 0.0,
+            'from_previous': round(count / previous, 4) if previous else 0.0,
+        })
+        previous = count
+    return result
+
+
+def retention_cohorts(data, weeks=12, now=None):
+    """Когорты по неделе регистрации: доля пользователей, активных через N недель"""
+    current_week = (int((now or timezone.now()).timestamp()) - WEEK_OFFSET) // WEEK
+    first_week = current_week - weeks + 1
+
+    users = data['users']
+    cohort = (users['joined'] - WEEK_OFFSET) // WEEK
+    in_range = cohort >= first_week
+    user_ids, cohort = users['id'][in_range], cohort[in_range] - first_week
+    sizes = np.bincount(cohort, minlength=weeks)
+
+    matrix = np.zeros((weeks, weeks), dtype=np.int64)
+    activity = data['activity']
+    if activity is not None and len(user_ids):
+        index = np.searchsorted(user_ids, activity['user'])
+        index[index == len(user_ids)] = 0
+        known = user_ids[index] == activity['user']
+        index = index[known]
+        offset = (activity['time'][known] - WEEK_OFFSET) // WEEK - first_week - cohort[index]
+        valid = (offset >= 0) & (cohort[index] + offset < weeks)
+        # Пользователь учитывается в неделе один раз, сколько бы действий ни совершил
+        keys = np.unique(index[valid] * weeks + offset[valid])
+        active_index, active_offset = keys // weeks, keys % weeks
+        np.add.at(matrix, (cohort[active_index], active_offset), 1)
+
+    result = []
+    for row in range(weeks):
+        size = int(sizes[row])
+        observed = weeks - row  # Для поздних когорт прошло меньше недель
+        result.append({
+            'week_start': _day_date((first_week + row) * WEEK // DAY + WEEK_OFFSET // DAY),
+            'users': size,
+            'retention': [round(int(count) / size, 4) if size else 0.0 for count in matrix[row, :observed]],
+        })
+    return result
+
+
+REPORTS = {
+    'active_users': active_users,
+    'funnel': funnel,
+    'retention': retention_cohorts,
+}
+
+
+def get_report(name, **params):
+    """Отчет по текущему снимку; результат кэшируется до следующей выгрузки"""
+    data = snapshot.get()
+    if data is None:
+        return None
+    params_key = ':'.join(f'{key}={value}' for key, value in sorted(params.items()))
+    key = f'books:analytics:{data["version"]}:{name}:{params_key}:{_today()}'
+    report = cache.get(key)
+    if report is None:
+        report = REPORTS[name](data, **params)
+        cache.set(key, report, settings.ANALYTICS_CACHE_TIMEOUT)
+    return report
@@ -2,7 +2,8 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .api_views import (
     BookViewSet, ReviewViewSet, GenreViewSet, 
-    UserViewSet, UserProfileViewSet, MessageViewSet
+    UserViewSet, UserProfileViewSet, MessageViewSet, SearchViewSet,
+    AnalyticsViewSet
 )
 
 # Создаем роутер для API
@@ -13,6 +14,8 @@ router.register(r'genres', GenreViewSet)
 router.register(r'users', UserViewSet)
 router.register(r'profiles', UserProfileViewSet)
 router.register(r'messages', MessageViewSet, basename='message')
+router.register(r'search', SearchViewSet, basename='search')
+router.register(r'analytics', AnalyticsViewSet, basename='analytics')
 
 urlpatterns = [
     # API маршруты
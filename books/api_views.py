@@ -1,30 +1,163 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.db.models import Avg, Count, Q, Max, Min
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from datetime import timedelta
-import json
 
 from .models import Book, Review, Genre, UserProfile, Message, UserActivity
 from .serializers import (
     BookListSerializer, BookDetailSerializer, BookCreateUpdateSerializer,
     ReviewSerializer, GenreSerializer, UserSerializer, UserProfileSerializer,
-    MessageSerializer, BookStatisticsSerializer, UserActivitySerializer
+    MessageSerializer, BookStatisticsSerializer, UserActivitySerializer,
+    BookBulkCreateSerializer, BulkIdsSerializer, PointInTimeSerializer,
+    AnalyticsQuerySerializer
 )
 from .pagination import (
     BookPagination, ReviewPagination, MessagePagination, 
     CustomPageNumberPagination, SmallResultsSetPagination
 )
-from .history_utils import log_user_activity
+from .history_utils import compare_object_versions, log_user_activity
+from .history_diff import (
+    HISTORY_MAX_PAGE_SIZE, HISTORY_PAGE_SIZE, history_page, serialize_history_record
+)
+from .renderers import ORJSONRenderer
+from .read_serializers import (
+    FastBookListSerializer, FastMessageSerializer, FastReviewSerializer, pks_only
+)
+from .bulk import (
+    bulk_error_results, bulk_create_books, bulk_create_reviews,
+    bulk_mark_messages_read, find_review_conflicts, mark_all_messages_read
+)
+from .concurrency import VersionConflict, parse_if_match, version_etag
+from .db_router import pin_to_primary
+from .analytics import get_report, read_state
+from .point_in_time import book_ids_for_genre, book_ids_for_owner, restore_as_of, take_snapshot
+from .scoring import activity_threshold
+from .suggest import get_suggestions
+from .facets import filter_by_author_initial, filter_by_has_file, get_catalog_facets
+from .genre_index import filter_books_by_genres, parse_id_list
+
+
+class ReplicaReadMixin:
+    """Разрешает чтение из реплик только для перечисленных действий"""
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        if self.action not in self.replica_actions:
+            pin_to_primary()
+        super().initial(request, *args, **kwargs)
+
+
+class FastListMixin:
+    """Списки через быстрые сериализаторы из .values() (см. read_serializers)"""
+    read_serializer_class = None
+
+    def fast_list_response(self, queryset, context=None):
+        """Ответ со списком (с пагинацией, если она настроена)"""
+        if context is None:
+            context = self.get_serializer_context()
+        page = self.paginate_queryset(pks_only(queryset))
+        if page is not None:
+            return self.get_paginated_response(self.read_serializer_class(page, context=context).data)
+        return Response(self.read_serializer_class(pks_only(queryset), context=context).data)
+
+    def list(self, request, *args, **kwargs):
+        return self.fast_list_response(self.filter_queryset(self.get_queryset()))
+
+
+class HistoryMixin:
+    """История объекта: страницы по курсору (?before=...&limit=N) и сравнение версий"""
+
+    def history_response(self, instance, record_fields=None, **extra):
+        params = self.request.query_params
+        try:
+            limit = min(max(int(params.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+            records, next_cursor = history_page(instance.history.all(), params.get('before'), limit)
+        except ValueError:
+            return Response({'error': 'Неверный курсор или limit'}, status=status.HTTP_400_BAD_REQUEST)
+
+        history_data = []
+        for record in records:
+            data = serialize_history_record(record)
+            if record_fields:
+                data.update(record_fields(record))
+            history_data.append(data)
+        return Response({**extra, 'next_cursor': next_cursor, 'history': history_data})
+
+    def history_diff_response(self, instance):
+        """Различия двух версий: ?from=<history_id>&to=<history_id>"""
+        comparison = compare_object_versions(
+            instance, self.request.query_params.get('from'), self.request.query_params.get('to')
+        )
+        if comparison is None:
+            return Response({'error': 'Версия не найдена'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            'from': str(comparison['version1'].history_id),
+            'to': str(comparison['version2'].history_id),
+            'changes': [
+                {
+                    'field': change['field'],
+                    'verbose_name': change['field_verbose_name'],
+                    'old': change['old_value'],
+                    'new': change['new_value'],
+                }
+                for change in comparison['changes']
+            ],
+        })
+
+
+class OptimisticLockMixin:
+    """ETag с версией объекта; изменение с If-Match, 409 при конфликте версий"""
+
+    def conflict_response(self, instance):
+        response = Response(
+            {'error': 'Объект уже изменен другим запросом', 'version': instance.version},
+            status=status.HTTP_409_CONFLICT
+        )
+        response['ETag'] = version_etag(instance)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        response = Response(self.get_serializer(instance).data)
+        response['ETag'] = version_etag(instance)
+        return response
+
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
+        instance = self.get_object()
+        try:
+            versions = parse_if_match(request.headers.get('If-Match'))
+        except ValueError:
+            return Response({'error': 'Некорректный заголовок If-Match'}, status=status.HTTP_400_BAD_REQUEST)
+        if versions is not None and instance.version not in versions:
+            return self.conflict_response(instance)
+
+        serializer = self.get_serializer(instance, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        try:
+            self.perform_update(serializer)
+        except VersionConflict:
+            # Строку изменили между чтением и записью
+            instance.refresh_from_db(fields=['version'])
+            return self.conflict_response(instance)
+
+        if getattr(instance, '_prefetched_objects_cache', None):
+            instance._prefetched_objects_cache = {}
+        response = Response(serializer.data)
+        response['ETag'] = version_etag(instance)
+        return response
 
 
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(ReplicaReadMixin, FastListMixin, HistoryMixin, OptimisticLockMixin, viewsets.ModelViewSet):
     """API для работы с книгами"""
     queryset = Book.objects.all().select_related('owner').prefetch_related('genres', 'reviews')
     pagination_class = BookPagination
@@ -33,6 +166,9 @@ class BookViewSet(viewsets.ModelViewSet):
     search_fields = ['title', 'author', 'description']
     ordering_fields = ['created_at', 'title', 'author']
     ordering = ['-created_at']
+    replica_actions = ('list', 'retrieve', 'statistics', 'popular', 'trending', 'similar')
+    read_serializer_class = FastBookListSerializer
+    throttle_scopes = {'download': 'download', 'export_data': 'export'}
     
     def get_serializer_class(self):
         if self.action == 'list':
@@ -43,8 +179,10 @@ class BookViewSet(viewsets.ModelViewSet):
     
     def get_permissions(self):
         """Настройка разрешений"""
-        if self.action in ['create']:
+        if self.action in ['create', 'bulk', 'as_of']:
             permission_classes = [permissions.IsAuthenticated]
+        elif self.action == 'restore_as_of':
+            permission_classes = [permissions.IsAdminUser]
         elif self.action in ['update', 'partial_update', 'destroy']:
             permission_classes = [permissions.IsAuthenticated]
         else:
@@ -94,10 +232,21 @@ class BookViewSet(viewsets.ModelViewSet):
         # Фильтр по наличию файла
         has_file = self.request.query_params.get('has_file')
         if has_file is not None:
-            if has_file.lower() == 'true':
-                queryset = queryset.exclude(book_file='')
-            else:
-                queryset = queryset.filter(book_file='')
+            queryset = filter_by_has_file(queryset, has_file)
+        
+        # Фильтр по нескольким жанрам через битовый индекс: genres_all (AND), genres_any (OR), genres_none (NOT)
+        params = self.request.query_params
+        queryset = filter_books_by_genres(
+            queryset,
+            all_of=parse_id_list(params.getlist('genres_all')),
+            any_of=parse_id_list(params.getlist('genres_any')),
+            none_of=parse_id_list(params.getlist('genres_none')),
+        )
+        
+        # Фильтр по первой букве автора
+        author_initial = self.request.query_params.get('author_initial')
+        if author_initial:
+            queryset = filter_by_author_initial(queryset, author_initial)
         
         # Фильтр по рейтингу
         min_rating = self.request.query_params.get('min_rating')
@@ -108,6 +257,13 @@ class BookViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    def list(self, request, *args, **kwargs):
+        """Список книг; с ?facets=true добавляются счетчики фасетов по текущим фильтрам"""
+        response = self.fast_list_response(self.filter_queryset(self.get_queryset()))
+        if request.query_params.get('facets', '').lower() in ('1', 'true'):
+            response.data['facets'] = get_catalog_facets(self.filter_queryset(self.get_queryset()))
+        return response
+    
     def destroy(self, request, *args, **kwargs):
         """Удаление книги (только владелец)"""
         book = self.get_object()
@@ -130,6 +286,30 @@ class BookViewSet(viewsets.ModelViewSet):
     
     # ДОПОЛНИТЕЛЬНЫЕ МЕТОДЫ @action
     
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Пакетное создание книг: список объектов, одна транзакция"""
+        serializer = BookBulkCreateSerializer(
+            data=request.data,
+            many=True,
+            max_length=settings.API_BULK_MAX_ITEMS,
+            context=self.get_serializer_context()
+        )
+        if not serializer.is_valid():
+            return Response(
+                {'results': bulk_error_results(serializer.errors)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        books = bulk_create_books(serializer.validated_data, request.user, request)
+        return Response({
+            'created': len(books),
+            'results': [
+                {'index': index, 'status': 'created', 'id': book.pk}
+                for index, book in enumerate(books)
+            ]
+        }, status=status.HTTP_201_CREATED)
+    
     @action(detail=True, methods=['get'])
     def download(self, request, pk=None):
         """Скачивание файла книги"""
@@ -202,38 +382,30 @@ class BookViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def popular(self, request):
         """Популярные книги (с высоким рейтингом)"""
-        queryset = self.get_queryset().annotate(
-            avg_rating=Avg('reviews__rating'),
-            reviews_count=Count('reviews')
-        ).filter(
-            reviews_count__gte=1
-        ).order_by('-avg_rating', '-reviews_count')
+        queryset = self.get_queryset().filter(
+            score__reviews_count__gte=1
+        ).order_by('-score__bayesian_rating', '-score__reviews_count')
         
         self.pagination_class = SmallResultsSetPagination
         
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = BookListSerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = BookListSerializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.fast_list_response(queryset, context={})
     
     @action(detail=False, methods=['get'])
     def trending(self, request):
-        """Трендовые книги (недавно добавленные с хорошими отзывами)"""
-        last_month = timezone.now() - timedelta(days=30)
-        
+        """Трендовые книги (по затухающей во времени активности: отзывы, сообщения, скачивания)"""
         queryset = self.get_queryset().filter(
-            created_at__gte=last_month
-        ).annotate(
-            avg_rating=Avg('reviews__rating'),
-            reviews_count=Count('reviews')
-        ).filter(
-            avg_rating__gte=4.0
-        ).order_by('-avg_rating', '-reviews_count')
-        
-        serializer = BookListSerializer(queryset[:10], many=True)
+            score__activity_score__gt=activity_threshold(timezone.now())
+        ).order_by('-score__activity_score')
+        
+        serializer = FastBookListSerializer(pks_only(queryset)[:10])
+        return Response(serializer.data)
+    
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """Похожие книги (из индекса, построенного командой build_similarity_index)"""
+        book = get_object_or_404(Book, pk=pk)
+        similar_books = book.get_similar_books().select_related('owner').prefetch_related('genres', 'reviews')
+        serializer = BookListSerializer(similar_books, many=True)
         return Response(serializer.data)
     
     @action(detail=True, methods=['post'])
@@ -260,32 +432,102 @@ class BookViewSet(viewsets.ModelViewSet):
         
         return Response({'status': 'Избранное переключено'})
     
-    @action(detail=True, methods=['get'])
-    def history(self, request, pk=None):
-        """История изменений книги"""
+    def get_history_book(self, request):
+        """Книга, если пользователю доступна ее история, иначе None"""
         book = self.get_object()
         if book.owner != request.user and not request.user.is_staff:
+            return None
+        return book
+    
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """История изменений книги с изменениями полей (?before=<курсор> - следующая страница)"""
+        book = self.get_history_book(request)
+        if book is None:
             return Response(
                 {'error': 'Нет доступа к истории этой книги'}, 
                 status=status.HTTP_403_FORBIDDEN
             )
-        history = book.history.all().order_by('-history_date')[:20]
-        history_data = []
-        for record in history:
-            history_data.append({
-                'history_id': str(record.history_id),
-                'history_date': record.history_date,
-                'history_type': record.history_type,
-                'history_change_reason': record.history_change_reason,
+        return self.history_response(
+            book,
+            lambda record: {
                 'title': record.title,
                 'author': record.author,
                 'description': record.description[:100] + '...' if len(record.description) > 100 else record.description
-            })
-        return Response({
-            'book_id': book.id,
-            'book_title': book.title,
-            'history': history_data
-        })
+            },
+            book_id=book.id,
+            book_title=book.title,
+        )
+    
+    @action(detail=True, methods=['get'], url_path='history/diff')
+    def history_diff(self, request, pk=None):
+        """Различия двух версий книги: ?from=<history_id>&to=<history_id>"""
+        book = self.get_history_book(request)
+        if book is None:
+            return Response(
+                {'error': 'Нет доступа к истории этой книги'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        return self.history_diff_response(book)
+    
+    def get_point_in_time_book_ids(self, data):
+        """Id книг набора из PointInTimeSerializer (owner, genre или ids)"""
+        if data.get('owner'):
+            return book_ids_for_owner(data['owner'])
+        if data.get('genre'):
+            return book_ids_for_genre(data['genre'])
+        return set(data['ids'])
+    
+    @action(detail=False, methods=['get'])
+    def as_of(self, request):
+        """Книги в состоянии на момент времени: ?at=<дата>&owner=<id>|genre=<id>|ids=..."""
+        params = request.query_params.copy()
+        if not request.user.is_staff:
+            # Пользователь видит прошлое состояние только своих книг
+            params.setlist('owner', [str(request.user.pk)])
+            for name in ('genre', 'ids'):
+                params.pop(name, None)
+        serializer = PointInTimeSerializer(data=params)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        versions, m2m = take_snapshot(Book, data['at'], self.get_point_in_time_book_ids(data))
+        if data.get('owner'):
+            versions = {pk: record for pk, record in versions.items() if record.owner_id == data['owner']}
+        if data.get('genre'):
+            versions = {pk: record for pk, record in versions.items() if data['genre'] in m2m['genres'].get(pk, ())}
+        
+        results = [
+            {
+                'id': record.id,
+                'title': record.title,
+                'author': record.author,
+                'description': record.description,
+                'owner': record.owner_id,
+                'genres': sorted(m2m['genres'].get(record.id, ())),
+                'has_file': bool(record.book_file),
+                'history_id': str(record.history_id),
+                'history_date': record.history_date,
+            }
+            for record in sorted(versions.values(), key=lambda record: record.history_date, reverse=True)
+        ]
+        page = self.paginate_queryset(results)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(results)
+    
+    @action(detail=False, methods=['post'])
+    def restore_as_of(self, request):
+        """Восстановить набор книг на момент времени (по умолчанию dry_run - только отчет)"""
+        serializer = PointInTimeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        plan = restore_as_of(
+            Book, data['at'], self.get_point_in_time_book_ids(data),
+            user=request.user, dry_run=data['dry_run']
+        )
+        return Response({'as_of': data['at'], 'dry_run': data['dry_run'], 'changes': plan})
     
     @action(detail=False, methods=['get'])
     def export_data(self, request):
@@ -304,7 +546,7 @@ class BookViewSet(viewsets.ModelViewSet):
         serializer = BookListSerializer(queryset, many=True)
         
         response = HttpResponse(
-            json.dumps(serializer.data, ensure_ascii=False, indent=2),
+            ORJSONRenderer().render(serializer.data, renderer_context={'indent': 2}),
             content_type='application/json'
         )
         response['Content-Disposition'] = 'attachment; filename="my_books.json"'
@@ -312,10 +554,11 @@ class BookViewSet(viewsets.ModelViewSet):
         return response
 
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(ReplicaReadMixin, FastListMixin, OptimisticLockMixin, viewsets.ModelViewSet):
     """API для работы с отзывами"""
     queryset = Review.objects.all().select_related('user', 'book')
     serializer_class = ReviewSerializer
+    read_serializer_class = FastReviewSerializer
     pagination_class = ReviewPagination
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_fields = ['book', 'user', 'rating']
@@ -324,7 +567,7 @@ class ReviewViewSet(viewsets.ModelViewSet):
     
     def get_permissions(self):
         """Настройка разрешений"""
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'bulk', 'update', 'partial_update', 'destroy']:
             permission_classes = [permissions.IsAuthenticated]
         else:
             permission_classes = [permissions.AllowAny]
@@ -364,6 +607,34 @@ class ReviewViewSet(viewsets.ModelViewSet):
     
     # ДОПОЛНИТЕЛЬНЫЕ МЕТОДЫ @action
     
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Пакетное создание отзывов текущего пользователя"""
+        serializer = self.get_serializer(
+            data=request.data, many=True, max_length=settings.API_BULK_MAX_ITEMS
+        )
+        if not serializer.is_valid():
+            return Response(
+                {'results': bulk_error_results(serializer.errors)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        conflicts = find_review_conflicts(serializer.validated_data, request.user)
+        if any(conflicts):
+            return Response(
+                {'results': bulk_error_results(conflicts)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        reviews = bulk_create_reviews(serializer.validated_data, request.user, request)
+        return Response({
+            'created': len(reviews),
+            'results': [
+                {'index': index, 'status': 'created', 'id': review.pk}
+                for index, review in enumerate(reviews)
+            ]
+        }, status=status.HTTP_201_CREATED)
+    
     @action(detail=False, methods=['get'])
     def my_reviews(self, request):
         """Мои отзывы"""
@@ -396,7 +667,7 @@ class ReviewViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class GenreViewSet(viewsets.ModelViewSet):
+class GenreViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     """API для работы с жанрами"""
     queryset = Genre.objects.all().annotate(books_count=Count('book'))
     serializer_class = GenreSerializer
@@ -440,7 +711,7 @@ class GenreViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+class UserViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     """API для работы с пользователями (только чтение)"""
     queryset = User.objects.all().select_related('userprofile')
     serializer_class = UserSerializer
@@ -479,7 +750,7 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(serializer.data)
 
 
-class UserProfileViewSet(viewsets.ModelViewSet):
+class UserProfileViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     """API для работы с профилями пользователей"""
     queryset = UserProfile.objects.all().select_related('user')
     serializer_class = UserProfileSerializer
@@ -525,9 +796,11 @@ class UserProfileViewSet(viewsets.ModelViewSet):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(ReplicaReadMixin, FastListMixin, HistoryMixin, viewsets.ModelViewSet):
     """API для работы с сообщениями"""
     serializer_class = MessageSerializer
+    read_serializer_class = FastMessageSerializer
+    throttle_scopes = {'create': 'message_send'}
     pagination_class = MessagePagination
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_fields = ['book', 'is_read']
@@ -557,25 +830,13 @@ class MessageViewSet(viewsets.ModelViewSet):
     def inbox(self, request):
         """Входящие сообщения"""
         queryset = self.get_queryset().filter(recipient=request.user)
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.fast_list_response(queryset)
     
     @action(detail=False, methods=['get'])
     def sent(self, request):
         """Отправленные сообщения"""
         queryset = self.get_queryset().filter(sender=request.user)
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.fast_list_response(queryset)
     
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
@@ -602,6 +863,36 @@ class MessageViewSet(viewsets.ModelViewSet):
         
         return Response({'status': 'Сообщение отмечено как прочитанное'})
     
+    @action(detail=False, methods=['post'])
+    def mark_read_bulk(self, request):
+        """Отметить прочитанными несколько входящих сообщений: {"ids": [...]}"""
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        results = bulk_mark_messages_read(serializer.validated_data['ids'], request.user, request)
+        return Response({
+            'marked': sum(1 for result in results if result['status'] == 'marked'),
+            'results': results
+        })
+    
+    @action(detail=False, methods=['post'])
+    def mark_all_read(self, request):
+        """Отметить прочитанными все входящие (с учетом фильтров, например ?book=1)"""
+        queryset = self.filter_queryset(self.get_queryset())
+        marked, unread_count = mark_all_messages_read(request.user, queryset, request)
+        return Response({'marked': marked, 'unread_count': unread_count})
+    
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """История изменений сообщения (?before=<курсор> - следующая страница)"""
+        message = self.get_object()
+        return self.history_response(message, message_id=message.id)
+    
+    @action(detail=True, methods=['get'], url_path='history/diff')
+    def history_diff(self, request, pk=None):
+        """Различия двух версий сообщения: ?from=<history_id>&to=<history_id>"""
+        return self.history_diff_response(self.get_object())
+    
     @action(detail=False, methods=['get'])
     def unread_count(self, request):
         """Количество непрочитанных сообщений"""
@@ -610,3 +901,60 @@ class MessageViewSet(viewsets.ModelViewSet):
             is_read=False
         ).count()
         return Response({'unread_count': count})
+
+
+class SearchViewSet(viewsets.ViewSet):
+    """API поиска"""
+    permission_classes = [permissions.AllowAny]
+
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """Подсказки по началу названия, автора или жанра"""
+        query = request.query_params.get('q', '')
+        suggestions, source = get_suggestions(query)
+        return Response({'query': query, 'source': source, **suggestions})
+
+
+class AnalyticsViewSet(viewsets.ViewSet):
+    """Отчеты по активности пользователей (по снимку export_analytics)"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def list(self, request):
+        """Состояние снимка и доступные отчеты"""
+        state = read_state()
+        return Response({
+            'version': state['version'],
+            'exported_at': state['exported_at'],
+            'rows': {name: dataset['rows'] for name, dataset in state['datasets'].items()},
+            'reports': {
+                name: reverse(f'analytics-{url_name}', request=request)
+                for name, url_name in [('active_users', 'active-users'), ('funnel', 'funnel'), ('retention', 'retention')]
+            },
+        })
+
+    def report_response(self, request, name, param, default):
+        serializer = AnalyticsQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        value = serializer.validated_data.get(param, default)
+        report = get_report(name, **{param: value})
+        if report is None:
+            return Response(
+                {'error': 'Снимок аналитики еще не выгружен (manage.py export_analytics)'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response({param: value, 'results': report})
+
+    @action(detail=False, methods=['get'])
+    def active_users(self, request):
+        """DAU / WAU / MAU по дням: ?days=30"""
+        return self.report_response(request, 'active_users', 'days', 30)
+
+    @action(detail=False, methods=['get'])
+    def funnel(self, request):
+        """Воронка регистрация -> книга -> сообщение: ?days=90"""
+        return self.report_response(request, 'funnel', 'days', 90)
+
+    @action(detail=False, methods=['get'])
+    def retention(self, request):
+        """Удержание по недельным когортам регистрации: ?weeks=12"""
+        return self.report_response(request, 'retention', 'weeks', 12)
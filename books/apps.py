@@ -5,3 +5,9 @@ class BooksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'books'
     verbose_name = 'Книги'
+
+    def ready(self):
+        # Регистрируем обработчики сигналов
+        from . import signals  # noqa: F401
+        # Регистрируем фоновые задачи (для run_worker)
+        from . import analytics, file_metadata, history_utils  # noqa: F401
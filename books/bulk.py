@@ -0,0 +1,165 @@
+"""Пакетные операции API: одна транзакция и bulk-запросы вместо save() на каждый объект
+
+bulk_create/bulk_update не вызывают save() и сигналы post_save, поэтому
+история, активность, рейтинги и индексы обновляются здесь явно и тоже пачкой.
+"""
+from django.db import transaction
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
+
+from .genre_index import genre_index
+from .history_utils import bulk_create_m2m_history, bulk_log_user_activity, log_user_activity
+from .models import Book, Message, Review
+from .scoring import refresh_book_scores
+from .suggest import invalidate_suggest_index
+
+# Сколько исторических записей создавать за один INSERT
+HISTORY_BATCH_SIZE = 1000
+
+
+def bulk_error_results(errors):
+    """Ошибки ListSerializer -> результаты по каждому элементу"""
+    if not isinstance(errors, list):
+        # Ошибка всего запроса (не список, пустой список, слишком много элементов)
+        return errors
+    return [
+        {'index': index, 'status': 'error', 'errors': item_errors} if item_errors
+        else {'index': index, 'status': 'valid'}
+        for index, item_errors in enumerate(errors)
+    ]
+
+
+def bulk_create_books(items, user, request=None):
+    """Создать книги из провалидированных данных одной транзакцией"""
+    books = []
+    book_genres = []
+    for data in items:
+        data = dict(data)
+        book_genres.append([genre.pk for genre in data.pop('genres', [])])
+        books.append(Book(owner=user, **data))
+
+    with transaction.atomic():
+        books = bulk_create_with_history(
+            books, Book, default_user=user, default_change_reason="Создана через API (пакетно)"
+        )
+        Through = Book.genres.through
+        Through.objects.bulk_create([
+            Through(book_id=book.pk, genre_id=genre_id)
+            for book, genre_ids in zip(books, book_genres)
+            for genre_id in genre_ids
+        ])
+        # Без истории жанров версии показывали бы пустой список, а восстановление стирало бы жанры
+        bulk_create_m2m_history(Book, list(Book.history.filter(id__in=[book.pk for book in books], history_type='+')))
+        bulk_log_user_activity(
+            user, 'create_book', 'Book',
+            [(book.pk, f"Создана книга '{book.title}'") for book in books],
+            request
+        )
+
+        new_books = {book.pk: genre_ids for book, genre_ids in zip(books, book_genres)}
+        transaction.on_commit(lambda: genre_index.add_new_books(new_books))
+        transaction.on_commit(invalidate_suggest_index)
+    return books
+
+
+def find_review_conflicts(items, user):
+    """Ошибки уникальности (книга, пользователь) для каждого элемента, в том числе внутри пачки"""
+    book_ids = [data['book'].pk for data in items]
+    reviewed = set(
+        Review.objects.filter(user=user, book_id__in=book_ids).values_list('book_id', flat=True)
+    )
+    errors = []
+    for book_id in book_ids:
+        if book_id in reviewed:
+            errors.append({'book': ['Вы уже оставили отзыв на эту книгу.']})
+        else:
+            errors.append({})
+        reviewed.add(book_id)
+    return errors
+
+
+def bulk_create_reviews(items, user, request=None):
+    """Создать отзывы текущего пользователя одной транзакцией"""
+    reviews = [
+        Review(user=user, book=data['book'], text=data['text'], rating=data['rating'])
+        for data in items
+    ]
+
+    with transaction.atomic():
+        reviews = bulk_create_with_history(
+            reviews, Review, default_user=user, default_change_reason="Создан через API (пакетно)"
+        )
+        books = {data['book'].pk: data['book'] for data in items}
+        bulk_log_user_activity(
+            user, 'create_review', 'Review',
+            [(review.pk, f"Создан отзыв на книгу '{books[review.book_id].title}'") for review in reviews],
+            request
+        )
+
+        book_ids = list(books)
+        transaction.on_commit(lambda: refresh_book_scores(book_ids))
+    return reviews
+
+
+def bulk_mark_messages_read(ids, user, request=None):
+    """Отметить входящие сообщения прочитанными, результат по каждому id"""
+    ids = list(dict.fromkeys(ids))
+    messages = Message.objects.filter(recipient=user, pk__in=ids).select_related('sender').in_bulk()
+    to_mark = [message for message in messages.values() if not message.is_read]
+
+    with transaction.atomic():
+        for message in to_mark:
+            message.is_read = True
+        bulk_update_with_history(
+            to_mark, Message, ['is_read'],
+            default_user=user,
+            default_change_reason="Отмечено как прочитанное через API (пакетно)"
+        )
+        bulk_log_user_activity(
+            user, 'read_message', 'Message',
+            [(message.pk, f"Прочитано сообщение от {message.sender.username}") for message in to_mark],
+            request
+        )
+
+    marked_ids = {message.pk for message in to_mark}
+    results = []
+    for message_id in ids:
+        message = messages.get(message_id)
+        if message is None:
+            status = 'not_found'
+        elif message_id in marked_ids:
+            status = 'marked'
+        else:
+            status = 'already_read'
+        results.append({'id': message_id, 'status': status})
+    return results
+
+
+def mark_all_messages_read(user, queryset=None, request=None):
+    """Отметить прочитанными все входящие (или подмножество queryset) одним UPDATE
+
+    Возвращает (сколько отмечено, сколько непрочитанных осталось).
+    """
+    queryset = Message.objects.all() if queryset is None else queryset
+    unread = queryset.filter(recipient=user, is_read=False).order_by()
+
+    with transaction.atomic():
+        message_ids = list(unread.select_for_update().values_list('pk', flat=True))
+        marked = unread.filter(pk__in=message_ids).update(is_read=True)
+
+        history = Message.history
+        for batch_start in range(0, len(message_ids), HISTORY_BATCH_SIZE):
+            batch_ids = message_ids[batch_start:batch_start + HISTORY_BATCH_SIZE]
+            history.bulk_history_create(
+                list(Message.objects.filter(pk__in=batch_ids)),
+                update=True,
+                default_user=user,
+                default_change_reason="Все сообщения отмечены как прочитанные"
+            )
+        if marked:
+            log_user_activity(
+                user, 'read_message', 'Message', None,
+                f"Отмечено как прочитанные: {marked}",
+                request
+            )
+        unread_count = Message.objects.filter(recipient=user, is_read=False).count()
+    return marked, unread_count
@@ -0,0 +1,18 @@
+"""Вспомогательные функции для работы с кэшем"""
+from django.core.cache import cache
+
+
+def bump_cache_version(key):
+    """Увеличить счетчик версии в кэше и вернуть новое значение
+
+    Счетчик используется для сброса данных, которые каждый процесс
+    держит в памяти: процесс сравнивает свою версию со значением в кэше.
+    """
+    if cache.add(key, 1, timeout=None):
+        return 1
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Ключ успел истечь между add и incr
+        cache.set(key, 1, timeout=None)
+        return 1
@@ -0,0 +1,81 @@
+"""Оптимистическая блокировка книг и отзывов по колонке version
+
+Изменение записывается одним запросом UPDATE ... SET <измененные поля>,
+version = N + 1 WHERE id = ... AND version = N. Если строку уже изменил
+другой запрос, UPDATE не затрагивает ни одной строки и вызывается
+VersionConflict - ничего не записано, версия истории не создана.
+В API версия передается как ETag, клиент возвращает ее в If-Match.
+"""
+import re
+
+ETAG_RE = re.compile(r'^(?:W/)?"(\d+)"$')
+
+
+class VersionConflict(Exception):
+    """Объект изменен после того, как его прочитал клиент"""
+
+    def __init__(self, instance):
+        super().__init__(f'{instance._meta.label} {instance.pk}: версия устарела')
+        self.instance = instance
+
+
+class VersionedModelMixin:
+    """Примесь к модели с полем version: save() с проверкой версии в WHERE"""
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        expected_version = getattr(self, '_expected_version', None)
+        if expected_version is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        updated = super()._do_update(
+            base_qs.filter(version=expected_version), using, pk_val, values, update_fields, forced_update
+        )
+        if not updated:
+            raise VersionConflict(self)
+        return updated
+
+
+def save_changes(instance, fields, expected_version=None, touch=False):
+    """Записать только поля fields, если версия в базе равна expected_version
+
+    touch - увеличить версию, даже если колонки не менялись (изменились
+    только связи ManyToMany). Возвращает True, если запись была.
+    """
+    current_version = instance.version
+    if expected_version is None:
+        expected_version = current_version
+    if expected_version != current_version:
+        raise VersionConflict(instance)
+    if not fields and not touch:
+        return False
+
+    auto_now = [field.name for field in instance._meta.concrete_fields if getattr(field, 'auto_now', False)]
+    instance._expected_version = expected_version
+    instance.version = expected_version + 1
+    try:
+        instance.save(update_fields={*fields, *auto_now, 'version'})
+    except Exception:
+        instance.version = current_version
+        raise
+    finally:
+        del instance._expected_version
+    return True
+
+
+def version_etag(instance):
+    return f'"{instance.version}"'
+
+
+def parse_if_match(value):
+    """Версии из заголовка If-Match; None - заголовка нет или это '*'
+
+    ValueError, если значение не похоже на ETag версии.
+    """
+    if value is None or value.strip() == '*':
+        return None
+    versions = set()
+    for tag in value.split(','):
+        match = ETAG_RE.match(tag.strip())
+        if not match:
+            raise ValueError(tag)
+        versions.add(int(match.group(1)))
+    return versions
@@ -0,0 +1,6 @@
+from django.conf import settings
+
+
+def fragment_cache(request):
+    """Время жизни фрагментов для тега {% cache %}"""
+    return {'FRAGMENT_CACHE_TIMEOUT': settings.FRAGMENT_CACHE_TIMEOUT}
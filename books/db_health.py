@@ -0,0 +1,86 @@
+"""Проверка доступности баз данных и метрики пула соединений"""
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .db_router import get_replica_lag
+
+# Колонки SHOW POOLS, которые отдаем в метриках
+PGBOUNCER_POOL_FIELDS = (
+    'cl_active', 'cl_waiting', 'sv_active', 'sv_idle', 'sv_used', 'maxwait',
+)
+
+
+def check_database(alias):
+    """Проверка одной базы: SELECT 1 и время ответа"""
+    started = time.monotonic()
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+    except DatabaseError as e:
+        return {'ok': False, 'error': str(e)}
+
+    result = {'ok': True, 'latency_ms': round((time.monotonic() - started) * 1000, 2)}
+    if alias in getattr(settings, 'DATABASE_REPLICAS', []):
+        try:
+            result['lag_seconds'] = get_replica_lag(alias)
+        except DatabaseError:
+            result['lag_seconds'] = None
+    return result
+
+
+def get_pgbouncer_pools():
+    """Состояние пулов PgBouncer (SHOW POOLS) для нашей базы"""
+    if not settings.PGBOUNCER_ADMIN_URL:
+        return None
+
+    import psycopg2
+
+    database_name = settings.DATABASES['default']['NAME']
+    try:
+        connection = psycopg2.connect(settings.PGBOUNCER_ADMIN_URL, connect_timeout=5)
+    except psycopg2.Error as e:
+        return {'error': str(e)}
+
+    try:
+        # Консоль PgBouncer не поддерживает транзакции
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW POOLS')
+            columns = [column.name for column in cursor.description]
+            pools = []
+            for row in cursor.fetchall():
+                pool = dict(zip(columns, row))
+                if pool['database'] != database_name:
+                    continue
+                pools.append({
+                    'user': pool['user'],
+                    'pool_mode': pool.get('pool_mode'),
+                    **{field: pool.get(field) for field in PGBOUNCER_POOL_FIELDS},
+                })
+            return pools
+    except psycopg2.Error as e:
+        return {'error': str(e)}
+    finally:
+        connection.close()
+
+
+def get_database_health(detailed=False):
+    """Сводка по всем базам; detailed - с ошибками баз и пулами PgBouncer
+
+    Без detailed наружу уходит только общий статус: текст ошибок
+    подключения и SHOW POOLS раскрывают внутреннее устройство.
+    """
+    databases = {alias: check_database(alias) for alias in connections}
+    ok = all(result['ok'] for result in databases.values())
+    health = {'ok': ok, 'status': 'ok' if ok else 'unavailable'}
+    if not detailed:
+        return health
+    return {
+        **health,
+        'pool_mode': settings.DATABASE_POOL_MODE,
+        'databases': databases,
+        'pgbouncer_pools': get_pgbouncer_pools(),
+    }
@@ -0,0 +1,121 @@
+"""Маршрутизация чтения по репликам базы данных"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+PRIMARY_DB = 'default'
+
+# Приложения, которые всегда читаются из основной базы: отставание реплики
+# по сессиям приводило бы к внезапному выходу пользователя из системы
+PRIMARY_ONLY_APPS = ('sessions',)
+
+# Можно ли в текущем запросе читать из реплик
+_read_from_replica = ContextVar('read_from_replica', default=False)
+# Была ли в текущем запросе запись в основную базу
+_wrote_to_primary = ContextVar('wrote_to_primary', default=False)
+# Реплика, выбранная для текущего запроса: все чтения идут в одну реплику,
+# чтобы список, его COUNT и prefetch видели одинаковое состояние данных
+_replica_alias = ContextVar('replica_alias', default=None)
+
+# Кэш проверок отставания: alias -> (время проверки, реплика пригодна)
+_replica_health = {}
+
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def get_replica_aliases():
+    """Список псевдонимов реплик из настроек"""
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def get_replica_lag(alias):
+    """Отставание реплики в секундах"""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        # У SQLite и прочих локальных баз репликации нет
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(REPLICA_LAG_SQL)
+        return float(cursor.fetchone()[0])
+
+
+def is_replica_healthy(alias):
+    """Реплика доступна и отстает не больше допустимого"""
+    now = time.monotonic()
+    checked_at, healthy = _replica_health.get(alias, (None, False))
+    if checked_at is not None and now - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return healthy
+
+    try:
+        healthy = get_replica_lag(alias) <= settings.REPLICA_MAX_LAG_SECONDS
+    except DatabaseError:
+        healthy = False
+    _replica_health[alias] = (now, healthy)
+    return healthy
+
+
+def get_healthy_replicas():
+    return [alias for alias in get_replica_aliases() if is_replica_healthy(alias)]
+
+
+def pin_to_primary():
+    """Все дальнейшие чтения в рамках запроса идут в основную базу"""
+    _read_from_replica.set(False)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """Разрешить чтение из реплик внутри блока
+
+    Возвращает словарь состояния: после выхода из блока ключ ``wrote``
+    показывает, была ли запись в основную базу.
+    """
+    state = {'wrote': False}
+    read_token = _read_from_replica.set(enabled)
+    write_token = _wrote_to_primary.set(False)
+    alias_token = _replica_alias.set(None)
+    try:
+        yield state
+    finally:
+        state['wrote'] = _wrote_to_primary.get()
+        _replica_alias.reset(alias_token)
+        _wrote_to_primary.reset(write_token)
+        _read_from_replica.reset(read_token)
+
+
+class ReadReplicaRouter:
+    """Роутер: запись в основную базу, чтение из реплик, если это разрешено"""
+
+    def db_for_read(self, model, **hints):
+        if not _read_from_replica.get() or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return PRIMARY_DB
+        alias = _replica_alias.get()
+        if alias is None:
+            # Реплика выбирается один раз на блок replica_reads (запрос)
+            replicas = get_healthy_replicas()
+            alias = random.choice(replicas) if replicas else PRIMARY_DB
+            _replica_alias.set(alias)
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # После записи читаем свои же изменения из основной базы
+        _wrote_to_primary.set(True)
+        _read_from_replica.set(False)
+        return PRIMARY_DB
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        databases = {PRIMARY_DB, *get_replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,79 @@
+"""Запись только измененных полей модели
+
+Примесь запоминает значения, загруженные из базы, и при save() без
+update_fields пишет UPDATE только с изменившимися колонками. Если не
+изменилось ничего, запрос не выполняется; если не изменилось ни одно
+поле, отслеживаемое историей, версия истории не создается.
+"""
+from django.db.models.base import DEFERRED
+from django.db.models.fields.files import FieldFile
+
+
+class DirtyFieldsMixin:
+    """Примесь к модели: save() записывает только измененные поля"""
+
+    _loaded_values = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            attname: value for attname, value in zip(field_names, values) if value is not DEFERRED
+        }
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        if self._loaded_values is not None:
+            self._loaded_values.update(self._current_values(fields))
+
+    def _current_values(self, fields=None):
+        values = {}
+        for field in self._meta.concrete_fields:
+            if fields is not None and field.name not in fields and field.attname not in fields:
+                continue
+            if field.attname not in self.__dict__:
+                continue  # отложенное поле, которое не читали
+            value = getattr(self, field.attname)
+            if isinstance(value, FieldFile):
+                # Новый файл еще не записан - поле считается измененным
+                value = value.name if value._committed else value
+            values[field.attname] = value
+        return values
+
+    def get_dirty_fields(self):
+        """Имена полей, изменившихся после загрузки из базы"""
+        loaded = self._loaded_values or {}
+        current = self._current_values()
+        return [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and field.attname in current
+            and (field.attname not in loaded or loaded[field.attname] != current[field.attname])
+        ]
+
+    def save(self, *args, **kwargs):
+        if args or self._state.adding or self._loaded_values is None or kwargs.get('force_insert'):
+            super().save(*args, **kwargs)
+            self._loaded_values = self._current_values()
+            return
+
+        dirty = self.get_dirty_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            if not dirty:
+                return
+            auto_now = [field.name for field in self._meta.concrete_fields if getattr(field, 'auto_now', False)]
+            update_fields = kwargs['update_fields'] = {*dirty, *auto_now}
+        else:
+            dirty = [name for name in dirty if name in update_fields]
+
+        tracked = {field.name for field in type(self).history.model.tracked_fields}
+        skip_history = not tracked.intersection(dirty) and not hasattr(self, 'skip_history_when_saving')
+        if skip_history:
+            self.skip_history_when_saving = True
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            if skip_history:
+                del self.skip_history_when_saving
+        self._loaded_values.update(self._current_values(update_fields))
@@ -0,0 +1,69 @@
+"""Фасеты каталога: количество книг по жанрам, первой букве автора и наличию файла"""
+from django.db.models import Case, CharField, Count, Q, Value, When
+from django.db.models.functions import Cast, Substr, Upper
+
+from .models import Book, Genre
+
+NO_FILE_Q = Q(book_file='') | Q(book_file__isnull=True)
+
+
+def filter_by_has_file(queryset, has_file):
+    """Фильтр по наличию файла: has_file - строка 'true'/'false' из запроса"""
+    if has_file.lower() == 'true':
+        return queryset.exclude(NO_FILE_Q)
+    return queryset.filter(NO_FILE_Q)
+
+
+def filter_by_author_initial(queryset, initial):
+    """Фильтр по первой букве автора"""
+    return queryset.filter(author__istartswith=initial[:1])
+
+
+def get_catalog_facets(queryset):
+    """Счетчики фасетов для текущей выборки книг
+
+    Все три фасета считаются одним запросом (UNION ALL трех GROUP BY
+    по подзапросу с текущими фильтрами), а не отдельным COUNT на каждый жанр.
+    """
+    book_ids = queryset.order_by().values('pk')
+    books = Book.objects.filter(pk__in=book_ids).order_by()
+
+    by_genre = Book.genres.through.objects.filter(book_id__in=book_ids).order_by().values('genre_id').annotate(
+        facet=Value('genre', output_field=CharField()),
+        value=Cast('genre_id', output_field=CharField()),
+        count=Count('book_id'),
+    ).values_list('facet', 'value', 'count')
+
+    by_initial = books.annotate(
+        facet=Value('author', output_field=CharField()),
+        value=Upper(Substr('author', 1, 1)),
+    ).values('facet', 'value').annotate(count=Count('pk')).values_list('facet', 'value', 'count')
+
+    by_file = books.annotate(
+        facet=Value('has_file', output_field=CharField()),
+        value=Case(When(NO_FILE_Q, then=Value('false')), default=Value('true'), output_field=CharField()),
+    ).values('facet', 'value').annotate(count=Count('pk')).values_list('facet', 'value', 'count')
+
+    genre_counts = {}
+    initial_counts = {}
+    file_counts = {'true': 0, 'false': 0}
+    for facet, value, count in by_genre.union(by_initial, by_file, all=True):
+        if facet == 'genre':
+            genre_counts[int(value)] = count
+        elif facet == 'author':
+            initial_counts[value] = count
+        else:
+            file_counts[value] = count
+
+    return {
+        'total': file_counts['true'] + file_counts['false'],
+        'genres': [
+            {'id': genre_id, 'name': name, 'count': genre_counts.get(genre_id, 0)}
+            for genre_id, name in Genre.objects.order_by('name').values_list('id', 'name')
+        ],
+        'author_initials': [
+            {'value': initial, 'count': count}
+            for initial, count in sorted(initial_counts.items())
+        ],
+        'has_file': file_counts,
+    }
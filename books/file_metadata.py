@@ -0,0 +1,103 @@
+"""Сведения о файле книги: размер, формат, SHA-256 и число страниц
+
+Вычисляются один раз после загрузки фоновой задачей и хранятся в колонках
+Book, поэтому списки, API и админка не обращаются к хранилищу файлов.
+Файл читается потоком по частям, целиком в память не загружается.
+"""
+import hashlib
+import mimetypes
+import re
+import zipfile
+
+from django.utils import timezone
+
+from .jobs import enqueue, task
+from .models import Book
+
+CHUNK_SIZE = 1024 * 1024
+
+# Сигнатуры форматов по первым байтам файла
+MAGIC_MIME_TYPES = [
+    (b'%PDF-', 'application/pdf'),
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\xd0\xcf\x11\xe0', 'application/msword'),
+]
+
+# Объект страницы PDF (/Type /Pages - узел дерева страниц - не подходит)
+PDF_PAGE_RE = re.compile(rb'/Type\s{0,8}/Page[^s]')
+PDF_PAGE_OVERLAP = 32
+
+
+def detect_mime(head, name, file):
+    """MIME по сигнатуре, для ZIP - EPUB/DOCX по содержимому, иначе по расширению"""
+    guessed = mimetypes.guess_type(name)[0] or ''
+    if name.lower().endswith('.fb2'):
+        guessed = 'application/x-fictionbook+xml'
+
+    for magic, mime in MAGIC_MIME_TYPES:
+        if head.startswith(magic):
+            break
+    else:
+        return guessed or 'application/octet-stream'
+
+    if mime != 'application/zip':
+        return mime
+    try:
+        file.seek(0)
+        with zipfile.ZipFile(file) as archive:
+            names = set(archive.namelist())
+            if 'mimetype' in names:
+                return archive.read('mimetype').decode('ascii', 'ignore').strip() or mime
+            if 'word/document.xml' in names:
+                return 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+    except (zipfile.BadZipFile, OSError):
+        pass
+    return mime
+
+
+def read_file_metadata(field_file):
+    """Прочитать файл один раз: {file_size, file_mime, file_sha256, page_count}"""
+    sha256 = hashlib.sha256()
+    size = 0
+    pages = 0
+    head = b''
+    tail = b''
+
+    with field_file.open('rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            if not head:
+                head = chunk[:8]
+            sha256.update(chunk)
+            size += len(chunk)
+            # Хвост предыдущей части: совпадения на стыке не теряются и не считаются дважды
+            data = tail + chunk
+            pages += sum(1 for match in PDF_PAGE_RE.finditer(data) if match.end() > len(tail))
+            tail = data[-PDF_PAGE_OVERLAP:]
+
+        mime = detect_mime(head, field_file.name, file)
+
+    return {
+        'file_size': size,
+        'file_mime': mime,
+        'file_sha256': sha256.hexdigest(),
+        # Страницы сжатых потоков объектов не видны - тогда число неизвестно
+        'page_count': pages if mime == 'application/pdf' and pages else None,
+    }
+
+
+@task('books.extract_file_metadata')
+def extract_file_metadata(book_id):
+    """Фоновая задача: заполнить сведения о файле книги"""
+    book = Book.objects.filter(pk=book_id).only('pk', 'book_file').first()
+    if book is None or not book.book_file:
+        return
+    metadata = read_file_metadata(book.book_file)
+    # update() без истории; updated_at сбрасывает кэш фрагментов карточки книги
+    Book.objects.filter(pk=book_id, book_file=book.book_file.name).update(
+        updated_at=timezone.now(), **metadata
+    )
+
+
+def schedule_file_metadata(book_id):
+    """Поставить в очередь вычисление сведений о файле книги"""
+    return enqueue('books.extract_file_metadata', book_id=book_id)
@@ -2,9 +2,14 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
+from django.db import transaction
+from .concurrency import save_changes
 from .models import Book, Review, UserProfile, Genre, Message
 
 class BookForm(forms.ModelForm):
+    # Версия книги на момент открытия формы (оптимистическая блокировка)
+    version = forms.IntegerField(widget=forms.HiddenInput, required=False)
+
     class Meta:
         model = Book
         fields = ['title', 'author', 'genres', 'description', 'cover_image', 'book_file']
@@ -17,6 +22,11 @@ class BookForm(forms.ModelForm):
             'book_file': forms.FileInput(attrs={'class': 'form-control', 'accept': '.pdf,.epub,.fb2,.txt,.doc,.docx'}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.fields['version'].initial = self.instance.version
+
     def clean_title(self):
         title = self.cleaned_data.get('title')
 
@@ -46,6 +56,17 @@ class BookForm(forms.ModelForm):
             self.save_m2m()
         return book
 
+    def save_changes(self):
+        """Записать только измененные поля, если книгу не изменили после открытия формы"""
+        book = self.instance
+        fields = [name for name in self.changed_data if name in self._meta.fields and name != 'genres']
+        genres_changed = 'genres' in self.changed_data
+        with transaction.atomic():
+            save_changes(book, fields, self.cleaned_data.get('version'), touch=genres_changed)
+            if genres_changed:
+                book.genres.set(self.cleaned_data['genres'])
+        return book
+
 class ReviewForm(forms.ModelForm):
     class Meta:
         model = Review
@@ -0,0 +1,236 @@
+"""Битовый индекс жанров в памяти процесса
+
+Для каждого жанра хранится битовая карта (Python int): бит N установлен,
+если книга с id=N относится к жанру. Запросы AND/OR/NOT по жанрам сводятся
+к побитовым операциям, а в запрос к БД уходит готовый список id без
+соединений через таблицу Book.genres. Список id передается одним
+параметром-массивом (pk = ANY(%s)); если книг в результате больше
+GENRE_INDEX_MAX_IDS, фильтр строится подзапросами EXISTS по Book.genres,
+чтобы не передавать в запрос десятки тысяч id.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Exists, F, Lookup, OuterRef
+
+from .cache_utils import bump_cache_version
+from .models import Book
+
+GENRE_INDEX_VERSION_KEY = 'books:genre_index:version'
+
+logger = logging.getLogger(__name__)
+
+
+def ids_to_bitmap(ids):
+    """Список id -> битовая карта; строится за O(n) через numpy"""
+    if not ids:
+        return 0
+    bits = np.zeros(max(ids) + 1, dtype=bool)
+    bits[ids] = True
+    return int.from_bytes(np.packbits(bits, bitorder='little').tobytes(), 'little')
+
+
+def bitmap_to_ids(bitmap):
+    """Битовая карта -> отсортированный список id"""
+    if not bitmap:
+        return []
+    raw = np.frombuffer(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little'), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(raw, bitorder='little')).tolist()
+
+
+def parse_id_list(values):
+    """['1,2', '3'] -> [1, 2, 3]; нечисловые значения пропускаются"""
+    ids = []
+    for value in values:
+        for part in value.split(','):
+            part = part.strip()
+            if part.isdigit():
+                ids.append(int(part))
+    return ids
+
+
+class GenreBitmapIndex:
+    """Битовые карты жанров; состояние (карты, все книги) меняется одним присваиванием
+
+    Устаревший индекс перестраивается в фоновом потоке, запросы до конца
+    перестройки получают прежний индекс, а до первой постройки - None
+    (фильтр идет подзапросами по Book.genres).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None  # ({genre_id: битовая карта}, битовая карта всех книг)
+        self._version = None
+        self._built_at = 0.0
+        self._rebuilding = False
+
+    def build(self):
+        genre_books = defaultdict(list)
+        for book_id, genre_id in Book.genres.through.objects.values_list('book_id', 'genre_id').iterator():
+            genre_books[genre_id].append(book_id)
+        all_books = list(Book.objects.values_list('pk', flat=True).iterator())
+        return {genre_id: ids_to_bitmap(ids) for genre_id, ids in genre_books.items()}, ids_to_bitmap(all_books)
+
+    def rebuild(self):
+        """Перестроить индекс в текущем потоке"""
+        version = cache.get(GENRE_INDEX_VERSION_KEY, 0)
+        state = self.build()
+        with self._lock:
+            self._state = state
+            # Изменения во время build() увеличили версию - индекс снова будет устаревшим
+            self._version = version
+            self._built_at = time.monotonic()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Не удалось перестроить индекс жанров')
+        finally:
+            self._rebuilding = False
+            connections.close_all()
+
+    def ensure_fresh(self):
+        """Запустить фоновую перестройку, если индекс устарел; запрос ее не ждет"""
+        version = cache.get(GENRE_INDEX_VERSION_KEY, 0)
+        if self._version == version and time.monotonic() - self._built_at < settings.GENRE_INDEX_TTL:
+            return
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    def query_bitmap(self, all_of=(), any_of=(), none_of=()):
+        """Битовая карта книг, у которых есть все жанры all_of, хотя бы один из any_of и нет ни одного из none_of
+
+        None - индекс еще не построен.
+        """
+        self.ensure_fresh()
+        state = self._state
+        if state is None:
+            return None
+        bitmaps, result = state
+        for genre_id in all_of:
+            result &= bitmaps.get(genre_id, 0)
+        if any_of:
+            union = 0
+            for genre_id in any_of:
+                union |= bitmaps.get(genre_id, 0)
+            result &= union
+        for genre_id in none_of:
+            result &= ~bitmaps.get(genre_id, 0)
+        return result
+
+    # Инкрементальные обновления из сигналов: update(bitmaps, all_books) правит копию
+    # словаря карт и возвращает новую карту всех книг
+
+    def _apply(self, update):
+        """Применить изменение локально и сообщить остальным процессам"""
+        with self._lock:
+            if self._state is None:
+                # Индекс еще не строился - построится при первом запросе
+                bump_cache_version(GENRE_INDEX_VERSION_KEY)
+                return
+            bitmaps, all_books = self._state
+            bitmaps = dict(bitmaps)
+            all_books = update(bitmaps, all_books)
+            self._state = (bitmaps, all_books)
+            new_version = bump_cache_version(GENRE_INDEX_VERSION_KEY)
+            if new_version == self._version + 1:
+                # Других изменений не было - локальный индекс актуален
+                self._version = new_version
+
+    def add_books(self, genre_id, book_ids):
+        def update(bitmaps, all_books):
+            for book_id in book_ids:
+                bitmaps[genre_id] = bitmaps.get(genre_id, 0) | (1 << book_id)
+            return all_books
+        self._apply(update)
+
+    def remove_books(self, genre_id, book_ids):
+        def update(bitmaps, all_books):
+            for book_id in book_ids:
+                bitmaps[genre_id] = bitmaps.get(genre_id, 0) & ~(1 << book_id)
+            return all_books
+        self._apply(update)
+
+    def add_book(self, book_id):
+        def update(bitmaps, all_books):
+            return all_books | (1 << book_id)
+        self._apply(update)
+
+    def add_new_books(self, book_genres):
+        """Пакет новых книг: {book_id: [genre_id, ...]}"""
+        def update(bitmaps, all_books):
+            for book_id, genre_ids in book_genres.items():
+                all_books |= 1 << book_id
+                for genre_id in genre_ids:
+                    bitmaps[genre_id] = bitmaps.get(genre_id, 0) | (1 << book_id)
+            return all_books
+        self._apply(update)
+
+    def remove_book(self, book_id):
+        def update(bitmaps, all_books):
+            mask = ~(1 << book_id)
+            for genre_id in bitmaps:
+                bitmaps[genre_id] &= mask
+            return all_books & mask
+        self._apply(update)
+
+    def clear_book_genres(self, book_id):
+        def update(bitmaps, all_books):
+            mask = ~(1 << book_id)
+            for genre_id in bitmaps:
+                bitmaps[genre_id] &= mask
+            return all_books
+        self._apply(update)
+
+    def clear_genre(self, genre_id):
+        def update(bitmaps, all_books):
+            bitmaps.pop(genre_id, None)
+            return all_books
+        self._apply(update)
+
+
+genre_index = GenreBitmapIndex()
+
+
+class AnyOf(Lookup):
+    """pk = ANY(%s): весь список id - один параметр-массив PostgreSQL"""
+    lookup_name = 'any_of'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        return f'{lhs} = ANY(%s)', [*lhs_params, list(self.rhs)]
+
+
+def genre_conditions(all_of=(), any_of=(), none_of=()):
+    """Те же условия, что у индекса, подзапросами EXISTS по таблице Book.genres"""
+    through = Book.genres.through.objects.filter(book_id=OuterRef('pk'))
+    conditions = [Exists(through.filter(genre_id=genre_id)) for genre_id in all_of]
+    if any_of:
+        conditions.append(Exists(through.filter(genre_id__in=any_of)))
+    if none_of:
+        conditions.append(~Exists(through.filter(genre_id__in=none_of)))
+    return conditions
+
+
+def filter_books_by_genres(queryset, all_of=(), any_of=(), none_of=()):
+    """Отфильтровать книги по жанрам через битовый индекс (без JOIN по Book.genres)"""
+    if not (all_of or any_of or none_of):
+        return queryset
+    result = genre_index.query_bitmap(all_of, any_of, none_of)
+    if result is None or result.bit_count() > settings.GENRE_INDEX_MAX_IDS:
+        return queryset.filter(*genre_conditions(all_of, any_of, none_of))
+    ids = bitmap_to_ids(result)
+    if connections[queryset.db].vendor == 'postgresql':
+        return queryset.filter(AnyOf(F('pk'), ids))
+    return queryset.filter(pk__in=ids)
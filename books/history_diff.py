@@ -0,0 +1,144 @@
+"""Изменения полей в истории и постраничный просмотр истории объекта
+
+Для моделей с историей на базе HistoryDiffModel при записи версии '~'
+в history_diff сохраняется {поле: [старое, новое]} относительно предыдущей
+версии (один запрос по индексу). История листается по ключу
+(history_date, history_id) без OFFSET и без загрузки всех версий.
+"""
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import FileField, Q
+from django.db.models.fields.files import FieldFile
+
+from .models import HistoryDiffModel
+
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def field_value(field, record):
+    """Значение поля для сравнения версий (у файлов - имя или None)"""
+    value = getattr(record, field.attname)
+    if isinstance(field, FileField):
+        # В истории файл хранится строкой; пустое имя, '' и NULL - одно и то же
+        name = value.name if isinstance(value, FieldFile) else value
+        return name or None
+    return value
+
+
+def m2m_value(field, record):
+    """Отсортированные id связанных объектов версии"""
+    target = f'{field.m2m_reverse_field_name()}_id'
+    if record._state.adding:
+        # Связи версии записываются после нее самой - пока берем текущие
+        pk_name = record.instance_type._meta.pk.attname
+        through = field.remote_field.through
+        rows = through.objects.filter(**{f'{field.m2m_field_name()}_id': getattr(record, pk_name)})
+        return sorted(rows.values_list(target, flat=True))
+    return sorted(getattr(record, field.name).values_list(target, flat=True))
+
+
+def compute_diff(old_record, new_record):
+    """{поле: [старое, новое]} для отслеживаемых полей и ManyToMany с историей"""
+    diff = {}
+    for field in new_record.tracked_fields:
+        old_value = field_value(field, old_record)
+        new_value = field_value(field, new_record)
+        if old_value != new_value:
+            diff[field.name] = [old_value, new_value]
+    for field in getattr(new_record, '_history_m2m_fields', ()):
+        old_value = m2m_value(field, old_record)
+        new_value = m2m_value(field, new_record)
+        if old_value != new_value:
+            diff[field.name] = [old_value, new_value]
+    return diff
+
+
+def previous_record(history_record):
+    """Предыдущая версия того же объекта (запись может быть еще не сохранена)"""
+    pk_name = history_record.instance_type._meta.pk.attname
+    return (
+        type(history_record).objects
+        .filter(**{pk_name: getattr(history_record, pk_name)}, history_date__lte=history_record.history_date)
+        .exclude(history_id=history_record.history_id)
+        .order_by('-history_date', '-history_id')
+        .first()
+    )
+
+
+def store_history_diff(history_record):
+    """Заполнить history_diff перед сохранением версии"""
+    if not isinstance(history_record, HistoryDiffModel) or history_record.history_type != '~':
+        return
+    previous = previous_record(history_record)
+    if previous is not None:
+        history_record.history_diff = compute_diff(previous, history_record)
+
+
+def encode_cursor(record):
+    """Курсор страницы: микросекунды history_date и history_id"""
+    micros = (record.history_date - _EPOCH) // timedelta(microseconds=1)
+    return f'{micros}.{record.history_id.hex}'
+
+
+def decode_cursor(cursor):
+    """Обратное к encode_cursor; ValueError для неверного курсора"""
+    micros, _, history_id = cursor.partition('.')
+    return _EPOCH + timedelta(microseconds=int(micros)), uuid.UUID(history_id)
+
+
+def history_page(history, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """Страница истории одного объекта от новых версий к старым
+
+    Возвращает (версии, курсор следующей страницы или None). У каждой
+    версии заполнен атрибут changes - список изменений полей.
+    """
+    queryset = history.order_by('-history_date', '-history_id')
+    if cursor:
+        history_date, history_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(history_date__lt=history_date) | Q(history_date=history_date, history_id__lt=history_id)
+        )
+
+    # Лишняя версия - признак следующей страницы и предыдущая версия для последней записи
+    records = list(queryset[:limit + 1])
+    for index, record in enumerate(records[:limit]):
+        diff = record.history_diff if isinstance(record, HistoryDiffModel) else None
+        if diff is None and record.history_type == '~' and index + 1 < len(records):
+            # Версии из bulk_update_with_history и записанные до появления history_diff
+            diff = compute_diff(records[index + 1], record)
+        record.changes = describe_changes(record, diff)
+
+    next_cursor = encode_cursor(records[limit - 1]) if len(records) > limit else None
+    return records[:limit], next_cursor
+
+
+def describe_changes(record, diff):
+    """Список изменений с названиями полей; None, если изменения неизвестны"""
+    if diff is None:
+        return None
+    opts = record.instance_type._meta
+    return [
+        {
+            'field': name,
+            'verbose_name': str(opts.get_field(name).verbose_name),
+            'old': old_value,
+            'new': new_value,
+        }
+        for name, (old_value, new_value) in diff.items()
+    ]
+
+
+def serialize_history_record(record):
+    """Версия для ответа API"""
+    return {
+        'history_id': str(record.history_id),
+        'history_date': record.history_date,
+        'history_type': record.history_type,
+        'history_change_reason': record.history_change_reason,
+        'history_user': record.history_user_id,
+        'changes': record.changes,
+    }
@@ -1,34 +1,139 @@
 """Утилиты для работы с историей изменений"""
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from datetime import timedelta
+from simple_history.utils import bulk_create_with_history
+from .history_diff import compute_diff, describe_changes
+from .jobs import enqueue, task
 from .models import Book, Review, UserProfile, Message, UserActivity
 
 
+def get_client_ip(request):
+    """IP адрес клиента с учетом прокси
+
+    X-Real-IP выставляет nginx; в X-Forwarded-For доверяем только последнему
+    адресу (его дописал nginx), первые клиент может подставить сам.
+    """
+    real_ip = request.META.get('HTTP_X_REAL_IP')
+    if real_ip:
+        return real_ip.strip()
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR')
+
+
 def log_user_activity(user, action, object_type=None, object_id=None, 
                      description=None, request=None):
-    """Логирование активности пользователя"""
+    """Логирование активности пользователя (запись создается фоновой задачей)"""
+    if user is None or not user.is_authenticated:
+        return None
+    
     activity_data = {
-        'user': user,
+        'user_id': user.pk,
         'action': action,
         'object_type': object_type,
         'object_id': object_id,
         'description': description,
+        'timestamp': timezone.now().isoformat(),
     }
     
     if request:
-        # Получаем IP адрес
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        
-        activity_data['ip_address'] = ip
+        activity_data['ip_address'] = get_client_ip(request)
         activity_data['user_agent'] = request.META.get('HTTP_USER_AGENT', '')
     
-    return UserActivity.objects.create(**activity_data)
+    return enqueue('books.log_user_activity', **activity_data)
+
+
+@task('books.log_user_activity')
+def create_user_activity(user_id, action, object_type=None, object_id=None, description=None,
+                         ip_address=None, user_agent='', timestamp=None):
+    """Фоновая задача: запись активности и ее истории"""
+    activity = UserActivity(
+        user_id=user_id,
+        action=action,
+        object_type=object_type or '',
+        object_id=object_id,
+        description=description or '',
+        ip_address=ip_address,
+        user_agent=user_agent,
+        timestamp=parse_datetime(timestamp) if timestamp else timezone.now(),
+    )
+    activity._history_user = User(pk=user_id)
+    # Запись и ее версия истории - вместе, чтобы повтор задачи не создал дубликат
+    with transaction.atomic():
+        activity.save()
+    return activity
+
+
+def bulk_create_m2m_history(model, versions):
+    """История ManyToMany-полей (жанров книги) для версий, созданных пакетно
+
+    bulk_history_create ее не пишет; связи берутся из текущих данных.
+    """
+    pk_name = model._meta.pk.attname
+    object_ids = {getattr(version, pk_name) for version in versions}
+    for field in model.history.model._history_m2m_fields:
+        through = field.remote_field.through
+        source, target = f'{field.m2m_field_name()}_id', f'{field.m2m_reverse_field_name()}_id'
+        links = {}
+        rows = through.objects.filter(**{f'{source}__in': object_ids}).values_list('pk', source, target)
+        for link_id, object_id, target_id in rows:
+            links.setdefault(object_id, []).append((link_id, target_id))
+        m2m_history = getattr(model.history.model, field.name).model
+        m2m_history.objects.bulk_create([
+            m2m_history(history=version, id=link_id, **{source: getattr(version, pk_name), target: target_id})
+            for version in versions
+            for link_id, target_id in links.get(getattr(version, pk_name), ())
+        ])
+
+
+def bulk_log_user_activity(user, action, object_type, entries, request=None):
+    """Логирование активности пачкой: entries - [(object_id, description), ...]
+
+    Как и log_user_activity, ставит в очередь одну задачу на всю пачку;
+    записи создаются одним INSERT с временем запроса.
+    """
+    if user is None or not user.is_authenticated or not entries:
+        return None
+
+    activity_data = {
+        'user_id': user.pk,
+        'action': action,
+        'object_type': object_type,
+        'entries': [[object_id, description] for object_id, description in entries],
+        'timestamp': timezone.now().isoformat(),
+    }
+
+    if request:
+        activity_data['ip_address'] = get_client_ip(request)
+        activity_data['user_agent'] = request.META.get('HTTP_USER_AGENT', '')
+
+    return enqueue('books.bulk_log_user_activity', **activity_data)
+
+
+@task('books.bulk_log_user_activity')
+def create_user_activities(user_id, action, object_type, entries, ip_address=None, user_agent='', timestamp=None):
+    """Фоновая задача: пачка записей активности и их истории"""
+    timestamp = parse_datetime(timestamp) if timestamp else timezone.now()
+    with transaction.atomic():
+        return bulk_create_with_history([
+            UserActivity(
+                user_id=user_id,
+                action=action,
+                object_type=object_type,
+                object_id=object_id,
+                description=description,
+                ip_address=ip_address,
+                user_agent=user_agent,
+                timestamp=timestamp,
+            )
+            for object_id, description in entries
+        ], UserActivity, default_user=User(pk=user_id))
 
 
 def get_user_activity_summary(user, days=30):
@@ -78,31 +183,24 @@ def compare_object_versions(obj, version1_id, version2_id):
     try:
         version1 = obj.history.get(history_id=version1_id)
         version2 = obj.history.get(history_id=version2_id)
-        
-        changes = []
-        for field in obj._meta.fields:
-            field_name = field.name
-            if field_name in ['id', 'history_id', 'history_date', 'history_change_reason', 'history_type']:
-                continue
-                
-            val1 = getattr(version1, field_name, None)
-            val2 = getattr(version2, field_name, None)
-            
-            if val1 != val2:
-                changes.append({
-                    'field': field_name,
-                    'old_value': val1,
-                    'new_value': val2,
-                    'field_verbose_name': field.verbose_name
-                })
-        
-        return {
-            'version1': version1,
-            'version2': version2,
-            'changes': changes
-        }
-    except:
+    except (obj.history.model.DoesNotExist, ValidationError):
+        # Нет такой версии или id - не UUID
         return None
+    
+    changes = [
+        {
+            'field': change['field'],
+            'old_value': change['old'],
+            'new_value': change['new'],
+            'field_verbose_name': change['verbose_name'],
+        }
+        for change in describe_changes(version2, compute_diff(version1, version2))
+    ]
+    return {
+        'version1': version1,
+        'version2': version2,
+        'changes': changes
+    }
 
 
 def get_system_activity_stats(days=30):
@@ -145,18 +243,21 @@ def restore_object_version(obj, history_id):
     
     try:
         historical_obj = obj.history.get(history_id=history_id)
-        
-        # Копируем все поля кроме служебных
-        for field in obj._meta.fields:
-            field_name = field.name
-            if field_name not in ['id', 'created_at']:
-                setattr(obj, field_name, getattr(historical_obj, field_name))
-        
-        obj._change_reason = f"Восстановлено до версии {history_id}"
-        obj.save()
-        return True
-    except:
+    except (obj.history.model.DoesNotExist, ValidationError):
         return False
+    
+    # Копируем отслеживаемые историей поля кроме служебных
+    # (исключенных из истории полей, например updated_at, в версии нет)
+    for field in historical_obj.tracked_fields:
+        if field.name not in ['id', 'created_at']:
+            setattr(obj, field.attname, getattr(historical_obj, field.attname))
+    
+    if hasattr(obj, 'version'):
+        # Клиенты со старой версией должны получить конфликт (books.concurrency)
+        obj.version += 1
+    obj._change_reason = f"Восстановлено до версии {history_id}"
+    obj.save()
+    return True
 
 
 def get_user_changes_timeline(user, days=30):
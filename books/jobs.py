@@ -0,0 +1,138 @@
+"""Фоновая очередь задач в PostgreSQL без внешнего брокера
+
+Задачи лежат в таблице Job. Обработчик (manage.py run_worker) забирает задачу
+короткой транзакцией: SELECT ... FOR UPDATE SKIP LOCKED и отметка locked_until
+(аренда на JOB_QUEUE_LEASE_SECONDS). Сама задача выполняется уже вне этой
+транзакции, поэтому долгая задача не держит блокировку и соединение PgBouncer
+в транзакции. Если обработчик упал, по истечении аренды задачу заберет другой.
+Неудачная задача повторяется с растущей задержкой, а после max_attempts
+переносится в DeadJob.
+
+Задача - функция, зарегистрированная декоратором @task('имя'); аргументы
+передаются именованными и должны сериализоваться в JSON.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import DeadJob, Job
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+
+def task(name):
+    """Зарегистрировать функцию как фоновую задачу"""
+    def decorator(func):
+        TASKS[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, delay=0, max_attempts=None, **payload):
+    """Поставить задачу в очередь
+
+    Запись в Job идет в текущей транзакции: задача появится в очереди,
+    только если транзакция запроса зафиксирована. С JOB_QUEUE_EAGER задача
+    выполняется сразу после фиксации, без обработчика (удобно в разработке).
+    """
+    if name not in TASKS:
+        raise KeyError(f'Неизвестная задача: {name}')
+
+    if settings.JOB_QUEUE_EAGER:
+        transaction.on_commit(lambda: TASKS[name](**payload))
+        return None
+
+    return Job.objects.create(
+        task=name,
+        payload=payload,
+        max_attempts=max_attempts or settings.JOB_QUEUE_MAX_ATTEMPTS,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def retry_delay(attempts):
+    """Экспоненциальная задержка перед повтором, секунд"""
+    return settings.JOB_QUEUE_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def _fail(job, error):
+    job.last_error = error
+    if job.attempts >= job.max_attempts:
+        DeadJob.objects.create(
+            task=job.task,
+            payload=job.payload,
+            attempts=job.attempts,
+            last_error=error,
+            created_at=job.created_at,
+        )
+        Job.objects.filter(pk=job.pk).delete()
+        logger.error('Задача %s перенесена в DeadJob после %s попыток', job, job.attempts)
+    else:
+        job.run_at = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+        job.locked_until = None
+        job.save(update_fields=['last_error', 'run_at', 'locked_until'])
+        logger.warning('Задача %s завершилась ошибкой, повтор в %s', job, job.run_at)
+
+
+def claim_next_job():
+    """Занять готовую задачу на JOB_QUEUE_LEASE_SECONDS; None, если очередь пуста
+
+    Попытка засчитывается при захвате: задача, на которой обработчик
+    падает, все равно попадет в DeadJob после max_attempts.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lte=now), run_at__lte=now)
+            .order_by('run_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        job.attempts += 1
+        job.locked_until = now + timedelta(seconds=settings.JOB_QUEUE_LEASE_SECONDS)
+        job.save(update_fields=['attempts', 'locked_until'])
+    return job
+
+
+def run_next_job():
+    """Забрать и выполнить одну готовую задачу; False, если очередь пуста"""
+    job = claim_next_job()
+    if job is None:
+        return False
+
+    func = TASKS.get(job.task)
+    try:
+        if func is None:
+            raise KeyError(f'Неизвестная задача: {job.task}')
+        # Вне транзакции: задачам, которым нужна атомарность, хватает своего atomic
+        func(**job.payload)
+    except Exception:
+        _fail(job, traceback.format_exc())
+    else:
+        Job.objects.filter(pk=job.pk).delete()
+    return True
+
+
+def requeue_dead_jobs(queryset):
+    """Вернуть отказавшие задачи в очередь, возвращает их количество"""
+    with transaction.atomic():
+        dead_jobs = list(queryset.select_for_update())
+        Job.objects.bulk_create([
+            Job(
+                task=dead_job.task,
+                payload=dead_job.payload,
+                max_attempts=settings.JOB_QUEUE_MAX_ATTEMPTS,
+            )
+            for dead_job in dead_jobs
+        ])
+        DeadJob.objects.filter(pk__in=[dead_job.pk for dead_job in dead_jobs]).delete()
+    return len(dead_jobs)
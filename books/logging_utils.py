@@ -0,0 +1,198 @@
+"""Неблокирующее логирование: очередь, JSON-строки, ротация и выборка
+
+Обработчик QueueListenerHandler только кладет запись в очередь, а на диск
+ее пишет отдельный поток QueueListener, поэтому поток запроса не ждет
+файловую систему. Файл ротируется по размеру под файловой блокировкой,
+так что несколько воркеров gunicorn пишут в один файл без потерь.
+Модуль загружается при настройке LOGGING, до инициализации приложений,
+поэтому не импортирует модели.
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+from datetime import datetime, timezone as dt_timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+try:
+    import fcntl
+except ImportError:  # Windows - блокировка между процессами недоступна
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Идентификатор текущего запроса (устанавливает RequestLogMiddleware)
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+# Дополнительные поля записи, которые попадают в JSON
+EXTRA_FIELDS = ('method', 'path', 'status', 'latency_ms', 'status_code', 'sample_rate')
+
+
+class RequestIdFilter(logging.Filter):
+    """Добавляет к записи request_id текущего запроса"""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = request_id_var.get()
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """Пропускает долю rate записей уровня INFO и ниже; предупреждения и ошибки - все"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or self.rate >= 1:
+            return True
+        if random.random() >= self.rate:
+            return False
+        # По sample_rate при анализе можно восстановить полное число записей
+        record.sample_rate = self.rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, tz=dt_timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+            'request_id': getattr(record, 'request_id', None),
+        }
+        for field in EXTRA_FIELDS:
+            if hasattr(record, field):
+                data[field] = getattr(record, field)
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        if orjson is not None:
+            return orjson.dumps(data, default=str).decode()
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class LockingRotatingFileHandler(RotatingFileHandler):
+    """Ротация по размеру, безопасная для нескольких процессов
+
+    Запись и ротация идут под блокировкой файла <имя>.lock. Если файл уже
+    переименовал другой процесс, он открывается заново перед записью.
+    Файл блокировки открывается в каждом процессе свой: flock не разделяет
+    процессы, унаследовавшие одно открытое описание файла после fork
+    (gunicorn --preload настраивает LOGGING в главном процессе).
+    """
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.lock_file = None
+        self._pid = os.getpid()
+
+    def _acquire_lock_file(self):
+        """Файл блокировки текущего процесса; унаследованные от родителя файлы открываются заново"""
+        pid = os.getpid()
+        if self._pid != pid:
+            if self.lock_file is not None:
+                self.lock_file.close()
+                self.lock_file = None
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+            self._pid = pid
+        if self.lock_file is None:
+            self.lock_file = open(f'{self.baseFilename}.lock', 'a')
+        return self.lock_file
+
+    def _reopen_if_rotated(self):
+        if self.stream is None:
+            return
+        try:
+            rotated = os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            rotated = True
+        if rotated:
+            self.stream.close()
+            self.stream = self._open()
+
+    def shouldRollover(self, record):
+        # Размер сравнивается по концу файла, куда дописывают и другие процессы
+        self._reopen_if_rotated()
+        return super().shouldRollover(record)
+
+    def emit(self, record):
+        if fcntl is None:
+            super().emit(record)
+            return
+        lock_file = self._acquire_lock_file()
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            super().emit(record)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def close(self):
+        super().close()
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+
+class QueueListenerHandler(QueueHandler):
+    """QueueHandler со своим потоком записи в target
+
+    Очередь ограничена: если поток записи не успевает, новые записи
+    отбрасываются (счетчик dropped), а не блокируют запрос.
+    """
+
+    def __init__(self, target, queue_size=10000):
+        self.target = target
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.listener = None
+        super().__init__(queue.Queue(queue_size))
+        self._start_listener()
+        # Поток записи не переживает fork (gunicorn --preload) - запускаем его в дочернем процессе заново
+        os.register_at_fork(after_in_child=self._restart_after_fork)
+
+    def _start_listener(self):
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+
+    def _restart_after_fork(self):
+        self.queue = queue.Queue(self.queue_size)
+        self._start_listener()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Дописать очередь до закрытия файла (logging.shutdown при выходе)
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        self.target.close()
+        super().close()
+
+
+def queued_file_handler(filename, max_bytes=0, backup_count=0, queue_size=10000):
+    """Фабрика для LOGGING: файл с ротацией за очередью
+
+    Сообщение форматирует сам QueueHandler (его formatter из LOGGING),
+    файловый обработчик пишет готовую строку.
+    """
+    target = LockingRotatingFileHandler(
+        filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True
+    )
+    target.setFormatter(logging.Formatter('%(message)s'))
+    return QueueListenerHandler(target, queue_size=queue_size)
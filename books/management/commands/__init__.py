@@ -0,0 +1 @@
+# Пустой файл для создания Python пакета
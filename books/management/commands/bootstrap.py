@@ -0,0 +1,178 @@
+import hashlib
+import os
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.staticfiles.finders import get_finders
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+
+from books.cache_utils import bump_cache_version
+from books.db_health import check_database
+from books.genre_index import GENRE_INDEX_VERSION_KEY
+from books.models import Book, Genre, UserProfile
+from books.scoring import refresh_book_scores
+from books.suggest import invalidate_suggest_index
+
+DEFAULT_GENRES = [
+    'Классическая литература', 'Современная проза', 'Фантастика',
+    'Фэнтези', 'Детектив', 'Роман', 'Поэзия', 'Биография',
+    'История', 'Философия', 'Психология', 'Научная литература',
+    'Детская литература', 'Приключения', 'Мистика', 'Антиутопия',
+    'Триллер', 'Ужасы', 'Комедия', 'Драма', 'Научпоп',
+]
+
+TEST_USERS = [
+    ('testuser1', 'test1@example.com', 'Иван', 'Петров'),
+    ('testuser2', 'test2@example.com', 'Мария', 'Сидорова'),
+    ('testuser3', 'test3@example.com', 'Алексей', 'Иванов'),
+]
+TEST_PASSWORD = 'testpass123'
+
+TEST_BOOKS = [
+    ('Война и мир', 'Лев Толстой', 'Классическая литература', 'Великий роман о войне 1812 года'),
+    ('1984', 'Джордж Оруэлл', 'Антиутопия', 'Роман-предупреждение о тоталитарном обществе'),
+    ('Мастер и Маргарита', 'Михаил Булгаков', 'Современная проза', 'Мистический роман о добре и зле'),
+    ('Гарри Поттер и философский камень', 'Дж.К. Роулинг', 'Фэнтези', 'Первая книга о юном волшебнике'),
+    ('Преступление и наказание', 'Федор Достоевский', 'Классическая литература', 'Психологический роман о преступлении'),
+]
+
+# Отпечаток исходных статических файлов последнего collectstatic
+STATIC_FINGERPRINT_FILE = '.collectstatic-fingerprint'
+
+
+class Command(BaseCommand):
+    help = (
+        'Подготовка к запуску в одном процессе: проверка БД, миграции, суперпользователь, '
+        'жанры, тестовые данные, рейтинги и статика (повторный запуск ничего не меняет)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--test-data', action='store_true', help='Создать тестовых пользователей и книги')
+        parser.add_argument('--skip-scores', action='store_true', help='Не пересчитывать рейтинги книг')
+        parser.add_argument(
+            '--force-collectstatic', action='store_true',
+            help='Собрать статику, даже если исходные файлы не менялись'
+        )
+        parser.add_argument('--db-timeout', type=int, default=60, help='Сколько секунд ждать базу данных')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        steps = [
+            ('Проверка базы данных', lambda: self.wait_for_database(options['db_timeout'])),
+            ('Миграции', self.migrate),
+            ('Суперпользователь', self.create_superuser),
+            ('Жанры', self.create_genres),
+        ]
+        if options['test_data']:
+            steps.append(('Тестовые данные', self.create_test_data))
+        if not options['skip_scores']:
+            steps.append(('Рейтинги книг', lambda: f'пересчитано: {refresh_book_scores()}'))
+        steps.append(('Статические файлы', lambda: self.collect_static(options['force_collectstatic'])))
+
+        for title, step in steps:
+            step_started = time.monotonic()
+            result = step()
+            self.stdout.write(f'{title}: {result} ({time.monotonic() - step_started:.2f} с)')
+
+        self.stdout.write(self.style.SUCCESS(f'Подготовка завершена за {time.monotonic() - started:.2f} с'))
+
+    def wait_for_database(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            result = check_database(DEFAULT_DB_ALIAS)
+            if result['ok']:
+                return f'доступна, {result["latency_ms"]} мс'
+            if time.monotonic() > deadline:
+                raise CommandError(f'База данных недоступна: {result["error"]}')
+            connections[DEFAULT_DB_ALIAS].close()
+            time.sleep(1)
+
+    def migrate(self):
+        executor = MigrationExecutor(connections[DEFAULT_DB_ALIAS])
+        plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+        if not plan:
+            return 'нет новых'
+        call_command('migrate', interactive=False, verbosity=0)
+        return f'применено: {len(plan)}'
+
+    def create_superuser(self):
+        username = os.environ.get('DJANGO_SUPERUSER_USERNAME', 'admin')
+        if User.objects.filter(username=username).exists():
+            return f'{username} уже существует'
+        User.objects.create_superuser(
+            username,
+            os.environ.get('DJANGO_SUPERUSER_EMAIL', 'admin@booksaw.local'),
+            os.environ.get('DJANGO_SUPERUSER_PASSWORD', 'admin123'),
+        )
+        return f'создан {username}'
+
+    def create_genres(self):
+        missing = set(DEFAULT_GENRES) - set(Genre.objects.filter(name__in=DEFAULT_GENRES).values_list('name', flat=True))
+        if missing:
+            # bulk_create не вызывает сигналы - историю и сброс индексов делаем сами
+            Genre.objects.bulk_create([Genre(name=name) for name in sorted(missing)], ignore_conflicts=True)
+            Genre.history.bulk_history_create(list(Genre.objects.filter(name__in=missing)))
+            invalidate_suggest_index()
+            bump_cache_version(GENRE_INDEX_VERSION_KEY)
+        return f'создано: {len(missing)}, всего: {Genre.objects.count()}'
+
+    def create_test_data(self):
+        usernames = [username for username, _, _, _ in TEST_USERS]
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        if len(existing) < len(TEST_USERS):
+            # Хэш пароля считается один раз на всех: PBKDF2 намеренно медленный
+            password = make_password(TEST_PASSWORD)
+            User.objects.bulk_create([
+                User(username=username, email=email, password=password, first_name=first_name, last_name=last_name)
+                for username, email, first_name, last_name in TEST_USERS
+                if username not in existing
+            ], ignore_conflicts=True)
+
+        users = list(User.objects.filter(username__in=usernames))
+        new_users = [user for user in users if user.username not in existing]
+        if new_users:
+            UserProfile.objects.bulk_create([
+                UserProfile(user=user, bio=f'Любитель чтения, пользователь {user.username}', location='Москва')
+                for user in new_users
+            ], ignore_conflicts=True)
+            UserProfile.history.bulk_history_create(list(UserProfile.objects.filter(user__in=new_users)))
+
+        created_books = 0
+        if Book.objects.count() < len(TEST_BOOKS) and users:
+            genres = {genre.name: genre for genre in Genre.objects.filter(name__in=[row[2] for row in TEST_BOOKS])}
+            existing_titles = set(Book.objects.filter(title__in=[row[0] for row in TEST_BOOKS]).values_list('title', flat=True))
+            for index, (title, author, genre_name, description) in enumerate(TEST_BOOKS):
+                if title in existing_titles or genre_name not in genres:
+                    continue
+                # Книг немного и создаются они один раз - через save(), с историей и сигналами
+                book = Book.objects.create(
+                    title=title, author=author, description=description, owner=users[index % len(users)]
+                )
+                book.genres.add(genres[genre_name])
+                created_books += 1
+        return f'пользователей: {len(TEST_USERS) - len(existing)}, книг: {created_books}'
+
+    def static_fingerprint(self):
+        digest = hashlib.sha256()
+        for finder in get_finders():
+            for path, storage in finder.list([]):
+                stat = os.stat(storage.path(path))
+                digest.update(f'{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode())
+        return digest.hexdigest()
+
+    def collect_static(self, force):
+        static_root = Path(settings.STATIC_ROOT)
+        fingerprint_file = static_root / STATIC_FINGERPRINT_FILE
+        fingerprint = self.static_fingerprint()
+        manifest_exists = (static_root / 'staticfiles.json').exists()
+        if not force and manifest_exists and fingerprint_file.exists() and fingerprint_file.read_text() == fingerprint:
+            return 'без изменений, пропущено'
+        call_command('collectstatic', interactive=False, verbosity=0)
+        fingerprint_file.write_text(fingerprint)
+        return 'собраны'
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from books.similarity import build_similarity_index
+
+
+class Command(BaseCommand):
+    help = 'Пересчитать индекс похожих книг (запускать периодически, например раз в сутки)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=None, help='Сколько соседей хранить для каждой книги')
+
+    def handle(self, *args, **options):
+        saved = build_similarity_index(top_k=options['top_k'])
+        self.stdout.write(self.style.SUCCESS(f'Сохранено пар похожих книг: {saved}'))
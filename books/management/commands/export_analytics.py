@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from books.analytics import export_snapshot, snapshot_dir
+
+
+class Command(BaseCommand):
+    help = 'Выгрузить новые строки активности и истории в снимок аналитики (запускать периодически, например раз в час)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Выгрузить снимок заново целиком')
+
+    def handle(self, *args, **options):
+        exported = export_snapshot(full=options['full'])
+        for name, rows in exported.items():
+            self.stdout.write(f'{name}: {rows}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Снимок аналитики обновлен ({snapshot_dir()}), новых строк: {sum(exported.values())}'
+        ))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from books.partitions import default_partition_rows, maintain_partitions
+
+ACTION_LABELS = {
+    'create': 'Создана секция',
+    'drop': 'Удалена секция',
+    'detach': 'Отсоединена секция',
+}
+
+
+class Command(BaseCommand):
+    help = 'Создать помесячные секции активности и истории наперед и удалить устаревшие (запускать раз в сутки)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--premake', type=int, default=None, help='На сколько месяцев вперед создавать секции')
+        parser.add_argument(
+            '--detach', action='store_true',
+            help='Устаревшие секции только отсоединять (остаются отдельными таблицами для архива)'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет сделано')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Секционирование таблиц поддерживается только для PostgreSQL')
+
+        actions = maintain_partitions(
+            premake_months=options['premake'], detach=options['detach'], dry_run=options['dry_run']
+        )
+        for action, name in actions:
+            self.stdout.write(f'{ACTION_LABELS[action]}: {name}')
+
+        for table, count in default_partition_rows().items():
+            self.stdout.write(self.style.WARNING(
+                f'{table}_default: {count} строк вне помесячных секций'
+            ))
+
+        summary = 'Будет выполнено' if options['dry_run'] else 'Выполнено'
+        self.stdout.write(self.style.SUCCESS(f'{summary} действий с секциями: {len(actions)}'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from books.scoring import refresh_book_scores
+
+
+class Command(BaseCommand):
+    help = 'Пересчитать рейтинги и популярность книг (запускать периодически, например раз в час)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('book_ids', nargs='*', type=int, help='ID книг (по умолчанию - все книги)')
+
+    def handle(self, *args, **options):
+        refreshed = refresh_book_scores(options['book_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано рейтингов: {refreshed}'))
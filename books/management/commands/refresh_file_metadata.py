@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from books.file_metadata import schedule_file_metadata
+from books.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Поставить в очередь вычисление сведений о файлах книг (по умолчанию - где они еще не вычислены)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Пересчитать для всех книг с файлами')
+
+    def handle(self, *args, **options):
+        books = Book.objects.exclude(book_file='').exclude(book_file__isnull=True)
+        if not options['all']:
+            books = books.filter(file_size__isnull=True)
+
+        scheduled = 0
+        for book_id in books.values_list('pk', flat=True).iterator():
+            schedule_file_metadata(book_id)
+            scheduled += 1
+        self.stdout.write(self.style.SUCCESS(f'Поставлено в очередь: {scheduled}'))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from books.models import Book, UserProfile
+from books.storage import HASHED_NAME_RE
+
+MEDIA_FIELDS = [
+    (Book, 'cover_image'),
+    (UserProfile, 'avatar'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Переименовать ранее загруженные обложки и аватары в имена с хэшем содержимого'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete-old', action='store_true', help='Удалить файлы со старыми именами')
+
+    def handle(self, *args, **options):
+        renamed = missing = 0
+        for model, field_name in MEDIA_FIELDS:
+            field = model._meta.get_field(field_name)
+            storage = field.storage
+            has_updated_at = any(f.name == 'updated_at' for f in model._meta.concrete_fields)
+            rows = model.objects.exclude(**{f'{field_name}__isnull': True}).exclude(**{field_name: ''})
+            for pk, name in rows.values_list('pk', field_name).iterator():
+                if HASHED_NAME_RE.search(name):
+                    continue
+                if not storage.exists(name):
+                    missing += 1
+                    continue
+                with storage.open(name) as file:
+                    new_name = storage.save(name, file, max_length=field.max_length)
+
+                changes = {field_name: new_name}
+                if has_updated_at:
+                    # updated_at сбрасывает кэш фрагментов карточки книги со старым URL
+                    changes['updated_at'] = timezone.now()
+                # update() без новой версии в истории: содержимое файла не изменилось
+                model.objects.filter(pk=pk, **{field_name: name}).update(**changes)
+                if options['delete_old']:
+                    storage.delete(name)
+                renamed += 1
+
+        if missing:
+            self.stdout.write(self.style.WARNING(f'Файлов не найдено: {missing}'))
+        self.stdout.write(self.style.SUCCESS(f'Переименовано файлов: {renamed}'))
@@ -0,0 +1,56 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+
+from books.models import Book
+from books.point_in_time import book_ids_for_genre, book_ids_for_owner, restore_as_of
+
+ACTION_LABELS = {
+    'update': 'изменена',
+    'recreate': 'удалена, будет создана заново',
+    'created_after': 'создана позже, не изменяется',
+}
+
+
+class Command(BaseCommand):
+    help = 'Восстановить книги в состояние на момент времени (без --apply - только отчет)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('at', help='Момент времени, например "2024-05-01 12:00"')
+        scope = parser.add_mutually_exclusive_group(required=True)
+        scope.add_argument('--owner', help='Все книги пользователя (username)')
+        scope.add_argument('--genre', type=int, help='Все книги жанра (id)')
+        scope.add_argument('--books', type=int, nargs='+', help='Id книг')
+        parser.add_argument('--apply', action='store_true', help='Выполнить восстановление')
+        parser.add_argument('--by', help='Пользователь, от имени которого пишется история')
+
+    def handle(self, *args, **options):
+        as_of = parse_datetime(options['at'])
+        if as_of is None:
+            raise CommandError(f'Неверная дата: {options["at"]}')
+        if timezone.is_naive(as_of):
+            as_of = timezone.make_aware(as_of)
+
+        try:
+            if options['owner']:
+                book_ids = book_ids_for_owner(User.objects.get(username=options['owner']).pk)
+            elif options['genre']:
+                book_ids = book_ids_for_genre(options['genre'])
+            else:
+                book_ids = set(options['books'])
+            user = User.objects.get(username=options['by']) if options['by'] else None
+        except User.DoesNotExist as e:
+            raise CommandError(str(e))
+
+        plan = restore_as_of(Book, as_of, book_ids, user=user, dry_run=not options['apply'])
+        for entry in plan:
+            self.stdout.write(f"Книга #{entry['id']}: {ACTION_LABELS[entry['action']]}")
+            for change in entry['changes']:
+                self.stdout.write(f"    {change['verbose_name']}: {change['old']!r} -> {change['new']!r}")
+
+        restored = sum(1 for entry in plan if entry['action'] != 'created_after')
+        if options['apply']:
+            self.stdout.write(self.style.SUCCESS(f'Восстановлено книг: {restored}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Будет восстановлено книг: {restored} (запустите с --apply)'))
@@ -0,0 +1,57 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from books.jobs import run_next_job
+
+
+class Command(BaseCommand):
+    help = 'Обработчик фоновой очереди задач (таблица Job)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=None, help='Количество потоков обработки')
+        parser.add_argument('--once', action='store_true', help='Выполнить готовые задачи и завершиться')
+
+    def handle(self, *args, **options):
+        threads_count = options['threads'] or settings.JOB_WORKER_THREADS
+        once = options['once']
+        stop = threading.Event()
+
+        def shutdown(signum, frame):
+            self.stdout.write('Завершение после текущих задач...')
+            stop.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        processed = [0] * threads_count
+
+        def work(index):
+            try:
+                while not stop.is_set():
+                    close_old_connections()
+                    if run_next_job():
+                        processed[index] += 1
+                    elif once:
+                        break
+                    else:
+                        stop.wait(settings.JOB_WORKER_POLL_INTERVAL)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=work, args=(index,), name=f'job-worker-{index}', daemon=True)
+            for index in range(threads_count)
+        ]
+        self.stdout.write(f'Обработчик очереди запущен, потоков: {threads_count}')
+        for thread in threads:
+            thread.start()
+        # join с таймаутом, чтобы главный поток успевал обрабатывать сигналы
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1)
+
+        self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {sum(processed)}'))
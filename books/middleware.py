@@ -0,0 +1,116 @@
+"""Промежуточные обработчики приложения книг"""
+import logging
+import math
+import time
+import uuid
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from .db_router import get_replica_aliases, replica_reads
+from .logging_utils import request_id_var
+from .throttling import check_rate
+
+request_logger = logging.getLogger('books.requests')
+
+
+class RequestLogMiddleware:
+    """Идентификатор запроса для логов и строка журнала запросов со временем ответа
+
+    Идентификатор берется из заголовка X-Request-ID (от nginx) или создается
+    заново и возвращается в ответе.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = (request.headers.get('X-Request-ID') or uuid.uuid4().hex)[:64]
+        token = request_id_var.set(request_id)
+        started = time.monotonic()
+        try:
+            response = self.get_response(request)
+            latency_ms = round((time.monotonic() - started) * 1000, 2)
+            request_logger.log(
+                logging.WARNING if response.status_code >= 500 else logging.INFO,
+                '%s %s %s %.2fms', request.method, request.path, response.status_code, latency_ms,
+                extra={
+                    'method': request.method,
+                    'path': request.path,
+                    'status': response.status_code,
+                    'latency_ms': latency_ms,
+                },
+            )
+        finally:
+            request_id_var.reset(token)
+        response['X-Request-ID'] = request_id
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """Отправляет чтение безопасных запросов в реплики
+
+    После записи пользователь получает cookie, и в течение
+    REPLICA_STICKY_SECONDS его запросы читают из основной базы,
+    чтобы он сразу видел свои изменения.
+    """
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        use_replica = (
+            request.method in self.safe_methods
+            and bool(get_replica_aliases())
+            and settings.REPLICA_PIN_COOKIE not in request.COOKIES
+        )
+
+        with replica_reads(use_replica) as state:
+            response = self.get_response(request)
+
+        if state['wrote']:
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE,
+                '1',
+                max_age=settings.REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+
+class ThrottleMiddleware:
+    """Ограничение частоты запросов к HTML страницам
+
+    Использует те же лимиты и корзины, что и API (REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']).
+    """
+    # Имя URL -> (область, методы)
+    url_scopes = {
+        'book_catalog': ('search', ('GET',)),
+        'download_book': ('download', ('GET',)),
+        'contact_owner': ('message_send', ('POST',)),
+    }
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        scope, methods = self.url_scopes.get(request.resolver_match.url_name, (None, ()))
+        if request.method not in methods:
+            return None
+        if scope == 'search' and not request.GET.get('search'):
+            return None
+
+        allowed, wait = check_rate(request, scope)
+        if allowed:
+            return None
+        response = HttpResponse(
+            'Слишком много запросов. Попробуйте позже.',
+            status=429,
+            content_type='text/plain; charset=utf-8',
+        )
+        response['Retry-After'] = str(math.ceil(wait))
+        return response
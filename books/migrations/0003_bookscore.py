@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-19 01:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0002_historicalbook_historicalbook_genres_historicalgenre_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='historicaluseractivity',
+            name='action',
+            field=models.CharField(choices=[('create_book', 'Создание книги'), ('update_book', 'Обновление книги'), ('delete_book', 'Удаление книги'), ('create_review', 'Создание отзыва'), ('update_review', 'Обновление отзыва'), ('delete_review', 'Удаление отзыва'), ('download_book', 'Скачивание книги'), ('send_message', 'Отправка сообщения'), ('read_message', 'Прочтение сообщения'), ('update_profile', 'Обновление профиля'), ('login', 'Вход в систему'), ('logout', 'Выход из системы')], max_length=50, verbose_name='Действие'),
+        ),
+        migrations.AlterField(
+            model_name='useractivity',
+            name='action',
+            field=models.CharField(choices=[('create_book', 'Создание книги'), ('update_book', 'Обновление книги'), ('delete_book', 'Удаление книги'), ('create_review', 'Создание отзыва'), ('update_review', 'Обновление отзыва'), ('delete_review', 'Удаление отзыва'), ('download_book', 'Скачивание книги'), ('send_message', 'Отправка сообщения'), ('read_message', 'Прочтение сообщения'), ('update_profile', 'Обновление профиля'), ('login', 'Вход в систему'), ('logout', 'Выход из системы')], max_length=50, verbose_name='Действие'),
+        ),
+        migrations.CreateModel(
+            name='BookScore',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='books.book', verbose_name='Книга')),
+                ('reviews_count', models.PositiveIntegerField(default=0, verbose_name='Количество отзывов')),
+                ('average_rating', models.FloatField(default=0, verbose_name='Средняя оценка')),
+                ('bayesian_rating', models.FloatField(default=0, verbose_name='Байесовский рейтинг')),
+                ('activity_score', models.FloatField(default=0, verbose_name='Активность')),
+                ('computed_at', models.DateTimeField(auto_now=True, verbose_name='Время расчета')),
+            ],
+            options={
+                'verbose_name': 'Рейтинг книги',
+                'verbose_name_plural': 'Рейтинги книг',
+                'indexes': [models.Index(fields=['-bayesian_rating', '-reviews_count'], name='books_score_popular_idx'), models.Index(fields=['-activity_score'], name='books_score_trending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 01:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_bookscore'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookSimilarity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='Позиция')),
+                ('score', models.FloatField(verbose_name='Сходство')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_links', to='books.book', verbose_name='Книга')),
+                ('similar_book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_for_links', to='books.book', verbose_name='Похожая книга')),
+            ],
+            options={
+                'verbose_name': 'Похожая книга',
+                'verbose_name_plural': 'Похожие книги',
+                'unique_together': {('book', 'rank')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Индексы для префиксного поиска (istartswith) по названию, автору и жанру.
+# Django строит для istartswith условие UPPER(col::text) LIKE UPPER('...%'),
+# при локали ru_RU обычный btree для LIKE не подходит, нужен text_pattern_ops.
+
+from django.db import migrations
+
+PREFIX_INDEXES = [
+    ('books_book_title_prefix_idx', 'books_book', 'title'),
+    ('books_book_author_prefix_idx', 'books_book', 'author'),
+    ('books_genre_name_prefix_idx', 'books_genre', 'name'),
+]
+
+
+def create_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for index_name, table, column in PREFIX_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {index_name} ON {table} (UPPER({column}::text) text_pattern_ops)'
+        )
+
+
+def drop_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for index_name, _, _ in PREFIX_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {index_name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_booksimilarity'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_indexes, drop_prefix_indexes),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0006_job_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='file_mime',
+            field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='Формат файла'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='file_sha256',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='SHA-256 файла'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='file_size',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True, verbose_name='Размер файла'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='page_count',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Страниц'),
+        ),
+    ]
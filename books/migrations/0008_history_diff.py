@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:13
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+# Индексы для постраничного просмотра истории объекта по (history_date, history_id)
+HISTORY_KEYSET_INDEXES = [
+    ('books_histbook_keyset_idx', 'books_historicalbook'),
+    ('books_histmessage_keyset_idx', 'books_historicalmessage'),
+    ('books_histreview_keyset_idx', 'books_historicalreview'),
+]
+
+
+def create_keyset_indexes(apps, schema_editor):
+    for index_name, table in HISTORY_KEYSET_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {index_name} ON {table} (id, history_date DESC, history_id DESC)'
+        )
+
+
+def drop_keyset_indexes(apps, schema_editor):
+    for index_name, _ in HISTORY_KEYSET_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {index_name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0007_book_file_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalbook',
+            name='history_diff',
+            field=models.JSONField(blank=True, editable=False, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True, verbose_name='Изменения'),
+        ),
+        migrations.AddField(
+            model_name='historicalmessage',
+            name='history_diff',
+            field=models.JSONField(blank=True, editable=False, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True, verbose_name='Изменения'),
+        ),
+        migrations.AddField(
+            model_name='historicalreview',
+            name='history_diff',
+            field=models.JSONField(blank=True, editable=False, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True, verbose_name='Изменения'),
+        ),
+        migrations.RunPython(create_keyset_indexes, drop_keyset_indexes),
+    ]
@@ -0,0 +1,125 @@
+# Помесячное секционирование (PARTITION BY RANGE) таблиц, которые только
+# дополняются и читаются по временным окнам: активность пользователей и история.
+# Таблица пересоздается как секционированная, данные переносятся, индексы и
+# внешние ключи восстанавливаются. Первичный ключ должен включать ключ
+# секционирования, поэтому он становится составным. Секции на будущие месяцы
+# создает и устаревшие удаляет команда manage_partitions.
+
+from django.db import migrations
+from django.utils import timezone
+
+# (таблица, первичный ключ, колонка секционирования)
+PARTITIONED_TABLES = [
+    ('books_useractivity', 'id', 'timestamp'),
+    ('books_historicaluseractivity', 'history_id', 'history_date'),
+    ('books_historicalbook', 'history_id', 'history_date'),
+    ('books_historicalreview', 'history_id', 'history_date'),
+    ('books_historicalmessage', 'history_id', 'history_date'),
+    ('books_historicaluserprofile', 'history_id', 'history_date'),
+]
+PREMAKE_MONTHS = 3
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=index // 12, month=index % 12 + 1)
+
+
+def table_definitions(cursor, table):
+    """Индексы (кроме ключей) и внешние ключи таблицы, чтобы создать их заново"""
+    cursor.execute(
+        """
+        SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i
+        WHERE i.indrelid = %s::regclass AND NOT i.indisprimary AND NOT i.indisunique
+        """,
+        [table],
+    )
+    # У секционированной таблицы индекс описан как ON ONLY - для обычной таблицы это лишнее
+    indexes = [row[0].replace(' ON ONLY ', ' ON ') for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [table],
+    )
+    return indexes, cursor.fetchall()
+
+
+def rebuild_table(schema_editor, table, primary_key, column, partitioned):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        indexes, foreign_keys = table_definitions(cursor, table)
+        cursor.execute(f'SELECT MIN({column}) FROM {table}')
+        first_value = cursor.fetchone()[0]
+
+    old_table = f'{table}_old'
+    partition_by = f' PARTITION BY RANGE ({column})' if partitioned else ''
+    schema_editor.execute(f'ALTER TABLE {table} RENAME TO {old_table}')
+    schema_editor.execute(
+        f'CREATE TABLE {table} (LIKE {old_table} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS)'
+        f'{partition_by}'
+    )
+
+    if partitioned:
+        # Секции с первого месяца, в котором есть данные, и на PREMAKE_MONTHS вперед;
+        # строки вне диапазона попадут в секцию по умолчанию
+        now = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        month = min(first_value, now).replace(day=1, hour=0, minute=0, second=0, microsecond=0) if first_value else now
+        while month <= add_months(now, PREMAKE_MONTHS):
+            schema_editor.execute(
+                f'CREATE TABLE {table}_p{month:%Y%m} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)',
+                [month, add_months(month, 1)],
+            )
+            month = add_months(month, 1)
+        schema_editor.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+
+    schema_editor.execute(f'INSERT INTO {table} SELECT * FROM {old_table}')
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [old_table, primary_key])
+        old_sequence = cursor.fetchone()[0]
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [table, primary_key])
+        new_sequence = cursor.fetchone()[0]
+    if new_sequence and new_sequence != old_sequence:
+        # Identity-колонка получила новую последовательность - продолжаем нумерацию
+        schema_editor.execute(
+            f"SELECT setval(%s, COALESCE((SELECT MAX({primary_key}) FROM {table}), 0) + 1, false)",
+            [new_sequence],
+        )
+    elif old_sequence:
+        # serial: последовательность общая, переносим ее владельца, иначе она удалится со старой таблицей
+        schema_editor.execute(f'ALTER SEQUENCE {old_sequence} OWNED BY {table}.{primary_key}')
+
+    schema_editor.execute(f'DROP TABLE {old_table}')
+    if new_sequence and new_sequence != old_sequence and old_sequence:
+        schema_editor.execute(f'ALTER SEQUENCE {new_sequence} RENAME TO {old_sequence.split(".")[-1]}')
+
+    primary_key_columns = f'{primary_key}, {column}' if partitioned else primary_key
+    schema_editor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY ({primary_key_columns})')
+    for index in indexes:
+        schema_editor.execute(index)
+    for name, definition in foreign_keys:
+        schema_editor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}')
+
+
+def partition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, primary_key, column in PARTITIONED_TABLES:
+        rebuild_table(schema_editor, table, primary_key, column, partitioned=True)
+
+
+def unpartition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, primary_key, column in PARTITIONED_TABLES:
+        rebuild_table(schema_editor, table, primary_key, column, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_history_diff'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:31
+
+import books.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_partition_time_tables'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='cover_image',
+            field=models.ImageField(blank=True, null=True, storage=books.storage.ContentHashedStorage(), upload_to='book_covers/', verbose_name='Обложка'),
+        ),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='avatar',
+            field=models.ImageField(blank=True, null=True, storage=books.storage.ContentHashedStorage(), upload_to='avatars/', verbose_name='Аватар'),
+        ),
+    ]
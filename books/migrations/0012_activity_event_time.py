@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:47
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0011_optimistic_locking'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='historicaluseractivity',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Время'),
+        ),
+        migrations.AlterField(
+            model_name='useractivity',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Время'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:52
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def copy_timestamp(apps, schema_editor):
+    # Для уже выгруженных строк отметка аналитики (по timestamp) остается прежней
+    UserActivity = apps.get_model('books', 'UserActivity')
+    UserActivity.objects.update(recorded_at=F('timestamp'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0012_activity_event_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useractivity',
+            name='recorded_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now, verbose_name='Время записи'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_timestamp, migrations.RunPython.noop),
+    ]
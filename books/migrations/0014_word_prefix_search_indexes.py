@@ -0,0 +1,39 @@
+# Индексы для поиска по началу слова (icontains ' <запрос>') в подсказках из БД.
+# Django строит для icontains условие UPPER(col::text) LIKE UPPER('%...%'),
+# такое условие использует только триграммный GIN-индекс (pg_trgm).
+
+from django.db import migrations
+
+WORD_INDEXES = [
+    ('books_book_title_trgm_idx', 'books_book', 'title'),
+    ('books_book_author_trgm_idx', 'books_book', 'author'),
+    ('books_genre_name_trgm_idx', 'books_genre', 'name'),
+]
+
+
+def create_word_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for index_name, table, column in WORD_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {index_name} ON {table} USING gin (UPPER({column}::text) gin_trgm_ops)'
+        )
+
+
+def drop_word_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for index_name, _, _ in WORD_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {index_name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0013_activity_recorded_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_word_indexes, drop_word_indexes),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 03:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0014_word_prefix_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='locked_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Занята до'),
+        ),
+    ]
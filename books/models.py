@@ -1,10 +1,31 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.urls import reverse
+from django.utils import timezone
 from simple_history.models import HistoricalRecords
 
+from .concurrency import VersionedModelMixin
+from .dirty_fields import DirtyFieldsMixin
+from .storage import content_hashed_storage
+
+
+class HistoryDiffModel(models.Model):
+    """База исторических моделей: изменения полей относительно предыдущей версии
+
+    Заполняется при записи версии (books.history_diff), чтобы история
+    не пересчитывала различия при каждом просмотре.
+    """
+    history_diff = models.JSONField(
+        null=True, blank=True, editable=False, encoder=DjangoJSONEncoder,
+        verbose_name="Изменения"
+    )
+
+    class Meta:
+        abstract = True
+
 
 class Genre(models.Model):
     name = models.CharField(max_length=100, unique=True, verbose_name="Название жанра")
@@ -23,24 +44,37 @@ class Genre(models.Model):
         verbose_name_plural = "Жанры"
 
 
-class Book(models.Model):
+class Book(DirtyFieldsMixin, VersionedModelMixin, models.Model):
     title = models.CharField(max_length=200, verbose_name="Название")
     author = models.CharField(max_length=100, verbose_name="Автор")
     genres = models.ManyToManyField(Genre, verbose_name="Жанры")
     description = models.TextField(verbose_name="Описание")
-    cover_image = models.ImageField(upload_to='book_covers/', blank=True, null=True, verbose_name="Обложка")
+    cover_image = models.ImageField(
+        upload_to='book_covers/', storage=content_hashed_storage, blank=True, null=True, verbose_name="Обложка"
+    )
     book_file = models.FileField(upload_to='books/', blank=True, null=True, verbose_name="Файл книги", 
                                 help_text="Загрузите файл книги (PDF, EPUB, FB2, TXT)")
+    # Сведения о файле заполняет фоновая задача после загрузки (books.file_metadata)
+    file_size = models.PositiveBigIntegerField(null=True, blank=True, editable=False, verbose_name="Размер файла")
+    file_mime = models.CharField(max_length=100, blank=True, editable=False, verbose_name="Формат файла")
+    file_sha256 = models.CharField(max_length=64, blank=True, editable=False, verbose_name="SHA-256 файла")
+    page_count = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name="Страниц")
     owner = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Владелец")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата добавления")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+    # Номер версии для оптимистической блокировки (books.concurrency)
+    version = models.PositiveIntegerField(default=1, editable=False, verbose_name="Версия")
+
+    FILE_METADATA_FIELDS = ('file_size', 'file_mime', 'file_sha256', 'page_count')
     
     # История изменений
     history = HistoricalRecords(
         verbose_name="История книги",
         history_change_reason_field=models.TextField(null=True, blank=True),
-        excluded_fields=['updated_at'],  # Исключаем поле updated_at из истории
+        # Исключаем из истории updated_at, версию и вычисляемые сведения о файле
+        excluded_fields=['updated_at', 'version', *FILE_METADATA_FIELDS],
         m2m_fields=[genres],  # Отслеживаем изменения в ManyToMany полях
+        bases=[HistoryDiffModel],
     )
 
     def clean_title(self):
@@ -70,9 +104,27 @@ class Book(models.Model):
         # Валидируем поле title
         self.title = self.clean_title()
 
+        # Новый файл еще не записан в хранилище - старые сведения о файле неверны
+        file_uploaded = bool(self.book_file) and not self.book_file._committed
+        if file_uploaded or (not self.book_file and self.file_size is not None):
+            self.reset_file_metadata()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(self.FILE_METADATA_FIELDS)
+
         # Вызываем родительский метод save
         super().save(*args, **kwargs)
 
+        if file_uploaded:
+            from .file_metadata import schedule_file_metadata
+            schedule_file_metadata(self.pk)
+
+    def reset_file_metadata(self):
+        """Очистить сведения о файле до их повторного вычисления"""
+        self.file_size = None
+        self.file_mime = ''
+        self.file_sha256 = ''
+        self.page_count = None
 
 
     def __str__(self):
@@ -94,6 +146,19 @@ class Book(models.Model):
     def get_latest_changes(self, limit=5):
         """Получить последние изменения"""
         return self.history.all().order_by('-history_date')[:limit]
+
+    def get_cache_version(self):
+        """Версия для ключей кэша фрагментов: меняется при изменении книги или ее рейтинга"""
+        score = getattr(self, 'score', None)
+        rating_version = score.computed_at.timestamp() if score else 0
+        return f'{self.updated_at.timestamp()}-{rating_version}'
+
+    def get_similar_books(self, limit=None):
+        """Похожие книги из предрасчитанного индекса (команда build_similarity_index)"""
+        books = Book.objects.filter(
+            similar_for_links__book_id=self.pk
+        ).order_by('similar_for_links__rank')
+        return books[:limit] if limit else books
     
     class Meta:
         verbose_name = "Книга"
@@ -101,7 +166,7 @@ class Book(models.Model):
         ordering = ['-created_at']
 
 
-class Review(models.Model):
+class Review(VersionedModelMixin, models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='reviews', verbose_name="Книга")
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Пользователь")
     text = models.TextField(verbose_name="Текст отзыва")
@@ -110,11 +175,14 @@ class Review(models.Model):
         verbose_name="Оценка"
     )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    version = models.PositiveIntegerField(default=1, editable=False, verbose_name="Версия")
     
     # История изменений
     history = HistoricalRecords(
         verbose_name="История отзыва",
-        history_change_reason_field=models.TextField(null=True, blank=True)
+        history_change_reason_field=models.TextField(null=True, blank=True),
+        excluded_fields=['version'],
+        bases=[HistoryDiffModel],
     )
     
     def __str__(self):
@@ -127,12 +195,14 @@ class Review(models.Model):
         ordering = ['-created_at']
 
 
-class UserProfile(models.Model):
+class UserProfile(DirtyFieldsMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, verbose_name="Пользователь")
     bio = models.TextField(max_length=500, blank=True, verbose_name="О себе")
     location = models.CharField(max_length=30, blank=True, verbose_name="Местоположение")
     birth_date = models.DateField(null=True, blank=True, verbose_name="Дата рождения")
-    avatar = models.ImageField(upload_to='avatars/', blank=True, null=True, verbose_name="Аватар")
+    avatar = models.ImageField(
+        upload_to='avatars/', storage=content_hashed_storage, blank=True, null=True, verbose_name="Аватар"
+    )
     phone = models.CharField(max_length=20, blank=True, verbose_name="Телефон")
     telegram = models.CharField(max_length=50, blank=True, verbose_name="Telegram")
     
@@ -150,7 +220,7 @@ class UserProfile(models.Model):
         verbose_name_plural = "Профили пользователей"
 
 
-class Message(models.Model):
+class Message(DirtyFieldsMixin, models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages', verbose_name="Отправитель")
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages', verbose_name="Получатель")
     book = models.ForeignKey(Book, on_delete=models.CASCADE, verbose_name="Книга")
@@ -163,7 +233,8 @@ class Message(models.Model):
     history = HistoricalRecords(
         verbose_name="История сообщения",
         history_change_reason_field=models.TextField(null=True, blank=True),
-        excluded_fields=['created_at']  # Исключаем created_at из истории
+        excluded_fields=['created_at'],  # Исключаем created_at из истории
+        bases=[HistoryDiffModel],
     )
     
     def __str__(self):
@@ -175,6 +246,50 @@ class Message(models.Model):
         ordering = ['-created_at']
 
 
+class BookScore(models.Model):
+    """Предрасчитанные рейтинг и популярность книги"""
+    book = models.OneToOneField(
+        Book, on_delete=models.CASCADE, primary_key=True, related_name='score', verbose_name="Книга"
+    )
+    reviews_count = models.PositiveIntegerField(default=0, verbose_name="Количество отзывов")
+    average_rating = models.FloatField(default=0, verbose_name="Средняя оценка")
+    bayesian_rating = models.FloatField(default=0, verbose_name="Байесовский рейтинг")
+    # Логарифм суммы весов событий относительно scoring.ACTIVITY_EPOCH (0 - активности нет)
+    activity_score = models.FloatField(default=0, verbose_name="Активность")
+    computed_at = models.DateTimeField(auto_now=True, verbose_name="Время расчета")
+
+    def __str__(self):
+        return f"Рейтинг {self.book_id}: {self.bayesian_rating:.2f}"
+
+    class Meta:
+        verbose_name = "Рейтинг книги"
+        verbose_name_plural = "Рейтинги книг"
+        indexes = [
+            models.Index(fields=['-bayesian_rating', '-reviews_count'], name='books_score_popular_idx'),
+            models.Index(fields=['-activity_score'], name='books_score_trending_idx'),
+        ]
+
+
+class BookSimilarity(models.Model):
+    """Предрасчитанные похожие книги (top-K соседей для каждой книги)"""
+    book = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name='similar_links', verbose_name="Книга"
+    )
+    similar_book = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name='similar_for_links', verbose_name="Похожая книга"
+    )
+    rank = models.PositiveSmallIntegerField(verbose_name="Позиция")
+    score = models.FloatField(verbose_name="Сходство")
+
+    def __str__(self):
+        return f"{self.book_id} -> {self.similar_book_id} ({self.score:.3f})"
+
+    class Meta:
+        verbose_name = "Похожая книга"
+        verbose_name_plural = "Похожие книги"
+        unique_together = ('book', 'rank')
+
+
 # Кастомная модель для отслеживания действий пользователей
 class UserActivity(models.Model):
     """Модель для отслеживания активности пользователей"""
@@ -185,6 +300,7 @@ class UserActivity(models.Model):
         ('create_review', 'Создание отзыва'),
         ('update_review', 'Обновление отзыва'),
         ('delete_review', 'Удаление отзыва'),
+        ('download_book', 'Скачивание книги'),
         ('send_message', 'Отправка сообщения'),
         ('read_message', 'Прочтение сообщения'),
         ('update_profile', 'Обновление профиля'),
@@ -199,12 +315,16 @@ class UserActivity(models.Model):
     description = models.TextField(blank=True, verbose_name="Описание")
     ip_address = models.GenericIPAddressField(null=True, blank=True, verbose_name="IP адрес")
     user_agent = models.TextField(blank=True, verbose_name="User Agent")
-    timestamp = models.DateTimeField(auto_now_add=True, verbose_name="Время")
+    # Время события; фоновая задача передает время запроса, а не записи
+    timestamp = models.DateTimeField(default=timezone.now, editable=False, verbose_name="Время")
+    # Время записи в базу - отметка инкрементальной выгрузки аналитики (timestamp может быть в прошлом)
+    recorded_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Время записи")
     
     # История изменений для активности (мета-уровень)
     history = HistoricalRecords(
         verbose_name="История активности",
-        history_change_reason_field=models.TextField(null=True, blank=True)
+        history_change_reason_field=models.TextField(null=True, blank=True),
+        excluded_fields=['recorded_at'],
     )
     
     def __str__(self):
@@ -214,3 +334,45 @@ class UserActivity(models.Model):
         verbose_name = "Активность пользователя"
         verbose_name_plural = "Активность пользователей"
         ordering = ['-timestamp']
+
+
+class Job(models.Model):
+    """Задача фоновой очереди (выполняется командой run_worker)"""
+    task = models.CharField(max_length=100, verbose_name="Задача")
+    payload = models.JSONField(default=dict, blank=True, verbose_name="Аргументы")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток")
+    max_attempts = models.PositiveIntegerField(default=5, verbose_name="Максимум попыток")
+    run_at = models.DateTimeField(default=timezone.now, verbose_name="Выполнить не раньше")
+    # Задачу выполняет обработчик; если он упал, после этого времени задачу заберет другой
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name="Занята до")
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+
+    def __str__(self):
+        return f"{self.task} #{self.pk}"
+
+    class Meta:
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        ordering = ['run_at', 'id']
+        indexes = [
+            models.Index(fields=['run_at', 'id'], name='books_job_run_at_idx'),
+        ]
+
+
+class DeadJob(models.Model):
+    """Задача, исчерпавшая все попытки"""
+    task = models.CharField(max_length=100, verbose_name="Задача")
+    payload = models.JSONField(default=dict, blank=True, verbose_name="Аргументы")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток")
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(verbose_name="Дата создания")
+    failed_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата отказа")
+
+    def __str__(self):
+        return f"{self.task} (отказ {self.failed_at})"
+
+    class Meta:
+        verbose_name = "Отказавшая задача"
+        verbose_name_plural = "Отказавшие задачи"
+        ordering = ['-failed_at']
@@ -1,7 +1,66 @@
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from rest_framework.pagination import PageNumberPagination, LimitOffsetPagination
 from rest_framework.response import Response
 from collections import OrderedDict
 
+
+# Число строк таблицы из pg_class (обновляется ANALYZE/autovacuum). У секционированной
+# таблицы своих строк нет (reltuples = -1), поэтому суммируются все секции из pg_inherits,
+# включая вложенные; -1 у секции - она еще ни разу не анализировалась.
+TABLE_ROWS_SQL = """
+    WITH RECURSIVE tree AS (
+        SELECT %s::regclass AS relid
+        UNION ALL
+        SELECT inherits.inhrelid FROM pg_inherits inherits JOIN tree ON inherits.inhparent = tree.relid
+    )
+    SELECT SUM(class.reltuples)::bigint, BOOL_OR(class.reltuples < 0)
+    FROM tree JOIN pg_class class ON class.oid = tree.relid
+    WHERE class.relkind <> 'p'
+"""
+
+
+def estimate_count(queryset):
+    """Оценка числа строк по статистике PostgreSQL; None - если оценка недоступна"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(TABLE_ROWS_SQL, [queryset.model._meta.db_table])
+            rows, not_analyzed = cursor.fetchone()
+            if rows is not None and not not_analyzed:
+                return rows
+
+        # С фильтрами (или без статистики по секциям) - оценка планировщика для самого запроса
+        sql, params = queryset.order_by().query.get_compiler(using=queryset.db).as_sql()
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator админки: на больших таблицах - оценка числа строк вместо COUNT(*)
+
+    Точный COUNT(*) выполняется, только если оценка меньше
+    ADMIN_ESTIMATED_COUNT_THRESHOLD, - тогда он дешевый.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is not None and estimate >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+            return estimate
+        return super().count
+
+
 class CustomPageNumberPagination(PageNumberPagination):
     page_size = 20
     page_size_query_param = 'page_size'
@@ -0,0 +1,137 @@
+"""Помесячные секции активности пользователей и таблиц истории (PostgreSQL)
+
+Таблицы секционированы миграцией 0009 по колонке времени: секция
+<таблица>_pYYYYMM на каждый месяц (UTC) и <таблица>_default для строк
+вне созданных секций. Запросы с timestamp__gte / history_date__gte читают
+только нужные секции, а удаление старых данных - это DROP TABLE секции
+вместо DELETE по миллионам строк.
+"""
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Book, Message, Review, UserActivity, UserProfile
+
+PARTITION_NAME_RE = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+def partitioned_tables():
+    """[(модель, колонка секционирования, срок хранения в месяцах или 0)]"""
+    history_retention = settings.HISTORY_RETENTION_MONTHS
+    return [
+        (UserActivity, 'timestamp', settings.USER_ACTIVITY_RETENTION_MONTHS),
+        (UserActivity.history.model, 'history_date', settings.USER_ACTIVITY_RETENTION_MONTHS),
+        (Book.history.model, 'history_date', history_retention),
+        (Review.history.model, 'history_date', history_retention),
+        (Message.history.model, 'history_date', history_retention),
+        (UserProfile.history.model, 'history_date', history_retention),
+    ]
+
+
+def month_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=index // 12, month=index % 12 + 1)
+
+
+def list_partitions(table):
+    """{начало месяца: имя секции} для помесячных секций таблицы"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = %s::regclass',
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME_RE.search(name)
+        if match:
+            month = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=dt_timezone.utc)
+            partitions[month] = name
+    return partitions
+
+
+def create_partition(table, column, month):
+    """Создать секцию месяца; попавшие в секцию по умолчанию строки переносятся в нее"""
+    name = f'{table}_p{month:%Y%m}'
+    bounds = [month, add_months(month, 1)]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {table}_default WHERE {column} >= %s AND {column} < %s RETURNING *) '
+            f'INSERT INTO {name} SELECT * FROM moved',
+            bounds,
+        )
+        # ATTACH сам создает индексы секции по индексам родительской таблицы
+        cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)', bounds)
+    return name
+
+
+def drop_partition(model, name, detach=False):
+    """Удалить секцию (или только отсоединить - для архивирования через pg_dump)"""
+    table = model._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        if not detach:
+            # История ManyToMany (жанры книги) ссылается на версии без внешнего ключа
+            for field in getattr(model, '_history_m2m_fields', ()):
+                m2m_table = getattr(model, field.name).model._meta.db_table
+                cursor.execute(f'DELETE FROM {m2m_table} WHERE history_id IN (SELECT history_id FROM {name})')
+        cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+        if not detach:
+            cursor.execute(f'DROP TABLE {name}')
+
+
+def maintain_partitions(premake_months=None, detach=False, dry_run=False, now=None):
+    """Создать секции наперед и удалить устаревшие; возвращает [(действие, секция)]"""
+    if connection.vendor != 'postgresql':
+        return []
+    if premake_months is None:
+        premake_months = settings.PARTITION_PREMAKE_MONTHS
+    current_month = month_start(now or timezone.now())
+
+    actions = []
+    for model, column, retention_months in partitioned_tables():
+        table = model._meta.db_table
+        partitions = list_partitions(table)
+
+        for offset in range(premake_months + 1):
+            month = add_months(current_month, offset)
+            if month not in partitions:
+                name = f'{table}_p{month:%Y%m}'
+                actions.append(('create', name))
+                if not dry_run:
+                    create_partition(table, column, month)
+
+        if retention_months:
+            # Секция устарела целиком, когда ее месяц закончился до начала срока хранения
+            oldest_month = add_months(current_month, -retention_months)
+            for month, name in sorted(partitions.items()):
+                if month < oldest_month:
+                    actions.append(('detach' if detach else 'drop', name))
+                    if not dry_run:
+                        drop_partition(model, name, detach=detach)
+    return actions
+
+
+def default_partition_rows():
+    """{таблица: строк в секции по умолчанию} - ненулевое значение значит, что секций не хватает"""
+    if connection.vendor != 'postgresql':
+        return {}
+    result = {}
+    with connection.cursor() as cursor:
+        for model, _, _ in partitioned_tables():
+            table = model._meta.db_table
+            cursor.execute(f'SELECT COUNT(*) FROM {table}_default')
+            count = cursor.fetchone()[0]
+            if count:
+                result[table] = count
+    return result
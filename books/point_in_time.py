@@ -0,0 +1,254 @@
+"""Состояние объектов на момент времени и массовое восстановление из истории
+
+Последние версии набора объектов на момент as_of выбираются одним запросом
+к таблице истории: в PostgreSQL - DISTINCT ON (id) ... ORDER BY id,
+history_date DESC, в остальных базах - коррелированным подзапросом.
+ManyToMany-поля с историей (жанры книги) читаются одним запросом на поле.
+Восстановление выполняется пакетно в одной транзакции; по умолчанию это
+пробный прогон, который только возвращает отчет об изменениях.
+"""
+from django.db import connections, transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from simple_history.utils import bulk_update_with_history
+
+from .cache_utils import bump_cache_version
+from .file_metadata import schedule_file_metadata
+from .genre_index import GENRE_INDEX_VERSION_KEY
+from .history_diff import field_value
+from .history_utils import bulk_create_m2m_history
+from .models import Book, Genre, Review
+from .scoring import refresh_book_scores
+from .suggest import invalidate_suggest_index
+
+
+def versions_as_of(model, as_of, object_ids):
+    """Queryset последних версий объектов object_ids на момент as_of (включая удаления '-')"""
+    pk_name = model._meta.pk.attname
+    history = model.history.filter(history_date__lte=as_of, **{f'{pk_name}__in': object_ids})
+
+    if connections[history.db].vendor == 'postgresql':
+        return history.order_by(pk_name, '-history_date', '-history_id').distinct(pk_name)
+
+    latest = (
+        history.filter(**{pk_name: OuterRef(pk_name)})
+        .order_by('-history_date', '-history_id')
+        .values('history_id')[:1]
+    )
+    return history.filter(history_id=Subquery(latest))
+
+
+def m2m_fields(model):
+    """ManyToMany-поля модели, история которых ведется"""
+    return model.history.model._history_m2m_fields
+
+
+def _m2m_values(rows):
+    values = {}
+    for object_id, target_id in rows:
+        values.setdefault(object_id, set()).add(target_id)
+    return values
+
+
+def m2m_as_of(model, versions):
+    """{поле: {id объекта: {id связанных}}} для версий из versions_as_of"""
+    history_model = model.history.model
+    result = {}
+    for field in m2m_fields(model):
+        m2m_history = getattr(history_model, field.name).model
+        rows = m2m_history.objects.filter(history__in=versions.values('history_id')).values_list(
+            f'{field.m2m_field_name()}_id', f'{field.m2m_reverse_field_name()}_id'
+        )
+        result[field.name] = _m2m_values(rows)
+    return result
+
+
+def current_m2m(model, object_ids):
+    """То же, что m2m_as_of, для текущего состояния"""
+    result = {}
+    for field in m2m_fields(model):
+        source = field.m2m_field_name()
+        rows = field.remote_field.through.objects.filter(**{f'{source}_id__in': object_ids}).values_list(
+            f'{source}_id', f'{field.m2m_reverse_field_name()}_id'
+        )
+        result[field.name] = _m2m_values(rows)
+    return result
+
+
+def take_snapshot(model, as_of, object_ids):
+    """Состояние объектов на момент as_of: ({id: версия}, {m2m-поле: {id: {id связанных}}})
+
+    Объекты, удаленные к as_of или созданные после, в снимок не входят.
+    """
+    versions = versions_as_of(model, as_of, object_ids)
+    pk_name = model._meta.pk.attname
+    records = {
+        getattr(record, pk_name): record
+        for record in versions
+        if record.history_type != '-'
+    }
+    return records, m2m_as_of(model, versions)
+
+
+def book_ids_for_owner(user_id):
+    """Книги пользователя - текущие и когда-либо принадлежавшие ему"""
+    return (
+        set(Book.objects.filter(owner_id=user_id).values_list('pk', flat=True))
+        | set(Book.history.filter(owner_id=user_id).order_by().values_list('id', flat=True).distinct())
+    )
+
+
+def book_ids_for_genre(genre_id):
+    """Книги жанра - текущие и когда-либо входившие в него"""
+    genres_history = Book.history.model.genres.model
+    return (
+        set(Book.genres.through.objects.filter(genre_id=genre_id).values_list('book_id', flat=True))
+        | set(genres_history.objects.filter(genre_id=genre_id).order_by().values_list('book_id', flat=True).distinct())
+    )
+
+
+def _change(field, old, new):
+    return {'field': field.name, 'verbose_name': str(field.verbose_name), 'old': old, 'new': new}
+
+
+def plan_restore(model, as_of, object_ids):
+    """Отчет о восстановлении: [{id, action, history_id, changes}, ...]
+
+    action: update - объект изменился после as_of, recreate - удален после
+    as_of, created_after - создан после as_of (не трогается).
+    Объекты без изменений в отчет не входят.
+    """
+    versions, m2m = take_snapshot(model, as_of, object_ids)
+    current = {obj.pk: obj for obj in model.objects.filter(pk__in=object_ids)}
+    current_values = current_m2m(model, list(current))
+    tracked = [field for field in model.history.model.tracked_fields if not field.primary_key]
+
+    plan = []
+    for pk in sorted(set(versions) | set(current)):
+        version, obj = versions.get(pk), current.get(pk)
+        if version is None:
+            plan.append({'id': pk, 'action': 'created_after', 'history_id': None, 'changes': []})
+            continue
+
+        changes = []
+        for field in tracked:
+            old = field_value(field, obj) if obj is not None else None
+            new = field_value(field, version)
+            if old != new:
+                changes.append(_change(field, old, new))
+        for field in m2m_fields(model):
+            if pk not in m2m[field.name]:
+                # У версии нет истории связей (пакетное создание, версии до ее появления) -
+                # состав неизвестен, текущие связи не трогаем
+                continue
+            old = current_values[field.name].get(pk, set())
+            new = m2m[field.name][pk]
+            if old != new:
+                changes.append(_change(field, sorted(old), sorted(new)))
+
+        if changes or obj is None:
+            action = 'update' if obj is not None else 'recreate'
+            plan.append({'id': pk, 'action': action, 'history_id': str(version.history_id), 'changes': changes})
+    return plan, versions, m2m, current
+
+
+def restore_as_of(model, as_of, object_ids, user=None, dry_run=True):
+    """Вернуть объекты в состояние на момент as_of; возвращает отчет plan_restore"""
+    plan, versions, m2m, current = plan_restore(model, as_of, object_ids)
+    if dry_run:
+        return plan
+
+    reason = f"Восстановлено по состоянию на {timezone.localtime(as_of):%d.%m.%Y %H:%M}"
+    m2m_names = {field.name for field in m2m_fields(model)}
+    auto_now = [field for field in model._meta.concrete_fields if getattr(field, 'auto_now', False)]
+    now = timezone.now()
+
+    updated, update_fields, created, file_changed = [], set(), [], []
+    for entry in plan:
+        if entry['action'] == 'update':
+            obj, version = current[entry['id']], versions[entry['id']]
+            for change in entry['changes']:
+                if change['field'] not in m2m_names:
+                    field = model._meta.get_field(change['field'])
+                    setattr(obj, field.attname, getattr(version, field.attname))
+                    update_fields.add(field.name)
+                if change['field'] == 'book_file':
+                    file_changed.append(obj)
+            updated.append(obj)
+        elif entry['action'] == 'recreate':
+            obj = versions[entry['id']].instance
+            created.append(obj)
+            if model is Book:
+                file_changed.append(obj)
+
+    # Сведения о файле книги не хранятся в истории - вычисляются заново
+    for obj in file_changed:
+        obj.reset_file_metadata()
+    if file_changed and updated:
+        update_fields.update(Book.FILE_METADATA_FIELDS)
+    file_changed = [obj.pk for obj in file_changed if obj.book_file]
+
+    with transaction.atomic():
+        if updated:
+            # auto_now (updated_at книги) обновляется всегда: даже при изменении
+            # только жанров нужна новая версия, к которой привязать их историю
+            for obj in updated:
+                for field in auto_now:
+                    setattr(obj, field.attname, now)
+            update_fields.update(field.name for field in auto_now)
+            if hasattr(model, 'version'):
+                # Формы и клиенты API со старой версией получат конфликт, а не перезапишут восстановленное
+                for obj in updated:
+                    obj.version += 1
+                update_fields.add('version')
+            bulk_update_with_history(
+                updated, model, list(update_fields), default_user=user, default_change_reason=reason
+            )
+        if created:
+            _recreate(model, created, user, reason)
+        restored_ids = [obj.pk for obj in updated] + [obj.pk for obj in created]
+        if restored_ids and m2m_names:
+            _restore_m2m(model, restored_ids, m2m)
+        transaction.on_commit(lambda: _after_restore(model, updated + created, file_changed))
+    return plan
+
+
+def _recreate(model, objects, user, reason):
+    # bulk_create подставляет текущее время в auto_now_add - возвращаем исходное до записи истории
+    auto_now_add = [field for field in model._meta.concrete_fields if getattr(field, 'auto_now_add', False)]
+    original = {obj.pk: {field.attname: getattr(obj, field.attname) for field in auto_now_add} for obj in objects}
+    model.objects.bulk_create(objects)
+    if auto_now_add:
+        for obj in objects:
+            for attname, value in original[obj.pk].items():
+                setattr(obj, attname, value)
+        model.objects.bulk_update(objects, [field.name for field in auto_now_add])
+    model.history.bulk_history_create(objects, default_user=user, default_change_reason=reason)
+
+
+def _restore_m2m(model, object_ids, m2m):
+    """Связи ManyToMany и их история для новых версий (bulk_history_create их не пишет)"""
+    for field in m2m_fields(model):
+        through = field.remote_field.through
+        source, target = f'{field.m2m_field_name()}_id', f'{field.m2m_reverse_field_name()}_id'
+        # Объекты без истории связей в версии сохраняют текущие связи (см. plan_restore)
+        known_ids = [object_id for object_id in object_ids if object_id in m2m[field.name]]
+        through.objects.filter(**{f'{source}__in': known_ids}).delete()
+        through.objects.bulk_create([
+            through(**{source: object_id, target: target_id})
+            for object_id in known_ids
+            for target_id in m2m[field.name][object_id]
+        ])
+    bulk_create_m2m_history(model, list(versions_as_of(model, timezone.now(), object_ids)))
+
+
+def _after_restore(model, objects, file_changed):
+    """Производные данные, которые обычно обновляют сигналы save()"""
+    if model in (Book, Genre):
+        invalidate_suggest_index()
+        bump_cache_version(GENRE_INDEX_VERSION_KEY)
+    if model is Book:
+        for book_id in file_changed:
+            schedule_file_metadata(book_id)
+    if model is Review:
+        refresh_book_scores(list({review.book_id for review in objects}))
@@ -0,0 +1,190 @@
+"""Быстрые сериализаторы только для чтения списков
+
+Строят ответ из .values() и нескольких агрегирующих запросов на страницу
+вместо дерева полей ModelSerializer на каждый объект. Результат совпадает с
+BookListSerializer, ReviewSerializer и MessageSerializer байт в байт: порядок
+ключей, форматы дат и URL файлов те же, что у полей DRF.
+"""
+from django.contrib.auth.models import User
+from django.db.models import Count, Sum
+from rest_framework import serializers
+
+from .models import Book, Genre, Message, Review
+
+# Поля DRF, которыми форматируются значения, создаются один раз
+_datetime = serializers.DateTimeField().to_representation
+_cover_storage = Book._meta.get_field('cover_image').storage
+
+
+def pks_only(queryset):
+    """Queryset с теми же фильтрами и сортировкой, но только с pk - для пагинации"""
+    return queryset.prefetch_related(None).values_list('pk', flat=True)
+
+
+def _count_by(queryset, field, keys):
+    return dict(
+        queryset.filter(**{f'{field}__in': keys}).order_by()
+        .values(field).annotate(count=Count('pk')).values_list(field, 'count')
+    )
+
+
+def _file_url(name, request):
+    """Как FileField.to_representation: абсолютный URL, если есть request"""
+    if not name:
+        return None
+    url = _cover_storage.url(name)
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def _average_rating(total, count):
+    """Как Book.average_rating(): 0 без отзывов, иначе округление до 0.1"""
+    if not count:
+        return 0
+    return round(total / count, 1)
+
+
+def serialize_users(user_ids):
+    """{id: данные UserSerializer}"""
+    user_ids = set(user_ids)
+    books_count = _count_by(Book.objects, 'owner_id', user_ids)
+    reviews_count = _count_by(Review.objects, 'user_id', user_ids)
+    rows = User.objects.filter(pk__in=user_ids).values(
+        'id', 'username', 'email', 'first_name', 'last_name', 'date_joined'
+    )
+    return {
+        row['id']: {
+            'id': row['id'],
+            'username': row['username'],
+            'email': row['email'],
+            'first_name': row['first_name'],
+            'last_name': row['last_name'],
+            'full_name': f"{row['first_name']} {row['last_name']}".strip() or row['username'],
+            'date_joined': _datetime(row['date_joined']),
+            'books_count': books_count.get(row['id'], 0),
+            'reviews_count': reviews_count.get(row['id'], 0),
+        }
+        for row in rows
+    }
+
+
+def serialize_books(book_ids, request=None):
+    """{id: данные BookListSerializer}"""
+    book_ids = set(book_ids)
+    rows = list(Book.objects.filter(pk__in=book_ids).values(
+        'id', 'title', 'author', 'description', 'cover_image', 'book_file',
+        'owner_id', 'created_at', 'updated_at'
+    ))
+
+    # Жанры по id - в том же порядке, в каком их отдает prefetch_related('genres')
+    Through = Book.genres.through
+    book_genres = {}
+    genre_links = Through.objects.filter(book_id__in=book_ids).order_by('genre_id').values_list('book_id', 'genre_id')
+    for book_id, genre_id in genre_links:
+        book_genres.setdefault(book_id, []).append(genre_id)
+    genre_ids = {genre_id for genre_ids in book_genres.values() for genre_id in genre_ids}
+    genre_books = _count_by(Through.objects, 'genre_id', genre_ids)
+    genres = {
+        genre_id: {'id': genre_id, 'name': name, 'books_count': genre_books.get(genre_id, 0)}
+        for genre_id, name in Genre.objects.filter(pk__in=genre_ids).values_list('id', 'name')
+    }
+
+    ratings = {
+        book_id: (count, total)
+        for book_id, count, total in Review.objects.filter(book_id__in=book_ids).order_by()
+        .values('book_id').annotate(count=Count('pk'), total=Sum('rating'))
+        .values_list('book_id', 'count', 'total')
+    }
+    owners = serialize_users(row['owner_id'] for row in rows)
+
+    books = {}
+    for row in rows:
+        count, total = ratings.get(row['id'], (0, 0))
+        books[row['id']] = {
+            'id': row['id'],
+            'title': row['title'],
+            'author': row['author'],
+            'description': row['description'],
+            'cover_image': _file_url(row['cover_image'], request),
+            'owner': owners[row['owner_id']],
+            'genres': [genres[genre_id] for genre_id in book_genres.get(row['id'], [])],
+            'average_rating': _average_rating(total, count),
+            'reviews_count': count,
+            'has_file': bool(row['book_file']),
+            'created_at': _datetime(row['created_at']),
+            'updated_at': _datetime(row['updated_at']),
+        }
+    return books
+
+
+class ValuesListSerializer:
+    """Общая часть: serializer(pks, context=...).data -> список в порядке pks"""
+
+    def __init__(self, instance, context=None):
+        self.pks = list(instance)
+        self.context = context or {}
+
+    def serialize(self, pks, request):
+        raise NotImplementedError
+
+    @property
+    def data(self):
+        objects = self.serialize(self.pks, self.context.get('request'))
+        return [objects[pk] for pk in self.pks]
+
+
+class FastBookListSerializer(ValuesListSerializer):
+    """Аналог BookListSerializer(many=True)"""
+
+    def serialize(self, pks, request):
+        return serialize_books(pks, request)
+
+
+class FastReviewSerializer(ValuesListSerializer):
+    """Аналог ReviewSerializer(many=True)"""
+
+    def serialize(self, pks, request):
+        rows = list(Review.objects.filter(pk__in=pks).values(
+            'id', 'book_id', 'book__title', 'user_id', 'text', 'rating', 'created_at', 'version'
+        ))
+        users = serialize_users(row['user_id'] for row in rows)
+        return {
+            row['id']: {
+                'id': row['id'],
+                'book': row['book_id'],
+                'book_title': row['book__title'],
+                'user': users[row['user_id']],
+                'text': row['text'],
+                'rating': row['rating'],
+                'created_at': _datetime(row['created_at']),
+                'version': row['version'],
+            }
+            for row in rows
+        }
+
+
+class FastMessageSerializer(ValuesListSerializer):
+    """Аналог MessageSerializer(many=True)"""
+
+    def serialize(self, pks, request):
+        rows = list(Message.objects.filter(pk__in=pks).values(
+            'id', 'sender_id', 'recipient_id', 'book_id', 'subject', 'message', 'created_at', 'is_read'
+        ))
+        users = serialize_users(
+            [row['sender_id'] for row in rows] + [row['recipient_id'] for row in rows]
+        )
+        books = serialize_books({row['book_id'] for row in rows}, request)
+        return {
+            row['id']: {
+                'id': row['id'],
+                'sender': users[row['sender_id']],
+                'recipient': users[row['recipient_id']],
+                'book': books[row['book_id']],
+                'subject': row['subject'],
+                'message': row['message'],
+                'created_at': _datetime(row['created_at']),
+                'is_read': row['is_read'],
+            }
+            for row in rows
+        }
@@ -0,0 +1,62 @@
+"""Быстрые JSON рендерер и парсер для REST API на orjson
+
+Если orjson не установлен, используются стандартные классы DRF на модуле json.
+Вывод совпадает с JSONRenderer DRF: компактный UTF-8, даты в ISO 8601 с 'Z'
+для UTC, UUID и Decimal сериализуются так же, как в rest_framework.utils.encoders.
+"""
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    ORJSON_OPTIONS = (
+        orjson.OPT_UTC_Z
+        | orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_SERIALIZE_NUMPY
+    )
+
+# Типы, которые orjson не знает (Decimal, ленивые строки, QuerySet...), - как в DRF
+_encoder_default = JSONEncoder().default
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson; отступ 2 поддерживается, остальные - через json"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if data is None:
+            return b''
+
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent not in (None, 2):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        options = ORJSON_OPTIONS | (orjson.OPT_INDENT_2 if indent else 0)
+        ret = orjson.dumps(data, default=_encoder_default, option=options)
+        # Как и JSONRenderer: U+2028/U+2029 экранируются для встраивания в JavaScript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class ORJSONParser(JSONParser):
+    """JSONParser на orjson"""
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,155 @@
+"""Расчет рейтинга и популярности книг (таблица BookScore)
+
+Активность хранится в виде, не зависящем от времени расчета:
+log(sum(w * 2 ** ((t - ACTIVITY_EPOCH) / T))), где T - период полураспада.
+Затухание к текущему моменту - вычитание одного и того же числа для всех
+книг, поэтому сортировка по activity_score верна и для книг, которые давно
+не пересчитывались. После изменения BOOK_SCORE_HALF_LIFE_DAYS нужен полный
+пересчет (refresh_book_scores).
+"""
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count, Sum
+from django.utils import timezone
+
+from .models import Book, BookScore, Message, Review, UserActivity
+
+# Сколько книг пересчитывать за один проход
+REFRESH_BATCH_SIZE = 2000
+
+# Точка отсчета времени для activity_score
+ACTIVITY_EPOCH = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+# Общая средняя оценка (априорное среднее); обновляется полным пересчетом
+PRIOR_MEAN_CACHE_KEY = 'book_score_prior_mean'
+
+
+def get_activity_sources(since):
+    """События, из которых складывается активность: (вид, queryset, поле книги, поле времени)"""
+    return [
+        ('review', Review.objects.filter(created_at__gte=since), 'book_id', 'created_at'),
+        ('message', Message.objects.filter(created_at__gte=since), 'book_id', 'created_at'),
+        (
+            'download',
+            UserActivity.objects.filter(action='download_book', object_type='Book', timestamp__gte=since),
+            'object_id',
+            'timestamp',
+        ),
+    ]
+
+
+def bayesian_average(rating_sum, count, prior_mean, prior_weight):
+    """Средняя оценка, сглаженная к общему среднему для книг с малым числом отзывов"""
+    if count + prior_weight == 0:
+        return 0
+    return (prior_weight * prior_mean + rating_sum) / (prior_weight + count)
+
+
+def log_weight(event_time, half_life_seconds):
+    """Логарифм веса события относительно ACTIVITY_EPOCH (вес удваивается за период полураспада)"""
+    return (event_time - ACTIVITY_EPOCH).total_seconds() / half_life_seconds * math.log(2)
+
+
+def log_add(a, b):
+    """log(exp(a) + exp(b)) без переполнения"""
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def activity_threshold(now):
+    """activity_score одного события наименьшего веса в начале окна BOOK_SCORE_WINDOW_DAYS
+
+    Книги с меньшей активностью в тренды не попадают.
+    """
+    half_life_seconds = settings.BOOK_SCORE_HALF_LIFE_DAYS * 24 * 60 * 60
+    since = now - timedelta(days=settings.BOOK_SCORE_WINDOW_DAYS)
+    return math.log(min(settings.BOOK_SCORE_WEIGHTS.values())) + log_weight(since, half_life_seconds)
+
+
+def compute_activity_scores(book_ids, now):
+    """Активность по отзывам, сообщениям и скачиваниям (0 - событий в окне нет)"""
+    since = now - timedelta(days=settings.BOOK_SCORE_WINDOW_DAYS)
+    half_life_seconds = settings.BOOK_SCORE_HALF_LIFE_DAYS * 24 * 60 * 60
+    weights = {kind: math.log(weight) for kind, weight in settings.BOOK_SCORE_WEIGHTS.items()}
+
+    scores = {}
+    for kind, queryset, book_field, time_field in get_activity_sources(since):
+        rows = queryset.filter(**{f'{book_field}__in': book_ids}).values_list(book_field, time_field)
+        for book_id, event_time in rows.iterator():
+            term = weights[kind] + log_weight(event_time, half_life_seconds)
+            scores[book_id] = log_add(scores.get(book_id), term)
+    return scores
+
+
+def get_prior_mean(refresh=False):
+    """Средняя оценка по всем отзывам; между полными пересчетами берется из кэша"""
+    prior_mean = None if refresh else cache.get(PRIOR_MEAN_CACHE_KEY)
+    if prior_mean is None:
+        prior_mean = Review.objects.aggregate(avg=Avg('rating'))['avg'] or 0
+        cache.set(PRIOR_MEAN_CACHE_KEY, prior_mean, timeout=None)
+    return prior_mean
+
+
+def _refresh_batch(book_ids, now, prior_mean):
+    ratings = {
+        row['book_id']: row
+        for row in Review.objects.filter(book_id__in=book_ids)
+        .values('book_id')
+        .annotate(count=Count('id'), total=Sum('rating'))
+    }
+    activity = compute_activity_scores(book_ids, now)
+    prior_weight = settings.BOOK_SCORE_PRIOR_WEIGHT
+
+    scores = []
+    for book_id in book_ids:
+        rating = ratings.get(book_id, {'count': 0, 'total': 0})
+        count, total = rating['count'], rating['total'] or 0
+        scores.append(BookScore(
+            book_id=book_id,
+            reviews_count=count,
+            average_rating=round(total / count, 1) if count else 0,
+            bayesian_rating=bayesian_average(total, count, prior_mean, prior_weight),
+            activity_score=activity.get(book_id, 0),
+        ))
+
+    BookScore.objects.bulk_create(
+        scores,
+        update_conflicts=True,
+        unique_fields=['book'],
+        update_fields=['reviews_count', 'average_rating', 'bayesian_rating', 'activity_score', 'computed_at'],
+    )
+    return len(scores)
+
+
+def refresh_book_scores(book_ids=None):
+    """Пересчитать рейтинги указанных книг (или всех, если book_ids не передан)"""
+    now = timezone.now()
+    # Пересчет отдельных книг (после каждого отзыва или скачивания) не читает всю таблицу отзывов
+    prior_mean = get_prior_mean(refresh=book_ids is None)
+
+    books = Book.objects.order_by('pk')
+    if book_ids is not None:
+        books = books.filter(pk__in=book_ids)
+
+    refreshed = 0
+    batch = []
+    for book_id in books.values_list('pk', flat=True).iterator(chunk_size=REFRESH_BATCH_SIZE):
+        batch.append(book_id)
+        if len(batch) >= REFRESH_BATCH_SIZE:
+            refreshed += _refresh_batch(batch, now, prior_mean)
+            batch = []
+    if batch:
+        refreshed += _refresh_batch(batch, now, prior_mean)
+    return refreshed
+
+
+def schedule_score_refresh(book_id):
+    """Пересчитать рейтинг книги после успешного завершения транзакции"""
+    if book_id:
+        transaction.on_commit(lambda: refresh_book_scores([book_id]))
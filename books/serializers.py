@@ -1,8 +1,41 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from simple_history.utils import update_change_reason
+from .concurrency import save_changes
 from .models import Book, Review, Genre, UserProfile, Message, UserActivity
 
 
+class VersionedUpdateMixin:
+    """update() с проверкой версии: записываются только измененные поля
+
+    Если строку изменили после чтения объекта, вызывается VersionConflict
+    (If-Match проверяет OptimisticLockMixin до записи).
+    """
+    change_reason = None
+
+    def update(self, instance, validated_data):
+        m2m = {}
+        fields = []
+        for name, value in validated_data.items():
+            field = instance._meta.get_field(name)
+            if field.many_to_many:
+                if {obj.pk for obj in getattr(instance, name).all()} != {obj.pk for obj in value}:
+                    m2m[name] = value
+            elif getattr(instance, name) != value:
+                setattr(instance, name, value)
+                fields.append(name)
+
+        instance._change_reason = self.change_reason
+        with transaction.atomic():
+            save_changes(instance, fields, touch=bool(m2m))
+            for name, value in m2m.items():
+                getattr(instance, name).set(value)
+        return instance
+
+
 class UserSerializer(serializers.ModelSerializer):
     """Сериализатор для пользователя"""
     full_name = serializers.SerializerMethodField()
@@ -49,7 +82,7 @@ class GenreSerializer(serializers.ModelSerializer):
         return obj.book_set.count()
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(VersionedUpdateMixin, serializers.ModelSerializer):
     """Сериализатор для отзыва"""
     user = UserSerializer(read_only=True)
     user_id = serializers.IntegerField(write_only=True, required=False)
@@ -58,8 +91,10 @@ class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = ['id', 'book', 'book_title', 'user', 'user_id', 
-                 'text', 'rating', 'created_at']
-        read_only_fields = ['id', 'created_at', 'user']
+                 'text', 'rating', 'created_at', 'version']
+        read_only_fields = ['id', 'created_at', 'user', 'version']
+    
+    change_reason = "Обновлен через API"
     
     def create(self, validated_data):
         # Автоматически устанавливаем текущего пользователя
@@ -68,10 +103,6 @@ class ReviewSerializer(serializers.ModelSerializer):
         review._change_reason = "Создан через API"
         review.save()
         return review
-    
-    def update(self, instance, validated_data):
-        instance._change_reason = "Обновлен через API"
-        return super().update(instance, validated_data)
 
 
 class BookListSerializer(serializers.ModelSerializer):
@@ -113,13 +144,13 @@ class BookDetailSerializer(serializers.ModelSerializer):
     average_rating = serializers.SerializerMethodField()
     reviews_count = serializers.SerializerMethodField()
     has_file = serializers.SerializerMethodField()
-    file_size = serializers.SerializerMethodField()
     
     class Meta:
         model = Book
         fields = ['id', 'title', 'author', 'description', 'cover_image', 
                  'book_file', 'owner', 'genres', 'genre_ids', 'reviews',
                  'average_rating', 'reviews_count', 'has_file', 'file_size',
+                 'file_mime', 'file_sha256', 'page_count', 'version',
                  'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at', 'owner']
     
@@ -132,20 +163,12 @@ class BookDetailSerializer(serializers.ModelSerializer):
     def get_has_file(self, obj):
         return bool(obj.book_file)
     
-    def get_file_size(self, obj):
-        if obj.book_file:
-            try:
-                return obj.book_file.size
-            except:
-                return None
-        return None
-    
     def create(self, validated_data):
         # Автоматически устанавливаем текущего пользователя как владельца
         validated_data['owner'] = self.context['request'].user
         book = super().create(validated_data)
-        book._change_reason = "Создана через API"
-        book.save()
+        # Причина записывается в уже созданную версию: повторный save() без изменений ничего не пишет
+        update_change_reason(book, "Создана через API")
         return book
     
     def update(self, instance, validated_data):
@@ -153,7 +176,7 @@ class BookDetailSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
-class BookCreateUpdateSerializer(serializers.ModelSerializer):
+class BookCreateUpdateSerializer(VersionedUpdateMixin, serializers.ModelSerializer):
     """Сериализатор для создания и обновления книги"""
     genre_ids = serializers.PrimaryKeyRelatedField(
         queryset=Genre.objects.all(), 
@@ -164,18 +187,71 @@ class BookCreateUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Book
         fields = ['title', 'author', 'description', 'cover_image', 
-                 'book_file', 'genre_ids']
+                 'book_file', 'genre_ids', 'version']
+        read_only_fields = ['version']
+    
+    change_reason = "Обновлена через API"
     
     def create(self, validated_data):
         validated_data['owner'] = self.context['request'].user
         book = super().create(validated_data)
-        book._change_reason = "Создана через API"
-        book.save()
+        # Причина записывается в уже созданную версию: повторный save() без изменений ничего не пишет
+        update_change_reason(book, "Создана через API")
         return book
+
+
+class BookBulkCreateSerializer(serializers.ModelSerializer):
+    """Сериализатор для пакетного создания книг (без файлов)"""
+    genre_ids = serializers.PrimaryKeyRelatedField(
+        queryset=Genre.objects.all(), 
+        many=True,
+        source='genres'
+    )
     
-    def update(self, instance, validated_data):
-        instance._change_reason = "Обновлена через API"
-        return super().update(instance, validated_data)
+    class Meta:
+        model = Book
+        fields = ['title', 'author', 'description', 'genre_ids']
+    
+    def validate_title(self, value):
+        # Те же правила, что и в Book.save(): bulk_create save() не вызывает
+        try:
+            return Book(title=value).clean_title()
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.messages)
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    """Список id для пакетных операций"""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.API_BULK_MAX_ITEMS
+    )
+
+
+class PointInTimeSerializer(serializers.Serializer):
+    """Набор книг и момент времени для снимка или восстановления"""
+    at = serializers.DateTimeField()
+    owner = serializers.IntegerField(min_value=1, required=False)
+    genre = serializers.IntegerField(min_value=1, required=False)
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False,
+        max_length=settings.API_BULK_MAX_ITEMS
+    )
+    dry_run = serializers.BooleanField(default=True)
+
+    def validate(self, attrs):
+        scopes = [name for name in ('owner', 'genre', 'ids') if attrs.get(name)]
+        if len(scopes) != 1:
+            raise serializers.ValidationError('Укажите ровно один набор книг: owner, genre или ids')
+        return attrs
+
+
+class AnalyticsQuerySerializer(serializers.Serializer):
+    """Параметры отчетов аналитики"""
+    days = serializers.IntegerField(min_value=1, max_value=366, required=False)
+    weeks = serializers.IntegerField(min_value=1, max_value=104, required=False)
 
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -209,8 +285,7 @@ class MessageSerializer(serializers.ModelSerializer):
         validated_data['book'] = Book.objects.get(id=book_id)
         
         message = super().create(validated_data)
-        message._change_reason = "Создано через API"
-        message.save()
+        update_change_reason(message, "Создано через API")
         return message
 
 
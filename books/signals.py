@@ -0,0 +1,106 @@
+"""Обработчики сигналов моделей книг"""
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from simple_history.signals import pre_create_historical_record
+
+from .models import Book, Genre, Message, Review, UserActivity
+from .scoring import schedule_score_refresh
+from .suggest import invalidate_suggest_index
+from .genre_index import genre_index
+from .history_diff import store_history_diff
+
+
+@receiver([post_save, post_delete], sender=Review)
+def refresh_score_on_review(sender, instance, **kwargs):
+    """Отзыв меняет и рейтинг, и активность книги"""
+    schedule_score_refresh(instance.book_id)
+
+
+@receiver(post_save, sender=Message)
+def refresh_score_on_message(sender, instance, created, **kwargs):
+    if created:
+        schedule_score_refresh(instance.book_id)
+
+
+@receiver(post_save, sender=UserActivity)
+def refresh_score_on_download(sender, instance, created, **kwargs):
+    if created and instance.action == 'download_book' and instance.object_type == 'Book':
+        schedule_score_refresh(instance.object_id)
+
+
+SUGGEST_FIELDS = {Book: {'title', 'author'}, Genre: {'name'}}
+
+
+@receiver([post_save, post_delete], sender=Book)
+@receiver([post_save, post_delete], sender=Genre)
+def refresh_suggest_index(sender, update_fields=None, **kwargs):
+    """Названия, авторы и жанры изменились - подсказки нужно перестроить
+
+    Book.save() без изменений названия и автора (update_fields от
+    DirtyFieldsMixin) индекс не сбрасывает.
+    """
+    if update_fields is not None and not SUGGEST_FIELDS[sender].intersection(update_fields):
+        return
+    invalidate_suggest_index()
+
+
+@receiver(m2m_changed, sender=Book.genres.through)
+def refresh_suggest_genres(sender, action, **kwargs):
+    """Веса жанров в подсказках - число книг, их меняют только post_* действия"""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_suggest_index()
+
+
+@receiver(post_save, sender=Book)
+def add_book_to_genre_index(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: genre_index.add_book(instance.pk))
+
+
+@receiver(post_delete, sender=Book)
+def remove_book_from_genre_index(sender, instance, **kwargs):
+    book_id = instance.pk
+    transaction.on_commit(lambda: genre_index.remove_book(book_id))
+
+
+@receiver(post_delete, sender=Genre)
+def remove_genre_from_index(sender, instance, **kwargs):
+    genre_id = instance.pk
+    transaction.on_commit(lambda: genre_index.clear_genre(genre_id))
+
+
+@receiver(m2m_changed, sender=Book.genres.through)
+def update_genre_index(sender, instance, action, reverse, pk_set, **kwargs):
+    """Обновление битовых карт при изменении жанров книги"""
+    if action == 'post_clear':
+        if reverse:
+            # genre.book_set.clear(): из жанра убраны все книги
+            genre_id = instance.pk
+            transaction.on_commit(lambda: genre_index.clear_genre(genre_id))
+        else:
+            book_id = instance.pk
+            transaction.on_commit(lambda: genre_index.clear_book_genres(book_id))
+        return
+    if action not in ('post_add', 'post_remove'):
+        return
+
+    if reverse:
+        # genre.book_set.add(...): instance - жанр, pk_set - книги
+        changes = [(instance.pk, set(pk_set))]
+    else:
+        changes = [(genre_id, {instance.pk}) for genre_id in pk_set]
+
+    method = genre_index.add_books if action == 'post_add' else genre_index.remove_books
+
+    def apply_changes():
+        for genre_id, book_ids in changes:
+            method(genre_id, book_ids)
+
+    transaction.on_commit(apply_changes)
+
+
+@receiver(pre_create_historical_record)
+def save_history_diff(sender, history_instance, **kwargs):
+    """Изменения полей сохраняются вместе с версией, а не считаются при просмотре"""
+    store_history_diff(history_instance)
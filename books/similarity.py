@@ -0,0 +1,129 @@
+"""Построение индекса похожих книг
+
+Сходство двух книг складывается из трех косинусных мер:
+- общие жанры (M2M Book.genres);
+- общие читатели (пользователи, оставившие отзывы на обе книги);
+- TF-IDF описаний и названий.
+
+Все матрицы разреженные (scipy.sparse), произведения считаются блоками строк,
+для каждой книги сохраняются top-K соседей в таблицу BookSimilarity.
+"""
+import math
+import re
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from scipy import sparse
+
+from .models import Book, BookSimilarity, Review
+
+TOKEN_RE = re.compile(r'\w{3,}', re.UNICODE)
+
+# Сколько строк матрицы сходства считается за один шаг
+BLOCK_SIZE = 512
+
+
+def normalize_rows(matrix):
+    """L2-нормировка строк, чтобы произведение строк давало косинус"""
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return (sparse.diags(1.0 / norms) @ matrix).tocsr()
+
+
+def incidence_matrix(pairs, book_index):
+    """Бинарная матрица книга x объект из пар (book_id, object_id)"""
+    object_index = {}
+    rows, cols = [], []
+    for book_id, object_id in pairs:
+        row = book_index.get(book_id)
+        if row is None:
+            continue
+        rows.append(row)
+        cols.append(object_index.setdefault(object_id, len(object_index)))
+    data = np.ones(len(rows), dtype=np.float32)
+    matrix = sparse.csr_matrix((data, (rows, cols)), shape=(len(book_index), max(len(object_index), 1)))
+    # Дубликаты пар складываются, возвращаем матрицу к 0/1
+    matrix.data[:] = 1.0
+    return normalize_rows(matrix)
+
+
+def tfidf_matrix(texts):
+    """TF-IDF матрица книга x слово"""
+    vocabulary = {}
+    rows, cols, data = [], [], []
+    for row, text in enumerate(texts):
+        counts = {}
+        for token in TOKEN_RE.findall(text.lower()):
+            column = vocabulary.setdefault(token, len(vocabulary))
+            counts[column] = counts.get(column, 0) + 1
+        for column, count in counts.items():
+            rows.append(row)
+            cols.append(column)
+            data.append(1.0 + math.log(count))
+
+    matrix = sparse.csr_matrix(
+        (np.array(data, dtype=np.float32), (rows, cols)),
+        shape=(len(texts), max(len(vocabulary), 1)),
+    )
+    document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = np.log((1 + len(texts)) / (1 + document_frequency)) + 1.0
+    return normalize_rows(matrix @ sparse.diags(idf.astype(np.float32)))
+
+
+def top_k_neighbours(similarity_block, first_row, top_k):
+    """Top-K соседей для каждой строки блока: [(строка, [(столбец, сходство), ...]), ...]"""
+    similarity_block = similarity_block.tocsr()
+    result = []
+    for offset in range(similarity_block.shape[0]):
+        row = first_row + offset
+        start, end = similarity_block.indptr[offset], similarity_block.indptr[offset + 1]
+        columns = similarity_block.indices[start:end]
+        scores = similarity_block.data[start:end]
+
+        mask = (columns != row) & (scores > 0)
+        columns, scores = columns[mask], scores[mask]
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k)[:top_k]
+            columns, scores = columns[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        result.append((row, list(zip(columns[order].tolist(), scores[order].tolist()))))
+    return result
+
+
+def build_similarity_index(top_k=None):
+    """Пересчитать индекс похожих книг целиком, возвращает число сохраненных пар"""
+    top_k = top_k or settings.BOOK_SIMILARITY_TOP_K
+    weights = settings.BOOK_SIMILARITY_WEIGHTS
+
+    books = list(Book.objects.order_by('pk').values_list('pk', 'title', 'description'))
+    book_ids = [book_id for book_id, _, _ in books]
+    book_index = {book_id: row for row, book_id in enumerate(book_ids)}
+
+    genres = incidence_matrix(Book.genres.through.objects.values_list('book_id', 'genre_id').iterator(), book_index)
+    readers = incidence_matrix(Review.objects.values_list('book_id', 'user_id').iterator(), book_index)
+    texts = tfidf_matrix([f'{title} {description}' for _, title, description in books])
+
+    saved = 0
+    with transaction.atomic():
+        BookSimilarity.objects.all().delete()
+        for first_row in range(0, len(book_ids), BLOCK_SIZE):
+            block = slice(first_row, first_row + BLOCK_SIZE)
+            similarity = (
+                weights['genres'] * (genres[block] @ genres.T)
+                + weights['reviews'] * (readers[block] @ readers.T)
+                + weights['description'] * (texts[block] @ texts.T)
+            )
+            links = [
+                BookSimilarity(
+                    book_id=book_ids[row],
+                    similar_book_id=book_ids[column],
+                    rank=rank,
+                    score=score,
+                )
+                for row, neighbours in top_k_neighbours(similarity, first_row, top_k)
+                for rank, (column, score) in enumerate(neighbours, start=1)
+            ]
+            BookSimilarity.objects.bulk_create(links, batch_size=5000)
+            saved += len(links)
+    return saved
@@ -0,0 +1,57 @@
+"""Хранилище медиафайлов с хэшем содержимого в имени
+
+Обложки и аватары сохраняются как <имя>.<12 символов SHA-256>.<расширение>:
+новый файл получает новый URL, поэтому nginx отдает такие файлы с
+Cache-Control: immutable на год. Повторная загрузка того же файла копию
+не создает.
+"""
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_LENGTH = 12
+# Тот же вид имен, что у статики ManifestStaticFilesStorage (style.3f2a9b1c0d4e.css)
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{%d}\.[A-Za-z0-9]+$' % HASH_LENGTH)
+
+
+def content_hash(content):
+    """Первые HASH_LENGTH символов SHA-256 содержимого файла"""
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+@deconstructible
+class ContentHashedStorage(FileSystemStorage):
+    """FileSystemStorage, добавляющее к имени файла хэш содержимого"""
+
+    def hashed_name(self, name, content, max_length=None):
+        root, ext = os.path.splitext(name)
+        suffix = f'.{content_hash(content)}{ext.lower()}'
+        if max_length and len(root) + len(suffix) > max_length:
+            # Укорачиваем исходное имя, а не хэш (иначе его обрежет get_available_name)
+            directory, stem = os.path.split(root)
+            keep = max_length - len(suffix) - len(directory) - 1
+            root = os.path.join(directory, stem[:max(keep, 1)])
+        return f'{root}{suffix}'
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content, max_length)
+        if self.exists(name):
+            # Файл с тем же содержимым уже есть - URL тот же, повторно не записываем
+            return name
+        return super().save(name, content, max_length)
+
+
+content_hashed_storage = ContentHashedStorage()
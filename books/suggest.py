@@ -0,0 +1,213 @@
+"""Подсказки поиска: префиксное дерево в памяти процесса с запасным запросом к БД
+
+Устаревшее дерево перестраивается в фоновом потоке, а запросы до конца
+перестройки получают прежнее дерево (или, пока его нет, ответ из БД).
+Оба способа находят строку по началу любого ее слова.
+"""
+import heapq
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .cache_utils import bump_cache_version
+from .models import Book, Genre
+
+SUGGEST_VERSION_KEY = 'books:suggest:version'
+SUGGEST_KINDS = ('titles', 'authors', 'genres')
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text):
+    return ' '.join(text.lower().split())
+
+
+class SuggestTrie:
+    """Подсказки по префиксу с ограниченным расходом памяти
+
+    Для коротких префиксов (до top_depth символов - первые уровни
+    префиксного дерева) top-N готов заранее: это самые частые запросы
+    с самым большим числом совпадений. Более длинные префиксы ищутся
+    двоичным поиском в отсортированном массиве ключей (начал слов) -
+    совпадений у них немного, и top-N выбирается из них при запросе.
+    """
+
+    def __init__(self, limit, max_depth, top_depth):
+        self.limit = limit
+        self.max_depth = max_depth
+        self.top_depth = top_depth
+        self._top = {}  # префикс -> [(-вес, текст)], отсортировано, не длиннее limit
+        self._entries = []  # номер строки -> (-вес, текст)
+        self._keys = []
+        self._key_entries = array('L')
+        self._pending = []
+        self._short = defaultdict(list)
+
+    def insert(self, text, weight):
+        """Добавить строку; она находится по началу любого своего слова"""
+        entry_id = len(self._entries)
+        entry = (-weight, text)
+        self._entries.append(entry)
+        words = normalize(text).split(' ')
+        for start in range(len(words)):
+            key = ' '.join(words[start:])[:self.max_depth]
+            for depth in range(1, min(len(key), self.top_depth) + 1):
+                self._short[key[:depth]].append(entry)
+            if len(key) > self.top_depth:
+                self._pending.append((key, entry_id))
+
+    def freeze(self):
+        """Отсортировать ключи после всех insert; до этого длинные префиксы не ищутся"""
+        self._pending.sort()
+        self._keys = [key for key, _ in self._pending]
+        self._key_entries = array('L', (entry_id for _, entry_id in self._pending))
+        self._pending = []
+        self._top = {prefix: heapq.nsmallest(self.limit, set(entries)) for prefix, entries in self._short.items()}
+        self._short = defaultdict(list)
+        return self
+
+    def search(self, prefix):
+        prefix = normalize(prefix)[:self.max_depth]
+        if len(prefix) <= self.top_depth:
+            return [text for _, text in self._top.get(prefix, [])]
+
+        entry_ids = set()
+        index = bisect_left(self._keys, prefix)
+        while index < len(self._keys) and self._keys[index].startswith(prefix):
+            entry_ids.add(self._key_entries[index])
+            index += 1
+        return [text for _, text in heapq.nsmallest(self.limit, (self._entries[i] for i in entry_ids))]
+
+
+class SuggestIndex:
+    """Индекс подсказок для названий, авторов и жанров"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tries = None
+        self._version = None
+        self._built_at = 0.0
+        self._rebuilding = False
+
+    def _load_entries(self):
+        titles = Counter()
+        authors = Counter()
+        rows = Book.objects.order_by().values_list('title', 'author', 'score__reviews_count')
+        for title, author, reviews_count in rows.iterator():
+            # Книги с отзывами поднимаются выше в подсказках
+            titles[title] += 1 + (reviews_count or 0)
+            authors[author] += 1
+        genres = Counter(dict(
+            Genre.objects.annotate(books_count=Count('book')).values_list('name', 'books_count')
+        ))
+        return {'titles': titles, 'authors': authors, 'genres': genres}
+
+    def build(self):
+        if Book.objects.count() > settings.SEARCH_SUGGEST_MAX_ITEMS:
+            # Слишком большой каталог для памяти процесса - работаем через БД
+            return None
+
+        entries = self._load_entries()
+
+        tries = {}
+        for kind, counter in entries.items():
+            trie = SuggestTrie(
+                settings.SEARCH_SUGGEST_LIMIT, settings.SEARCH_SUGGEST_MAX_DEPTH, settings.SEARCH_SUGGEST_TOP_DEPTH
+            )
+            for text, weight in counter.items():
+                trie.insert(text, weight)
+            tries[kind] = trie.freeze()
+        return tries
+
+    def get_tries(self):
+        """Текущие деревья; если каталог изменился, запускается фоновая перестройка
+
+        Пока она идет, возвращается прежнее дерево, а до первой
+        постройки - None (подсказки берутся из БД).
+        """
+        version = cache.get(SUGGEST_VERSION_KEY, 0)
+        now = time.monotonic()
+        is_stale = self._version != version or now - self._built_at > settings.SEARCH_SUGGEST_TTL
+        recently_built = now - self._built_at < settings.SEARCH_SUGGEST_MIN_REBUILD_SECONDS
+        if not is_stale or (self._version is not None and recently_built):
+            return self._tries
+
+        with self._lock:
+            if not self._rebuilding:
+                self._rebuilding = True
+                threading.Thread(target=self._rebuild, args=(version,), daemon=True).start()
+        return self._tries
+
+    def _rebuild(self, version):
+        try:
+            tries = self.build()
+        except Exception:
+            logger.exception('Не удалось перестроить индекс подсказок')
+        else:
+            self._tries = tries
+            self._version = version
+        finally:
+            self._built_at = time.monotonic()
+            self._rebuilding = False
+            connections.close_all()
+
+    def suggest(self, query):
+        tries = self.get_tries()
+        if tries is None:
+            return None
+        return {kind: tries[kind].search(query) for kind in SUGGEST_KINDS}
+
+
+suggest_index = SuggestIndex()
+
+
+def invalidate_suggest_index():
+    """Сообщить всем процессам, что индекс подсказок устарел"""
+    bump_cache_version(SUGGEST_VERSION_KEY)
+
+
+def word_prefix_q(field, query):
+    """Строка начинается с query или содержит слово, начинающееся с query"""
+    return Q(**{f'{field}__istartswith': query}) | Q(**{f'{field}__icontains': f' {query}'})
+
+
+def suggest_from_database(query):
+    """Запасной вариант: поиск по началу слова через индексы UPPER(...) text_pattern_ops и gin_trgm_ops
+
+    Совпадения и веса те же, что у префиксного дерева.
+    """
+    limit = settings.SEARCH_SUGGEST_LIMIT
+    query = query[:settings.SEARCH_SUGGEST_MAX_DEPTH]
+    books = Book.objects.order_by()
+
+    titles = books.filter(word_prefix_q('title', query)).values('title').annotate(
+        weight=Count('id') + Coalesce(Sum('score__reviews_count'), 0)
+    )
+    authors = books.filter(word_prefix_q('author', query)).values('author').annotate(weight=Count('id'))
+    genres = Genre.objects.filter(word_prefix_q('name', query)).annotate(weight=Count('book'))
+    return {
+        'titles': [row['title'] for row in titles.order_by('-weight', 'title')[:limit]],
+        'authors': [row['author'] for row in authors.order_by('-weight', 'author')[:limit]],
+        'genres': list(genres.order_by('-weight', 'name').values_list('name', flat=True)[:limit]),
+    }
+
+
+def get_suggestions(query):
+    """Подсказки для строки запроса: {'titles': [...], 'authors': [...], 'genres': [...]}"""
+    query = normalize(query)
+    if len(query) < settings.SEARCH_SUGGEST_MIN_LENGTH:
+        return {kind: [] for kind in SUGGEST_KINDS}, 'none'
+
+    suggestions = suggest_index.suggest(query)
+    if suggestions is not None:
+        return suggestions, 'memory'
+    return suggest_from_database(query), 'database'
@@ -0,0 +1,441 @@
+import glob
+import logging
+import os
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .bulk import mark_all_messages_read
+from .logging_utils import LockingRotatingFileHandler, fcntl
+from .db_router import ReadReplicaRouter, replica_reads
+from .history_utils import bulk_log_user_activity
+from .genre_index import GENRE_INDEX_VERSION_KEY, GenreBitmapIndex, filter_books_by_genres, genre_index
+from .jobs import TASKS, claim_next_job, enqueue, run_next_job, task
+from .models import Book, Genre, Job, Message, Review, UserActivity, UserProfile
+from .pagination import estimate_count
+from .point_in_time import restore_as_of
+from .read_serializers import FastReviewSerializer
+from .serializers import ReviewSerializer
+from .suggest import SUGGEST_KINDS, SUGGEST_VERSION_KEY, SuggestIndex, suggest_from_database
+
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class PrimaryTestCase(TestCase):
+    """Тесты только с основной базой: реплика (TEST MIRROR) не видит данные незавершенной транзакции TestCase"""
+
+
+class FastReviewSerializerTests(PrimaryTestCase):
+    """Быстрый сериализатор списка отзывов совпадает с ReviewSerializer"""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+        self.reader = User.objects.create_user('reader', first_name='Иван', last_name='Петров')
+        book = Book.objects.create(title='Война и мир', author='Лев Толстой', description='Роман', owner=self.owner)
+        Review.objects.create(book=book, user=self.reader, text='Отлично', rating=5)
+        review = Review.objects.create(book=book, user=self.owner, text='Хорошо', rating=4)
+        Review.objects.filter(pk=review.pk).update(version=3)
+
+    def test_same_output_as_review_serializer(self):
+        reviews = list(Review.objects.order_by('pk'))
+        expected = ReviewSerializer(reviews, many=True).data
+        fast = FastReviewSerializer([review.pk for review in reviews]).data
+        self.assertEqual(fast, [dict(row) for row in expected])
+        self.assertEqual([row['version'] for row in fast], [1, 3])
+
+
+class GenreFilterTests(PrimaryTestCase):
+    """Фильтр по жанрам дает одинаковый результат списком id и подзапросами"""
+
+    def setUp(self):
+        owner = User.objects.create_user('owner')
+        self.novel = Genre.objects.create(name='Роман')
+        self.history = Genre.objects.create(name='История')
+        self.poetry = Genre.objects.create(name='Поэзия')
+        self.books = [
+            Book.objects.create(title=f'Книга {n}', author='Автор', description='Описание', owner=owner)
+            for n in range(4)
+        ]
+        self.books[0].genres.add(self.novel, self.history)
+        self.books[1].genres.add(self.novel)
+        self.books[2].genres.add(self.poetry)
+        genre_index.rebuild()  # сигналы срабатывают после коммита - перестроить индекс
+
+    def filtered(self, **genres):
+        return list(filter_books_by_genres(Book.objects.order_by('pk'), **genres))
+
+    def test_id_list_and_subquery_match(self):
+        cases = [
+            {'all_of': [self.novel.pk, self.history.pk]},
+            {'any_of': [self.history.pk, self.poetry.pk]},
+            {'none_of': [self.novel.pk]},
+            {'all_of': [self.novel.pk], 'none_of': [self.history.pk]},
+        ]
+        for genres in cases:
+            with self.subTest(**genres):
+                by_ids = self.filtered(**genres)
+                with override_settings(GENRE_INDEX_MAX_IDS=0):
+                    self.assertEqual(self.filtered(**genres), by_ids)
+        self.assertEqual(self.filtered(none_of=[self.novel.pk]), self.books[2:])
+
+    def test_stale_index_is_served_during_rebuild(self):
+        index = GenreBitmapIndex()
+        index.rebuild()
+        old_state = index._state
+        cache.set(GENRE_INDEX_VERSION_KEY, index._version + 1)
+        release = threading.Event()
+
+        def slow_build():
+            release.wait(5)
+            return {}, 0
+
+        with mock.patch.object(index, 'build', side_effect=slow_build):
+            self.assertEqual(index.query_bitmap(none_of=[self.novel.pk]), old_state[1] & ~old_state[0][self.novel.pk])
+            release.set()
+            while index._rebuilding:
+                time.sleep(0.01)
+        self.assertEqual(index._state, ({}, 0))
+
+    def test_not_built_index_uses_subqueries(self):
+        with mock.patch.object(genre_index, '_state', None), mock.patch.object(genre_index, 'ensure_fresh'):
+            self.assertEqual(self.filtered(all_of=[self.novel.pk]), self.books[:2])
+
+
+class RestoreAsOfTests(PrimaryTestCase):
+    """Восстановление книг по состоянию на момент времени"""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+        self.genre = Genre.objects.create(name='Роман')
+        self.book = Book.objects.create(title='Война и мир', author='Лев Толстой', description='Роман', owner=self.owner)
+        self.book.genres.add(self.genre)
+
+    def test_version_without_m2m_history_keeps_genres(self):
+        # Версии без истории жанров (пакетное создание, записи до ее появления)
+        Book.history.model.genres.model.objects.all().delete()
+        as_of = timezone.now()
+        self.book.title = 'Анна Каренина'
+        self.book.save()
+
+        plan = restore_as_of(Book, as_of, [self.book.pk], dry_run=False)
+
+        self.assertEqual([change['field'] for change in plan[0]['changes']], ['title'])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.title, 'Война и мир')
+        self.assertEqual(list(self.book.genres.all()), [self.genre])
+
+
+class DirtyFieldsTests(PrimaryTestCase):
+    """save() пишет только измененные поля и не создает пустые версии истории"""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='secret')
+        self.reader = User.objects.create_user('reader')
+        Book.objects.create(title='Война и мир', author='Лев Толстой', description='Роман', owner=self.owner)
+        self.book = Book.objects.get()
+
+    def test_unchanged_save_does_not_query(self):
+        history_count = self.book.history.count()
+        with self.assertNumQueries(0):
+            self.book.save()
+        self.assertEqual(self.book.history.count(), history_count)
+
+    def test_changed_save_updates_only_changed_columns(self):
+        history_count = self.book.history.count()
+        self.book.author = 'Л. Н. Толстой'
+        with CaptureQueriesContext(connection) as queries:
+            self.book.save()
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"author"', updates[0])
+        self.assertNotIn('"title"', updates[0])
+        self.assertNotIn('"description"', updates[0])
+        self.assertEqual(self.book.history.count(), history_count + 1)
+        self.assertEqual(self.book.history.first().history_diff, {'author': ['Лев Толстой', 'Л. Н. Толстой']})
+
+    def test_untracked_change_skips_history(self):
+        history_count = self.book.history.count()
+        self.book.file_mime = 'application/pdf'
+        self.book.save()
+        self.assertEqual(self.book.history.count(), history_count)
+        self.assertEqual(Book.objects.get().file_mime, 'application/pdf')
+
+    def test_read_message_twice_writes_one_version(self):
+        message = Message.objects.create(sender=self.reader, recipient=self.owner, book=self.book, subject='Тема', message='Текст')
+        self.client.login(username='owner', password='secret')
+        self.client.get(reverse('message_detail', args=[message.pk]))
+        self.client.get(reverse('message_detail', args=[message.pk]))
+        self.assertEqual(message.history.filter(history_type='~').count(), 1)
+        self.assertTrue(Message.objects.get().is_read)
+
+    def test_unchanged_profile_post_writes_nothing(self):
+        profile = UserProfile.objects.create(user=self.owner, bio='О себе')
+        data = {'first_name': '', 'last_name': '', 'bio': 'О себе', 'location': '', 'phone': '', 'telegram': ''}
+        self.client.login(username='owner', password='secret')
+        history_count = profile.history.count()
+        response = self.client.post(reverse('user_profile'), data, follow=True)
+        self.assertEqual(profile.history.count(), history_count)
+        self.assertEqual([str(message) for message in response.context['messages']], ['Изменений нет.'])
+
+
+class SuggestTests(PrimaryTestCase):
+    """Подсказки из дерева и из БД совпадают; перестройка не блокирует запрос"""
+
+    def setUp(self):
+        owner = User.objects.create_user('owner')
+        # Латиница: в SQLite регистронезависимый LIKE работает только для ASCII
+        genre = Genre.objects.create(name='World classics')
+        for title, author in [('War and Peace', 'Leo Tolstoy'), ('Peace of Mind', 'Anthology'),
+                              ('Peaceful Atom', 'Ivan Peacock'), ('War and Peace', 'Leo Tolstoy')]:
+            Book.objects.create(title=title, author=author, description='Описание', owner=owner).genres.add(genre)
+
+    def test_memory_and_database_match(self):
+        tries = SuggestIndex().build()
+        for query in ('peace', 'war and', 'tolstoy', 'clas', 'peac'):
+            with self.subTest(query=query):
+                from_memory = {kind: tries[kind].search(query) for kind in SUGGEST_KINDS}
+                self.assertEqual(suggest_from_database(query), from_memory)
+        self.assertEqual(tries['titles'].search('peace'), ['War and Peace', 'Peace of Mind', 'Peaceful Atom'])
+
+    def test_long_prefix_ranks_by_weight(self):
+        tries = SuggestIndex().build()
+        self.assertEqual(tries['titles'].search('peace o'), ['Peace of Mind'])
+        self.assertEqual(tries['authors'].search('ivan p'), ['Ivan Peacock'])
+        self.assertEqual(tries['titles'].search('peacef'), ['Peaceful Atom'])
+
+    def test_only_suggested_fields_invalidate(self):
+        book = Book.objects.get(title='Peace of Mind')
+        version = cache.get(SUGGEST_VERSION_KEY, 0)
+        book.description = 'Другое описание'
+        book.save()
+        self.assertEqual(cache.get(SUGGEST_VERSION_KEY, 0), version)
+        book.title = 'Peace of Heart'
+        book.save()
+        self.assertEqual(cache.get(SUGGEST_VERSION_KEY, 0), version + 1)
+        book.genres.clear()
+        self.assertEqual(cache.get(SUGGEST_VERSION_KEY, 0), version + 2)
+
+    def test_stale_index_is_served_during_rebuild(self):
+        index = SuggestIndex()
+        index._tries, index._version = {'titles': 'old'}, -1
+        release = threading.Event()
+
+        def slow_build():
+            release.wait(5)
+            return {'titles': 'new'}
+
+        with mock.patch.object(index, 'build', side_effect=slow_build) as build:
+            self.assertEqual(index.get_tries(), {'titles': 'old'})
+            self.assertEqual(index.get_tries(), {'titles': 'old'})
+            release.set()
+            while index._rebuilding:
+                time.sleep(0.01)
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(index.get_tries(), {'titles': 'new'})
+
+
+class HealthCheckTests(TransactionTestCase):
+    """Публично /health/ отдает только статус, подробности - сотрудникам и по токену"""
+
+    databases = '__all__'  # /health/ проверяет все базы, в том числе реплики
+
+    def test_public_response_has_only_status(self):
+        response = self.client.get(reverse('health_check'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'ok': True, 'status': 'ok'})
+
+    @override_settings(HEALTH_CHECK_TOKEN='secret-token')
+    def test_token_gives_details(self):
+        response = self.client.get(reverse('health_check'), HTTP_X_HEALTH_TOKEN='wrong')
+        self.assertNotIn('databases', response.json())
+        response = self.client.get(reverse('health_check'), HTTP_X_HEALTH_TOKEN='secret-token')
+        self.assertIn('default', response.json()['databases'])
+
+    def test_staff_gets_details(self):
+        User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.login(username='admin', password='secret')
+        response = self.client.get(reverse('health_check'))
+        self.assertEqual(response.json()['pool_mode'], 'direct')
+
+
+class MarkAllMessagesReadTests(PrimaryTestCase):
+    """Отметка всех сообщений прочитанными пишет в историю изменение, а не создание"""
+
+    def test_history_records_are_updates(self):
+        owner = User.objects.create_user('owner')
+        reader = User.objects.create_user('reader')
+        book = Book.objects.create(title='Война и мир', author='Лев Толстой', description='Роман', owner=owner)
+        for n in range(3):
+            Message.objects.create(sender=reader, recipient=owner, book=book, subject=f'Тема {n}', message='Текст')
+
+        marked, unread = mark_all_messages_read(owner)
+
+        self.assertEqual((marked, unread), (3, 0))
+        history = Message.history.filter(history_change_reason='Все сообщения отмечены как прочитанные')
+        self.assertEqual(history.count(), 3)
+        self.assertEqual(set(history.values_list('history_type', flat=True)), {'~'})
+
+
+
+
+@override_settings(JOB_QUEUE_EAGER=False)
+class BulkUserActivityTests(PrimaryTestCase):
+    """Пакетная активность пишется той же фоновой очередью, что и одиночная"""
+
+    def test_batch_is_one_job(self):
+        user = User.objects.create_user('reader')
+        job = bulk_log_user_activity(user, 'read_message', 'Message', [(1, 'Первое'), (2, 'Второе')])
+        logged_at = timezone.now()
+
+        self.assertEqual(Job.objects.get(), job)
+        self.assertFalse(UserActivity.objects.exists())
+        self.assertTrue(run_next_job())
+
+        activities = list(UserActivity.objects.order_by('object_id'))
+        self.assertEqual([(a.object_id, a.description) for a in activities], [(1, 'Первое'), (2, 'Второе')])
+        self.assertTrue(all(activity.timestamp <= logged_at for activity in activities))
+        self.assertEqual(UserActivity.history.filter(history_user=user).count(), 2)
+        self.assertIsNone(bulk_log_user_activity(user, 'read_message', 'Message', []))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'статистика pg_class есть только в PostgreSQL')
+class EstimateCountTests(PrimaryTestCase):
+    """Оценка числа строк секционированной таблицы - сумма по секциям"""
+
+    def test_partitioned_table(self):
+        user = User.objects.create_user('reader')
+        UserActivity.objects.bulk_create(UserActivity(user=user, action='login') for _ in range(5))
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {UserActivity._meta.db_table}')
+        self.assertEqual(estimate_count(UserActivity.objects.all()), 5)
+
+
+
+@override_settings(JOB_QUEUE_EAGER=False, DATABASE_REPLICAS=[])
+class JobQueueTests(TransactionTestCase):
+    """Задача занимается короткой транзакцией и выполняется вне ее"""
+
+    def setUp(self):
+        self.calls = []
+
+        @task('tests.record')
+        def record(fail=False):
+            self.calls.append(transaction.get_connection().in_atomic_block)
+            if fail:
+                raise ValueError('ошибка задачи')
+
+        self.addCleanup(TASKS.pop, 'tests.record')
+
+    def test_task_runs_outside_claim_transaction(self):
+        enqueue('tests.record')
+        self.assertTrue(run_next_job())
+        self.assertEqual(self.calls, [False])
+        self.assertFalse(Job.objects.exists())
+
+    def test_claimed_job_is_leased(self):
+        job = enqueue('tests.record')
+        claimed = claim_next_job()
+        self.assertEqual((claimed.pk, claimed.attempts), (job.pk, 1))
+        self.assertGreater(claimed.locked_until, timezone.now())
+        self.assertIsNone(claim_next_job())
+
+        # Обработчик упал - после окончания аренды задачу забирает другой
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now())
+        self.assertEqual(claim_next_job().attempts, 2)
+
+    def test_failed_job_is_released_for_retry(self):
+        enqueue('tests.record', fail=True)
+        self.assertTrue(run_next_job())
+        job = Job.objects.get()
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(job.locked_until)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('ошибка задачи', job.last_error)
+
+
+@skipUnless(fcntl is not None and hasattr(os, 'fork'), 'нужны fork и fcntl')
+class LockingRotatingFileHandlerTests(SimpleTestCase):
+    """Обработчик, созданный до fork (gunicorn --preload), не теряет строки при ротации"""
+
+    def test_forked_processes_keep_all_lines(self):
+        directory = tempfile.mkdtemp()
+        handler = LockingRotatingFileHandler(os.path.join(directory, 'app.log'), maxBytes=2000, backupCount=5000)
+        children = []
+        for process in range(4):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    for line in range(1000):
+                        handler.emit(logging.makeLogRecord({'msg': f'{process} {line}'}))
+                    handler.close()
+                finally:
+                    os._exit(0)
+            children.append(pid)
+        for pid in children:
+            os.waitpid(pid, 0)
+        handler.close()
+
+        lines = 0
+        for path in glob.glob(os.path.join(directory, 'app.log*')):
+            if not path.endswith('.lock'):
+                with open(path) as log_file:
+                    lines += len(log_file.read().splitlines())
+        self.assertEqual(lines, 4000)
+
+
+@skipUnless(settings.DATABASE_REPLICAS, 'нужны реплики: DATABASE_REPLICA_URLS=sqlite:///r1.db,sqlite:///r2.db')
+class ReadReplicaRoutingTests(TransactionTestCase):
+    """Чтение из реплик (в тестах - TEST MIRROR основной базы)
+
+    TransactionTestCase: данные зафиксированы, и реплика видит их через свое соединение.
+    """
+
+    databases = {'default', *settings.DATABASE_REPLICAS}
+
+    def setUp(self):
+        self.router = ReadReplicaRouter()
+        self.owner = User.objects.create_user('owner', password='secret')
+        Book.objects.create(title='Война и мир', author='Лев Толстой', description='Роман', owner=self.owner)
+
+    def test_one_replica_per_block(self):
+        with replica_reads():
+            aliases = {self.router.db_for_read(Book) for _ in range(50)}
+        self.assertEqual(len(aliases), 1)
+        self.assertIn(aliases.pop(), settings.DATABASE_REPLICAS)
+        self.assertEqual(self.router.db_for_read(Book), 'default')
+
+    def test_write_pins_to_primary(self):
+        with replica_reads() as state:
+            self.assertIn(self.router.db_for_read(Book), settings.DATABASE_REPLICAS)
+            self.router.db_for_write(Book)
+            self.assertEqual(self.router.db_for_read(Book), 'default')
+        self.assertTrue(state['wrote'])
+
+    def test_get_request_reads_from_one_replica(self):
+        replica_queries = {alias: CaptureQueriesContext(connections[alias]) for alias in settings.DATABASE_REPLICAS}
+        for context in replica_queries.values():
+            context.__enter__()
+        try:
+            response = self.client.get('/api/v1/books/', HTTP_HOST='localhost')
+        finally:
+            for context in replica_queries.values():
+                context.__exit__(None, None, None)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+        used = [alias for alias, context in replica_queries.items() if context.captured_queries]
+        self.assertEqual(len(used), 1)
+
+    def test_write_request_sets_primary_cookie(self):
+        self.client.login(username='owner', password='secret')
+        response = self.client.post(reverse('user_profile'), {'bio': 'О себе'}, HTTP_HOST='localhost')
+        self.assertIn(settings.REPLICA_PIN_COOKIE, response.cookies)
@@ -0,0 +1,136 @@
+"""Ограничение частоты запросов: token bucket в общем кэше
+
+Корзина пользователя (или IP для анонимов) хранится в кэше Django, поэтому
+при Redis (REDIS_URL) лимиты общие для всех процессов gunicorn. Корзина
+вмещает N токенов и пополняется со скоростью N за период из строки лимита
+('30/min'), так что короткие всплески допускаются, а средняя частота - нет.
+В Redis токен берется одним Lua-скриптом, поэтому параллельные запросы не
+превышают лимит; локальный кэш (разработка) защищен блокировкой процесса.
+"""
+import threading
+import time
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from .history_utils import get_client_ip
+
+THROTTLE_KEY_PREFIX = 'throttle'
+RATE_PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'30/min' -> (30, 60), формат как в DRF"""
+    num, period = rate.split('/')
+    return int(num), RATE_PERIODS[period[0]]
+
+
+# Пополнение и списание токена за один вызов; время берется у Redis, а не у процессов
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * capacity / period)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(period))
+return {allowed, tostring(tokens)}
+"""
+
+_local_lock = threading.Lock()
+_scripts = {}
+
+
+def _consume_redis(cache, key, capacity, period):
+    client = cache._cache.get_client(key, write=True)
+    script = _scripts.get(id(client))
+    if script is None:
+        script = _scripts[id(client)] = client.register_script(TOKEN_BUCKET_SCRIPT)
+    allowed, tokens = script(keys=[cache.make_and_validate_key(key)], args=[capacity, period])
+    return bool(allowed), float(tokens)
+
+
+def _consume_local(cache, key, capacity, period):
+    with _local_lock:
+        now = time.time()
+        tokens, updated_at = cache.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * capacity / period)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        cache.set(key, (tokens, now), timeout=period)
+    return allowed, tokens
+
+
+def consume_token(key, capacity, period):
+    """Взять токен из корзины: (разрешено, сколько секунд ждать)"""
+    cache = caches[DEFAULT_CACHE_ALIAS]
+    consume = _consume_redis if isinstance(cache, RedisCache) else _consume_local
+    allowed, tokens = consume(cache, key, capacity, period)
+    if allowed:
+        return True, 0
+    return False, (1 - tokens) * period / capacity
+
+
+def get_throttle_ident(request):
+    """Пользователь - по id, аноним - по IP (как в log_user_activity)"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return 'user', str(user.pk)
+    return 'anon', get_client_ip(request)
+
+
+def check_rate(request, scope):
+    """Проверить лимит области scope: (разрешено, сколько секунд ждать)"""
+    kind, ident = get_throttle_ident(request)
+    rate = api_settings.DEFAULT_THROTTLE_RATES.get(f'{scope}_{kind}')
+    if not rate or not ident:
+        return True, 0
+    capacity, period = parse_rate(rate)
+    return consume_token(f'{THROTTLE_KEY_PREFIX}:{scope}:{kind}:{ident}', capacity, period)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Базовый класс для DRF: область определяет get_scope()"""
+    wait_seconds = 0
+
+    def get_scope(self, request, view):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(request, view)
+        if scope is None:
+            return True
+        allowed, self.wait_seconds = check_rate(request, scope)
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class SearchRateThrottle(TokenBucketThrottle):
+    """Поиск: ?search= в любом списке; подсказки - своя область с лимитом на каждое нажатие клавиши"""
+
+    def get_scope(self, request, view):
+        if getattr(view, 'action', None) == 'suggest':
+            return 'suggest'
+        if request.query_params.get('search'):
+            return 'search'
+        return None
+
+
+class ActionRateThrottle(TokenBucketThrottle):
+    """Области по действиям ViewSet: throttle_scopes = {'download': 'download', ...}"""
+
+    def get_scope(self, request, view):
+        return getattr(view, 'throttle_scopes', {}).get(getattr(view, 'action', None))
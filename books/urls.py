@@ -17,6 +17,7 @@ urlpatterns = [
 
     # Сообщения
     path('messages/', views.messages_inbox, name='messages_inbox'),
+    path('messages/mark-all-read/', views.messages_mark_all_read, name='messages_mark_all_read'),
     path('message/<int:pk>/', views.message_detail, name='message_detail'),
 
     # Пользователи
@@ -28,4 +29,7 @@ urlpatterns = [
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
     path('password-change/', auth_views.PasswordChangeView.as_view(), name='password_change'),
     path('password-change/done/', auth_views.PasswordChangeDoneView.as_view(), name='password_change_done'),
+
+    # Служебное
+    path('health/', views.health_check, name='health_check'),
 ]
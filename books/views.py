@@ -5,25 +5,31 @@ from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator
 from django.db.models import Q, Avg, Count
 from django.http import HttpResponse, Http404, JsonResponse
+from django.views.decorators.http import require_POST
 from django.contrib.auth.models import User
 from django.contrib.auth import login
+from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
+import hmac
 import os
 from .models import Book, Review, Genre, UserProfile, Message
+from .concurrency import VersionConflict
 from .forms import BookForm, ReviewForm, UserProfileForm, CustomUserCreationForm, MessageForm
+from .db_health import get_database_health
+from .history_utils import log_user_activity
+from .bulk import mark_all_messages_read
+from .facets import filter_by_author_initial, filter_by_has_file, get_catalog_facets
+from .genre_index import filter_books_by_genres, parse_id_list
 
 
 def home(request):
 
-    recent_books = Book.objects.select_related('owner').prefetch_related('genres').order_by('-created_at')[:6]
+    recent_books = Book.objects.select_related('owner', 'score').order_by('-created_at')[:6]
 
-    popular_books = Book.objects.annotate(
-        avg_rating=Avg('reviews__rating'),
-        reviews_count=Count('reviews')
-    ).filter(
-        reviews_count__gt=0
-    ).order_by('-avg_rating', '-reviews_count')[:5]
+    popular_books = Book.objects.select_related('owner', 'score').filter(
+        score__reviews_count__gt=0
+    ).order_by('-score__bayesian_rating', '-score__reviews_count')[:5]
 
     total_books = Book.objects.count()
     total_users = User.objects.count()
@@ -41,8 +47,7 @@ def home(request):
 
 def book_catalog(request):
     """Каталог книг"""
-    books = Book.objects.all().select_related('owner').prefetch_related('genres')
-    genres = Genre.objects.all()
+    books = Book.objects.all().select_related('owner', 'score')
 
     # Поиск
     search_query = request.GET.get('search')
@@ -52,27 +57,51 @@ def book_catalog(request):
             Q(author__icontains=search_query)
         )
 
-    # Фильтр по жанру
-    genre_filter = request.GET.get('genre')
-    if genre_filter:
-        books = books.filter(genres__id=genre_filter)
+    # Фильтр по жанрам: все выбранные (genre), любой из (genre_any), кроме (exclude_genre)
+    selected_genres = parse_id_list(request.GET.getlist('genre'))
+    books = filter_books_by_genres(
+        books,
+        all_of=selected_genres,
+        any_of=parse_id_list(request.GET.getlist('genre_any')),
+        none_of=parse_id_list(request.GET.getlist('exclude_genre')),
+    )
+
+    # Фильтр по первой букве автора
+    author_initial = request.GET.get('author_initial')
+    if author_initial:
+        books = filter_by_author_initial(books, author_initial)
+
+    # Фильтр по наличию файла
+    has_file = request.GET.get('has_file')
+    if has_file:
+        books = filter_by_has_file(books, has_file)
+
+    # Счетчики для фильтров по текущей выборке
+    facets = get_catalog_facets(books)
 
     # Пагинация
     paginator = Paginator(books, 12)  # 12 книг на страницу
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
 
+    # Параметры фильтров для ссылок пагинации
+    filter_params = request.GET.copy()
+    filter_params.pop('page', None)
+
     context = {
         'page_obj': page_obj,
-        'genres': genres,
+        'facets': facets,
         'search_query': search_query,
-        'selected_genre': int(genre_filter) if genre_filter else None,
+        'selected_genres': selected_genres,
+        'selected_author_initial': author_initial,
+        'selected_has_file': has_file,
+        'filter_query': filter_params.urlencode(),
     }
     return render(request, 'books/catalog.html', context)
 
 
 def book_detail(request, pk):
-    book = get_object_or_404(Book, pk=pk)
+    book = get_object_or_404(Book.objects.select_related('owner', 'score'), pk=pk)
     reviews = book.reviews.all().select_related('user')
     # Форма для добавления отзыва
     review_form = None
@@ -96,7 +125,7 @@ def book_detail(request, pk):
         'reviews': reviews,
         'review_form': review_form,
         'user_review': user_review,
-        'average_rating': book.average_rating(),
+        'similar_books': book.get_similar_books(limit=5),
     }
     return render(request, 'books/book_detail.html', context)
 
@@ -136,9 +165,16 @@ def edit_book(request, pk):
         form = BookForm(request.POST, request.FILES, instance=book)
         if form.is_valid():
             try:
-                book = form.save()
+                book = form.save_changes()
                 messages.success(request, 'Книга успешно обновлена!')
                 return redirect('book_detail', pk=book.pk)
+            except VersionConflict:
+                # Введенные данные остаются в форме; повторное сохранение перезапишет чужие изменения
+                book.refresh_from_db(fields=['version'])
+                form.data = form.data.copy()
+                form.data['version'] = book.version
+                messages.error(request, 'Книгу уже изменили, пока была открыта форма. '
+                                        'Проверьте данные и сохраните еще раз.')
             except ValidationError as e:
                 messages.error(request, f'Ошибка валидации: {e.message}')
             except Exception as e:
@@ -178,6 +214,7 @@ def download_book(request, pk):
     try:
         response = HttpResponse(book.book_file.read(), content_type='application/octet-stream')
         response['Content-Disposition'] = f'attachment; filename="{book.title}.{book.book_file.name.split(".")[-1]}"'
+        log_user_activity(request.user, 'download_book', 'Book', book.id, f"Скачана книга '{book.title}'", request)
         return response
     except Exception as e:
         messages.error(request, 'Ошибка при скачивании файла.')
@@ -227,10 +264,21 @@ def messages_inbox(request):
 
     context = {
         'page_obj': page_obj,
+        'unread_messages': messages_list.filter(is_read=False).count(),
     }
     return render(request, 'books/messages_inbox.html', context)
 
 
+@login_required
+@require_POST
+def messages_mark_all_read(request):
+    """Отметить все входящие сообщения прочитанными"""
+    marked, unread_count = mark_all_messages_read(request.user, request=request)
+    if marked:
+        messages.success(request, f'Отмечено как прочитанные: {marked}')
+    return redirect('messages_inbox')
+
+
 @login_required
 def message_detail(request, pk):
     """Просмотр сообщения"""
@@ -240,7 +288,7 @@ def message_detail(request, pk):
     if request.user != message.sender and request.user != message.recipient:
         raise Http404
 
-    # Отмечаем сообщение как прочитанное
+    # Отмечаем сообщение как прочитанное (UPDATE только колонки is_read)
     if request.user == message.recipient and not message.is_read:
         message.is_read = True
         message.save()
@@ -263,10 +311,15 @@ def user_profile(request):
 
     # Обработка обновления профиля
     if request.method == 'POST':
-        # Обновляем основную информацию пользователя
-        request.user.first_name = request.POST.get('first_name', '')
-        request.user.last_name = request.POST.get('last_name', '')
-        request.user.save()
+        # Обновляем основную информацию пользователя (только изменившиеся поля)
+        user_fields = []
+        for field in ('first_name', 'last_name'):
+            value = request.POST.get(field, '')
+            if getattr(request.user, field) != value:
+                setattr(request.user, field, value)
+                user_fields.append(field)
+        if user_fields:
+            request.user.save(update_fields=user_fields)
 
         # Обновляем профиль
         profile.bio = request.POST.get('bio', '')
@@ -277,8 +330,13 @@ def user_profile(request):
         if request.FILES.get('avatar'):
             profile.avatar = request.FILES['avatar']
 
+        # UserProfile пишет только изменившиеся поля и без изменений не создает версию истории
+        profile_fields = profile.get_dirty_fields()
         profile.save()
-        messages.success(request, 'Профиль успешно обновлен!')
+        if user_fields or profile_fields:
+            messages.success(request, 'Профиль успешно обновлен!')
+        else:
+            messages.info(request, 'Изменений нет.')
         return redirect('user_profile')
 
     context = {
@@ -321,3 +379,20 @@ def validate_title_ajax(request):
             return JsonResponse({'valid': False, 'message': str(e.message)})
 
     return JsonResponse({'valid': False, 'message': 'Неверный запрос'})
+
+
+def has_health_details_access(request):
+    """Подробности проверки видят сотрудники и запросы с внутренним токеном"""
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    token = settings.HEALTH_CHECK_TOKEN
+    return bool(token) and hmac.compare_digest(request.headers.get('X-Health-Token', ''), token)
+
+
+def health_check(request):
+    """Проверка работоспособности: доступность баз и состояние пула соединений
+
+    Публично - только ok/status, подробности - см. has_health_details_access.
+    """
+    health = get_database_health(detailed=has_health_details_access(request))
+    return JsonResponse(health, status=200 if health['ok'] else 503)
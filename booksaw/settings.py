@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 import dj_database_url
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -17,7 +17,7 @@ ALLOWED_HOSTS = config('ALLOWED_HOSTS', default='localhost,127.0.0.1').split(','
 
 # Application definition
 INSTALLED_APPS = [
-    'django.contrib.admin',
+    'django.contrib.admin.apps.SimpleAdminConfig',  # admin.autodiscover() - в urls.py
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
@@ -32,36 +32,51 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'books.middleware.RequestLogMiddleware',  # Id запроса и журнал запросов
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Для статических файлов
     'corsheaders.middleware.CorsMiddleware',
     'simple_history.middleware.HistoryRequestMiddleware',  # История изменений
+    'books.middleware.ReplicaRoutingMiddleware',  # Чтение из реплик
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'books.middleware.ThrottleMiddleware',  # Ограничение частоты запросов к HTML страницам
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'booksaw.urls'
 
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'books.context_processors.fragment_cache',
+            ],
+            # В продакшене скомпилированные шаблоны хранятся в памяти процесса
+            'loaders': TEMPLATE_LOADERS if DEBUG else [
+                ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
             ],
         },
     },
 ]
 
+# Время жизни закэшированных фрагментов шаблонов (карточки книг, отзывы), секунд
+FRAGMENT_CACHE_TIMEOUT = config('FRAGMENT_CACHE_TIMEOUT', default=3600, cast=int)
+
 WSGI_APPLICATION = 'booksaw.wsgi.application'
 
 # Database - ТОЛЬКО PostgreSQL
@@ -71,10 +86,58 @@ DATABASES = {
     'default': dj_database_url.parse(DATABASE_URL)
 }
 
-DATABASES['default']['CONN_MAX_AGE'] = 60
-DATABASES['default']['OPTIONS'] = {
-    'connect_timeout': 10,
-}
+# Реплики только для чтения, через запятую (postgres://... или sqlite:///... для локальной проверки)
+DATABASE_REPLICA_URLS = config('DATABASE_REPLICA_URLS', default='', cast=Csv())
+DATABASE_REPLICAS = []
+for index, replica_url in enumerate(DATABASE_REPLICA_URLS, start=1):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dj_database_url.parse(replica_url)
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+# Режим подключения: direct - напрямую к PostgreSQL, pgbouncer - через PgBouncer в режиме transaction
+DATABASE_POOL_MODE = config('DATABASE_POOL_MODE', default='direct')
+# Строка подключения к консоли PgBouncer (база pgbouncer) для метрик пула
+PGBOUNCER_ADMIN_URL = config('PGBOUNCER_ADMIN_URL', default='')
+# Токен для подробного ответа /health/ (заголовок X-Health-Token); пустой - подробности только сотрудникам
+HEALTH_CHECK_TOKEN = config('HEALTH_CHECK_TOKEN', default='')
+
+for db_settings in DATABASES.values():
+    db_settings['CONN_MAX_AGE'] = config('CONN_MAX_AGE', default=60, cast=int)
+    db_settings['CONN_HEALTH_CHECKS'] = True  # Проверять постоянное соединение перед запросом
+    if db_settings['ENGINE'] == 'django.db.backends.postgresql':
+        db_settings['OPTIONS'] = {
+            'connect_timeout': 10,
+        }
+        if DATABASE_POOL_MODE == 'pgbouncer':
+            # В режиме transaction серверное соединение не закреплено за клиентом,
+            # поэтому именованные курсоры (server-side cursors) использовать нельзя.
+            # psycopg2 не использует серверные prepared statements, отключать их не нужно.
+            db_settings['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+DATABASE_ROUTERS = ['books.db_router.ReadReplicaRouter']
+
+# Чтение из реплик
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=5, cast=int)  # Чтение из основной базы после записи
+REPLICA_MAX_LAG_SECONDS = config('REPLICA_MAX_LAG_SECONDS', default=10, cast=float)  # Допустимое отставание реплики
+REPLICA_LAG_CHECK_INTERVAL = config('REPLICA_LAG_CHECK_INTERVAL', default=5, cast=float)  # Период проверки отставания
+REPLICA_PIN_COOKIE = 'booksaw_primary'
+
+# Кэш: общий для всех процессов gunicorn через Redis, без REDIS_URL - память процесса
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -140,25 +203,45 @@ if not DEBUG:
     CSRF_COOKIE_SECURE = True
 
 # Настройки логирования
+# В файл пишет отдельный поток (QueueHandler/QueueListener), запрос не ждет диск
+LOG_FILE = config('LOG_FILE', default=str(BASE_DIR / 'django.log'))
+LOG_MAX_BYTES = config('LOG_MAX_BYTES', default=50 * 1024 * 1024, cast=int)  # Ротация файла по размеру
+LOG_BACKUP_COUNT = config('LOG_BACKUP_COUNT', default=5, cast=int)  # Сколько старых файлов хранить
+LOG_QUEUE_SIZE = 10000  # Записей в очереди; при переполнении новые отбрасываются
+LOG_REQUESTS_SAMPLE_RATE = config('LOG_REQUESTS_SAMPLE_RATE', default=1.0, cast=float)  # Доля INFO-записей журнала запросов
+DJANGO_LOG_LEVEL = config('DJANGO_LOG_LEVEL', default='WARNING')
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     'formatters': {
-        'verbose': {
-            'format': '{levelname} {asctime} {module} {process:d} {thread:d} {message}',
-            'style': '{',
+        'json': {
+            '()': 'books.logging_utils.JsonFormatter',
         },
         'simple': {
             'format': '{levelname} {message}',
             'style': '{',
         },
     },
+    'filters': {
+        'request_id': {
+            '()': 'books.logging_utils.RequestIdFilter',
+        },
+        'sample_requests': {
+            '()': 'books.logging_utils.SampleFilter',
+            'rate': LOG_REQUESTS_SAMPLE_RATE,
+        },
+    },
     'handlers': {
         'file': {
+            '()': 'books.logging_utils.queued_file_handler',
             'level': 'INFO',
-            'class': 'logging.FileHandler',
-            'filename': BASE_DIR / 'django.log',
-            'formatter': 'verbose',
+            'filename': LOG_FILE,
+            'max_bytes': LOG_MAX_BYTES,
+            'backup_count': LOG_BACKUP_COUNT,
+            'queue_size': LOG_QUEUE_SIZE,
+            'formatter': 'json',
+            'filters': ['request_id'],
         },
         'console': {
             'level': 'INFO',
@@ -173,7 +256,7 @@ LOGGING = {
     'loggers': {
         'django': {
             'handlers': ['file', 'console'],
-            'level': 'INFO',
+            'level': DJANGO_LOG_LEVEL,
             'propagate': False,
         },
         'django.db.backends': {
@@ -181,6 +264,18 @@ LOGGING = {
             'level': 'DEBUG' if DEBUG else 'INFO',
             'propagate': False,
         },
+        'books': {
+            'handlers': ['file', 'console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        # Строка на каждый запрос - только в файл, с выборкой
+        'books.requests': {
+            'handlers': ['file'],
+            'level': 'INFO',
+            'filters': ['sample_requests'],
+            'propagate': False,
+        },
     },
 }
 
@@ -201,11 +296,39 @@ REST_FRAMEWORK = {
         'rest_framework.filters.OrderingFilter',
     ],
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'books.renderers.ORJSONRenderer',  # orjson, без него - стандартный json
         'rest_framework.renderers.BrowsableAPIRenderer',
     ],
+    'DEFAULT_PARSER_CLASSES': [
+        'books.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'books.throttling.SearchRateThrottle',
+        'books.throttling.ActionRateThrottle',
+    ],
+    # Лимиты: <область>_user - для пользователя, <область>_anon - для анонима по IP
+    'DEFAULT_THROTTLE_RATES': {
+        'search_user': config('THROTTLE_SEARCH_USER', default='60/min'),
+        'search_anon': config('THROTTLE_SEARCH_ANON', default='30/min'),
+        'suggest_user': config('THROTTLE_SUGGEST_USER', default='600/min'),
+        'suggest_anon': config('THROTTLE_SUGGEST_ANON', default='300/min'),
+        'download_user': config('THROTTLE_DOWNLOAD_USER', default='20/min'),
+        'download_anon': config('THROTTLE_DOWNLOAD_ANON', default='5/min'),
+        'message_send_user': config('THROTTLE_MESSAGE_SEND_USER', default='10/min'),
+        'message_send_anon': config('THROTTLE_MESSAGE_SEND_ANON', default='3/min'),
+        'export_user': config('THROTTLE_EXPORT_USER', default='10/hour'),
+        'export_anon': config('THROTTLE_EXPORT_ANON', default='2/hour'),
+    },
 }
 
+# Максимальное число объектов в одном пакетном запросе API (/bulk/, /mark_read_bulk/)
+API_BULK_MAX_ITEMS = config('API_BULK_MAX_ITEMS', default=1000, cast=int)
+
+# Список объектов в админке: начиная с N строк показывается оценка PostgreSQL вместо COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
 # CORS настройки для фронтенда
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -220,3 +343,55 @@ CORS_ALLOW_CREDENTIALS = True
 SIMPLE_HISTORY_HISTORY_ID_USE_UUID = True  # Использовать UUID для ID истории
 SIMPLE_HISTORY_EDIT = True  # Разрешить редактирование истории в админке
 SIMPLE_HISTORY_HISTORY_CHANGE_REASON_USE_TEXT_FIELD = True  # Длинные причины изменений
+
+# Рейтинги и популярность книг (таблица BookScore)
+BOOK_SCORE_PRIOR_WEIGHT = 5  # Сколько "виртуальных" оценок со средним значением добавляется к каждой книге
+BOOK_SCORE_HALF_LIFE_DAYS = 7  # За сколько дней вес события в активности уменьшается вдвое
+BOOK_SCORE_WINDOW_DAYS = 90  # Более старые события в активности не учитываются
+BOOK_SCORE_WEIGHTS = {
+    'review': 3,
+    'message': 2,
+    'download': 1,
+}
+
+# Похожие книги (команда build_similarity_index)
+BOOK_SIMILARITY_TOP_K = 10  # Сколько соседей хранить для каждой книги
+BOOK_SIMILARITY_WEIGHTS = {
+    'genres': 0.3,  # Общие жанры
+    'reviews': 0.4,  # Общие читатели
+    'description': 0.3,  # Похожие описания (TF-IDF)
+}
+
+# Подсказки поиска (/api/v1/search/suggest/)
+SEARCH_SUGGEST_LIMIT = 8  # Сколько подсказок каждого вида возвращать
+SEARCH_SUGGEST_MIN_LENGTH = 2  # Минимальная длина запроса
+SEARCH_SUGGEST_MAX_DEPTH = 30  # Максимальная длина префикса
+SEARCH_SUGGEST_TOP_DEPTH = 3  # Для префиксов до N символов top-N хранится готовым
+SEARCH_SUGGEST_MAX_ITEMS = 100000  # Больше книг - подсказки из БД (~65 МБ на названия при 100k книг в памяти)
+SEARCH_SUGGEST_TTL = 300  # Перестраивать индекс не реже, чем раз в N секунд
+SEARCH_SUGGEST_MIN_REBUILD_SECONDS = 5  # И не чаще, чем раз в N секунд
+
+# Битовый индекс жанров в памяти процесса
+GENRE_INDEX_TTL = 600  # Полная перестройка индекса не реже, чем раз в N секунд
+GENRE_INDEX_MAX_IDS = 1000  # Больше книг в результате - фильтр подзапросом по Book.genres, а не списком id
+
+# Фоновая очередь задач (таблица Job, команда run_worker)
+# Выполнять задачи сразу после коммита, без обработчика; по умолчанию - в режиме отладки,
+# где run_worker обычно не запущен и задачи копились бы в Job
+JOB_QUEUE_EAGER = config('JOB_QUEUE_EAGER', default=DEBUG, cast=bool)
+JOB_QUEUE_MAX_ATTEMPTS = 5  # После стольких неудач задача переносится в DeadJob
+JOB_QUEUE_LEASE_SECONDS = 1800  # Сколько задача считается занятой обработчиком (дольше самой долгой задачи)
+JOB_QUEUE_RETRY_DELAY = 30  # Задержка перед первым повтором, секунд (далее удваивается)
+JOB_WORKER_THREADS = config('JOB_WORKER_THREADS', default=2, cast=int)  # Потоков в одном run_worker
+JOB_WORKER_POLL_INTERVAL = 1.0  # Пауза при пустой очереди, секунд
+
+# Помесячные секции UserActivity и таблиц истории (PostgreSQL, команда manage_partitions)
+PARTITION_PREMAKE_MONTHS = 3  # Создавать секции на столько месяцев вперед
+USER_ACTIVITY_RETENTION_MONTHS = config('USER_ACTIVITY_RETENTION_MONTHS', default=12, cast=int)  # Срок хранения активности (0 - бессрочно)
+HISTORY_RETENTION_MONTHS = config('HISTORY_RETENTION_MONTHS', default=0, cast=int)  # Срок хранения истории изменений (0 - бессрочно)
+
+# Аналитика активности: снимок в колонках NumPy (команда export_analytics, /api/v1/analytics/)
+ANALYTICS_SNAPSHOT_DIR = config('ANALYTICS_SNAPSHOT_DIR', default=str(BASE_DIR / 'analytics'))
+ANALYTICS_EXPORT_LAG = 60  # Не выгружать строки моложе N секунд (незафиксированные транзакции)
+ANALYTICS_EXPORT_CHUNK_ROWS = 500000  # Строк в одном файле снимка
+ANALYTICS_CACHE_TIMEOUT = 3600  # Кэш готовых отчетов, секунд
@@ -3,6 +3,10 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+# Модули admin (и тяжелый import_export с openpyxl) загружаются вместе с URL,
+# а не при django.setup(): команды manage.py и обработчик очереди их не импортируют
+admin.autodiscover()
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('books.urls')),
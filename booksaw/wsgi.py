@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'booksaw.settings')
 
 application = get_wsgi_application()
+
+# Загружаем URL (и admin) сразу: с gunicorn --preload это делается один раз
+# в главном процессе, а не в каждом воркере при первом запросе
+from django.urls import get_resolver  # noqa: E402
+
+get_resolver().url_patterns